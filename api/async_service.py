@@ -0,0 +1,288 @@
+import asyncio
+import os
+from typing import List, Dict, Any, AsyncIterator
+
+from asgiref.sync import sync_to_async
+from dotenv import load_dotenv
+
+from api.dedup import detach_before_add
+from api.fieldsets import FieldSet, build_targets, result_queryset, tag_queryset
+from api.lanes import fast_lane_slots, lanes_enabled, split_lanes
+from api.processes import get_command_timeout, new_container_name, register_process, unregister_process, \
+    terminate_command
+from api.progress import ArchiveLogParser
+from api.read_model import get_read_model
+from api.tag_index import batch_tag_index_invalidation
+from api.planner import planner_enabled, plan_extractors
+from api.service import archivebox_server_enabled, dispatch_deferred_extractors, dispatch_heavy_lane, merge_add_results, prepare_docker_compose, \
+    schedule_crawl
+from api.tiering import rehydrate_before_add
+from api.utils import check_docker_version, check_docker_compose, execute_docker_compose_archivebox_command_async, \
+    run_command_async, success_response, error_response, parse_log, build_add_argv, process_archive_paths, \
+    build_response, process_json_data, save_result, filter_target_queryset, \
+    build_docker_compose_archivebox_argv, get_command_semaphore
+from api.webhooks import notify_add_completed, notify_batch_completed
+
+load_dotenv()
+
+STREAM_LINE_LIMIT = 1024 * 1024
+
+
+async def initialize_archivebox_async() -> Dict[str, Any]:
+    project_dir = os.getenv('PROJECT_DIR')
+
+    docker_version_result = await asyncio.to_thread(check_docker_version)
+    if docker_version_result["status"] != "success":
+        return docker_version_result
+
+    docker_compose_result = await asyncio.to_thread(check_docker_compose)
+    if docker_compose_result["status"] != "success":
+        return docker_compose_result
+
+    prepare_result = await asyncio.to_thread(prepare_docker_compose, project_dir)
+    if prepare_result["status"] != "success":
+        return prepare_result
+
+    init_result = await execute_docker_compose_archivebox_command_async(["init", "--setup"],
+                                                                        timeout=get_command_timeout())
+    if init_result["status"] != "success":
+        return init_result
+    if not archivebox_server_enabled():
+        return success_response("ArchiveBox initialized, server not started.")
+
+    try:
+        returncode, _, stderr = await run_command_async(["docker", "compose", "up", "-d"], cwd=project_dir)
+    except OSError as e:
+        return error_response(f"Failed to start ArchiveBox server: {e}", error=e)
+    if returncode != 0:
+        return error_response(f"Failed to start ArchiveBox server: exit status {returncode}", stderr=stderr)
+    return success_response("ArchiveBox server started successfully.")
+
+
+async def add_url_async(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool,
+                        overwrite: bool, extractors: str, parser: str, plan: bool = None,
+                        callback_url: str = None, lanes: bool = None) -> Dict[str, Any]:
+    """与同步接口的 add_url 相同：plan、lanes 为 None 时分别由 EXTRACTOR_PLANNER_ENABLED、EXTRACTOR_LANES_ENABLED 决定"""
+    if lanes_enabled() if lanes is None else lanes:
+        fast, heavy = split_lanes(extractors)
+        if fast:
+            # 快速通道的结果入库后立即返回，重量级提取器交给慢速通道的任务；
+            # 与同步接口共用 FAST_LANE_WORKERS 的并发限制，在线程中等待，不阻塞事件循环
+            slots = fast_lane_slots()
+            await asyncio.to_thread(slots.acquire)
+            try:
+                result = await add_url_async(urls, tags, depth, update, update_all, overwrite, fast, parser,
+                                             plan=plan, lanes=False)
+            finally:
+                slots.release()
+            job = await sync_to_async(dispatch_heavy_lane, thread_sensitive=False)(
+                urls, result, tags, overwrite, heavy, plan, callback_url=callback_url)
+            result['lanes'] = {'fast': fast, 'heavy': heavy, 'heavy_job': str(job.id) if job else None}
+            if job is None:
+                await sync_to_async(notify_batch_completed, thread_sensitive=False)(callback_url, urls, result)
+            return result
+    await sync_to_async(rehydrate_before_add, thread_sensitive=False)(urls, update, update_all, overwrite)
+    await sync_to_async(detach_before_add, thread_sensitive=False)(urls, update, update_all, overwrite)
+    if not (planner_enabled() if plan is None else plan):
+        result = await run_add_command_async(urls, tags, depth, update, update_all, overwrite, extractors, parser)
+        await sync_to_async(notify_add_completed, thread_sensitive=False)(urls, result, callback_url)
+        return result
+
+    # 规划需要读取各域名的历史结果，放到线程中执行
+    extraction_plan = await sync_to_async(plan_extractors, thread_sensitive=False)(urls, extractors)
+    groups = extraction_plan['groups']
+    results = [await run_add_command_async(group['urls'], tags, depth, update, update_all, overwrite,
+                                           group['extractors'], parser) for group in groups]
+    result = results[0] if len(results) == 1 else merge_add_results(urls, results)
+    result['plan'] = {
+        'decisions': extraction_plan['decisions'],
+        'deferred_jobs': await sync_to_async(dispatch_deferred_extractors, thread_sensitive=False)(
+            groups, results, tags),
+    }
+    await sync_to_async(notify_add_completed, thread_sensitive=False)(urls, result, callback_url)
+    return result
+
+
+async def run_add_command_async(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool,
+                                overwrite: bool, extractors: str, parser: str) -> Dict[str, Any]:
+    # URL 通过标准输入传入，既不经过 shell 也不受命令行长度限制
+    command_args = build_add_argv([], tags, depth, update, update_all, overwrite, extractors, parser)
+    result = await execute_docker_compose_archivebox_command_async(command_args, stdin="\n".join(urls) + "\n",
+                                                                   timeout=get_command_timeout(len(urls)))
+    if result["status"] == "error":
+        return result
+
+    archive_result = parse_log(result["stdout"], urls)
+    if archive_result["status"] == "error":
+        return archive_result
+
+    project_dir = os.getenv('PROJECT_DIR')
+    data_dir = os.path.join(project_dir, "data")
+
+    # 入库逻辑与同步接口共用，放到线程中执行，不阻塞事件循环
+    url_archive_paths, crawl_status = await sync_to_async(process_archive_paths, thread_sensitive=False)(
+        archive_result["data"], data_dir, tags, update or overwrite)
+
+    return build_response(urls, url_archive_paths, crawl_status)
+
+
+async def crawl_urls_async(urls: List[str], tags: List[str], update: bool, overwrite: bool, extractors: str,
+                           parser: str, plan: bool = None, callback_url: str = None) -> Dict[str, Any]:
+    """与同步接口的 crawl_urls 相同：先以 depth=0 存档种子页面，再为页面中的新链接创建任务"""
+    result = await add_url_async(urls, tags, 0, update, False, overwrite, extractors, parser, plan=plan,
+                                 callback_url=callback_url, lanes=False)
+    result['crawl'] = await schedule_crawl_async(list(result.get('archive_paths', {})), extractors, plan)
+    return result
+
+
+async def schedule_crawl_async(seed_urls: List[str], extractors: str, plan: bool = None) -> Dict[str, Any]:
+    # 读取种子页面和创建任务都是阻塞操作，放到线程中执行
+    return await sync_to_async(schedule_crawl, thread_sensitive=False)(seed_urls, extractors, plan)
+
+
+async def add_url_events(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool,
+                         overwrite: bool, extractors: str, parser: str,
+                         callback_url: str = None) -> AsyncIterator[Dict[str, Any]]:
+    """执行 add 并在读取 ArchiveBox 输出的同时产生进度事件，每个快照完成后立即入库；
+    所有提取器在同一条命令中执行，不使用规划和快慢通道，结束后向 callback_url 发送通知"""
+    await sync_to_async(rehydrate_before_add, thread_sensitive=False)(urls, update, update_all, overwrite)
+    await sync_to_async(detach_before_add, thread_sensitive=False)(urls, update, update_all, overwrite)
+    project_dir = os.getenv('PROJECT_DIR')
+    data_dir = os.path.join(project_dir, "data")
+    command_args = build_add_argv([], tags, depth, update, update_all, overwrite, extractors, parser)
+    container_name = new_container_name()
+    # 关闭容器内 Python 的输出缓冲，否则要等命令结束才能读到日志
+    argv = build_docker_compose_archivebox_argv(command_args, stdin=True, env={'PYTHONUNBUFFERED': '1'},
+                                                container_name=container_name)
+    timeout = get_command_timeout(len(urls))
+    log_parser = ArchiveLogParser(urls)
+    ingest = sync_to_async(process_archive_paths, thread_sensitive=False)
+    url_archive_paths = {}
+    crawl_status = {}
+
+    async def handle(events):
+        for event in events:
+            yield event
+            if event['event'] == 'snapshot_finished' and event['archive_path']:
+                paths, status = await ingest([{'url': event['url'], 'archive_path': event['archive_path']}],
+                                             data_dir, tags, update or overwrite)
+                url_archive_paths.update(paths)
+                crawl_status.update(status)
+                yield {'event': 'url_finished', 'url': event['url'], 'crawl_status': status.get(event['url']),
+                       'archive_paths': paths.get(event['url'], {})}
+
+    loop = asyncio.get_running_loop()
+    yield {'event': 'queued', 'urls': urls}
+    async with get_command_semaphore():
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *argv,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=project_dir,
+                limit=STREAM_LINE_LIMIT,
+                start_new_session=True
+            )
+        except OSError as e:
+            yield {'event': 'completed', **error_response(f"Failed to execute command '{' '.join(argv)}': {e}",
+                                                          error=e)}
+            return
+
+        register_process(process.pid, container_name)
+        deadline = loop.time() + timeout if timeout else None
+        timed_out = False
+        try:
+            stderr_task = asyncio.create_task(process.stderr.read())
+            process.stdin.write(("\n".join(urls) + "\n").encode('utf-8'))
+            await process.stdin.drain()
+            process.stdin.close()
+
+            while True:
+                remaining = deadline - loop.time() if deadline else None
+                try:
+                    raw_line = await asyncio.wait_for(process.stdout.readline(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    await asyncio.to_thread(terminate_command, process.pid, container_name)
+                    break
+                if not raw_line:
+                    break
+                async for event in handle(log_parser.feed(raw_line.decode('utf-8', errors='replace'))):
+                    yield event
+            if not timed_out:
+                async for event in handle(log_parser.close()):
+                    yield event
+
+            returncode = await process.wait()
+            stderr = (await stderr_task).decode('utf-8', errors='replace')
+        finally:
+            unregister_process(process.pid)
+            # 客户端断开连接时生成器会被关闭，此时结束仍在运行的命令
+            if process.returncode is None:
+                await asyncio.to_thread(terminate_command, process.pid, container_name)
+
+    if timed_out:
+        result = error_response(f"Command '{' '.join(argv)}' timed out after {timeout} seconds.",
+                                crawl_status=crawl_status, archive_paths=url_archive_paths)
+    elif returncode != 0 and not crawl_status:
+        result = error_response(f"Failed to execute command '{' '.join(argv)}': exit status {returncode}",
+                                stderr=stderr)
+    elif not crawl_status:
+        result = error_response(
+            "The requested target already exists. If you want to update it, please add the update parameter.")
+    else:
+        result = build_response(urls, url_archive_paths, crawl_status)
+    await sync_to_async(notify_add_completed, thread_sensitive=False)(urls, result, callback_url)
+    yield {'event': 'completed', **result}
+
+
+def _list_index_files(archive_dir: str) -> List[str]:
+    paths = (os.path.join(archive_dir, folder_name, 'index.json') for folder_name in os.listdir(archive_dir))
+    return [path for path in paths if os.path.exists(path)]
+
+
+def _synchronize_folders(index_file_paths: List[str]) -> None:
+    # 与同步接口相同，整批入库最多递增一次标签索引的版本号
+    with batch_tag_index_invalidation():
+        for index_file_path in index_file_paths:
+            save_result(process_json_data(index_file_path))
+
+
+async def synchronize_local_data_async() -> Dict[str, Any]:
+    project_dir = os.getenv('PROJECT_DIR')
+    if not project_dir:
+        return error_response("PROJECT_DIR environment variable not set.")
+
+    archive_dir = os.path.join(project_dir, "data", "archive")
+
+    if not os.path.exists(archive_dir):
+        return error_response(f"{archive_dir} does not exist.")
+
+    index_file_paths = await asyncio.to_thread(_list_index_files, archive_dir)
+    await sync_to_async(_synchronize_folders, thread_sensitive=False)(index_file_paths)
+
+    return success_response("Synchronization successful!")
+
+
+async def filter_targets_async(data: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        fieldset = FieldSet.parse(data.get('fields'))
+        model = get_read_model()
+        if model is not None:
+            # 筛选需要持有读模型的锁，与变更日志的应用互斥，放到线程中执行，不阻塞事件循环
+            targets = await sync_to_async(model.filter_targets, thread_sensitive=False)(data, fieldset)
+            return success_response("Targets fetched successfully", targets=targets)
+        # 标签表达式可能需要读取索引版本，放到线程中构建查询
+        targets = await sync_to_async(filter_target_queryset, thread_sensitive=False)(data)
+
+        result_rows = []
+        if fieldset.result:
+            results = result_queryset(targets, fieldset, data.get('extractors', []), data.get('latest_only', False))
+            result_rows = [row async for row in results]
+        tag_rows = [row async for row in tag_queryset(targets)] if 'tags' in fieldset.target else []
+        target_rows = [row async for row in targets.values_list(*fieldset.target_columns)]
+        serialized_targets = build_targets(target_rows, result_rows, tag_rows, fieldset)
+        return success_response("Targets fetched successfully", targets=serialized_targets)
+    except Exception as e:
+        return error_response("An error occurred while fetching targets", error=e)
@@ -0,0 +1,160 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+
+from . import async_service
+from .progress import format_sse
+from .serializers import AddUrlsSerializer, FilterTargetsSerializer
+from .utils import error_response
+
+
+def parse_json_body(request):
+    try:
+        return json.loads(request.body or b"{}"), None
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        return None, JsonResponse(error_response("Invalid JSON body.", error=e), status=status.HTTP_400_BAD_REQUEST)
+
+
+async def validate_async(serializer):
+    # callback_url 的校验会解析域名，放到线程中执行，不阻塞事件循环
+    return await sync_to_async(serializer.is_valid, thread_sensitive=False)()
+
+
+def method_not_allowed():
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@csrf_exempt
+async def init_project(request):
+    if request.method == 'GET':
+        result = await async_service.initialize_archivebox_async()
+
+        if result["status"] == "success":
+            return JsonResponse(result, status=status.HTTP_200_OK)
+        else:
+            return JsonResponse(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    else:
+        return method_not_allowed()
+
+
+@csrf_exempt
+async def add_urls(request):
+    if request.method == 'POST':
+        payload, error = parse_json_body(request)
+        if error:
+            return error
+        serializer = AddUrlsSerializer(data=payload)
+        if await validate_async(serializer):
+            data = serializer.validated_data
+            if data.get('fan_out'):
+                result = await async_service.crawl_urls_async(
+                    data.get('urls'),
+                    data.get('tag'),
+                    data.get('update', False),
+                    data.get('overwrite', False),
+                    data.get('extractors'),
+                    data.get('parser', 'auto'),
+                    plan=data.get('plan'),
+                    callback_url=data.get('callback_url')
+                )
+                return handle_response(result)
+            result = await async_service.add_url_async(
+                data.get('urls'),
+                data.get('tag'),
+                data.get('depth', 0),
+                data.get('update', False),
+                data.get('update_all', False),
+                data.get('overwrite', False),
+                data.get('extractors'),
+                data.get('parser', 'auto'),
+                plan=data.get('plan'),
+                callback_url=data.get('callback_url'),
+                lanes=data.get('lanes')
+            )
+            return handle_response(result)
+        else:
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return method_not_allowed()
+
+
+@csrf_exempt
+async def add_urls_stream(request):
+    if request.method == 'POST':
+        payload, error = parse_json_body(request)
+        if error:
+            return error
+        serializer = AddUrlsSerializer(data=payload)
+        if await validate_async(serializer):
+            data = serializer.validated_data
+            # 流式接口在一条命令中执行所有提取器，不支持规划、快慢通道和拆分模式
+            unsupported = [name for name in ('plan', 'lanes', 'fan_out') if data.get(name)]
+            if unsupported:
+                return JsonResponse(error_response(f"Options not supported when streaming: {', '.join(unsupported)}."),
+                                    status=status.HTTP_400_BAD_REQUEST)
+            events = async_service.add_url_events(
+                data.get('urls'),
+                data.get('tag'),
+                data.get('depth', 0),
+                data.get('update', False),
+                data.get('update_all', False),
+                data.get('overwrite', False),
+                data.get('extractors'),
+                data.get('parser', 'auto'),
+                callback_url=data.get('callback_url')
+            )
+
+            async def stream():
+                async for event in events:
+                    yield format_sse(event)
+
+            response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+        else:
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return method_not_allowed()
+
+
+@csrf_exempt
+async def synchronization(request):
+    if request.method == 'GET':
+        result = await async_service.synchronize_local_data_async()
+
+        if result["status"] == "success":
+            return JsonResponse(result, status=status.HTTP_200_OK)
+        else:
+            return JsonResponse(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    else:
+        return method_not_allowed()
+
+
+@csrf_exempt
+async def list_target(request):
+    if request.method == 'POST':
+        payload, error = parse_json_body(request)
+        if error:
+            return error
+        serializer = FilterTargetsSerializer(data=payload)
+        if serializer.is_valid():
+            result = await async_service.filter_targets_async(serializer.validated_data)
+            return handle_response(result)
+        else:
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return method_not_allowed()
+
+
+def handle_response(result):
+    if result["status"] == "success":
+        return JsonResponse(result, status=status.HTTP_200_OK)
+    elif result["status"] == "partial_success":
+        return JsonResponse(result, status=status.HTTP_207_MULTI_STATUS)
+    else:
+        return JsonResponse(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,79 @@
+import gzip
+import os
+import re
+from typing import Dict, Optional
+
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖，未安装时只使用 gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """解析 Accept-Encoding，返回编码及其 q 值"""
+    encodings = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    """客户端同时接受时优先使用 brotli，q 值相同时 brotli 压缩率更高"""
+    encodings = parse_accept_encoding(header)
+    wildcard = encodings.get('*', 0.0)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = None
+    best_quality = 0.0
+    for name in candidates:
+        quality = encodings.get(name, wildcard)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(content, quality=int(os.getenv('BROTLI_QUALITY', '5')))
+    return gzip.compress(content, compresslevel=int(os.getenv('GZIP_LEVEL', '6')), mtime=0)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """按 Accept-Encoding 压缩 JSON 和文本响应；流式响应（如 export）不在这里处理"""
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < int(os.getenv('COMPRESSION_MIN_SIZE', '1024')):
+            return response
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        return response
@@ -0,0 +1,157 @@
+import os
+from collections import Counter
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional
+from urllib.parse import urldefrag, urljoin, urlparse
+
+from django.db.models import Sum
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.models import Job, JobChunk, Result, Tagging, Target
+from api.stats import snapshot_output_path
+from api.tiering import BundleError, open_snapshot_file
+from api.utils import format_snapshot_timestamp
+
+load_dotenv()
+
+# 按顺序选择用于提取链接的 HTML 输出：dom 是渲染后的页面，包含脚本生成的链接
+HTML_EXTRACTORS = ('dom', 'singlefile', 'wget')
+EXISTING_URL_BATCH = 500
+
+
+def get_crawl_max_links() -> int:
+    return int(os.getenv('CRAWL_MAX_LINKS', '500'))
+
+
+def get_crawl_links_per_job() -> int:
+    return int(os.getenv('CRAWL_LINKS_PER_JOB', '1'))
+
+
+class LinkParser(HTMLParser):
+    """收集页面中 a 和 area 标签的 href，以及 base 标签指定的基准地址"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.base = None
+        self.hrefs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ('a', 'area', 'base'):
+            return
+        href = dict(attrs).get('href')
+        if not href:
+            return
+        if tag == 'base':
+            if self.base is None:
+                self.base = href.strip()
+        else:
+            self.hrefs.append(href.strip())
+
+
+def extract_outlinks(html: str, base_url: str) -> List[str]:
+    """返回页面中指向其他 http(s) 页面的绝对地址，去掉锚点并保持出现顺序"""
+    parser = LinkParser()
+    parser.feed(html)
+    parser.close()
+    base = urljoin(base_url, parser.base) if parser.base else base_url
+    seen = {urldefrag(base_url)[0]}
+    links = []
+    for href in parser.hrefs:
+        try:
+            url = urldefrag(urljoin(base, href))[0]
+            parsed = urlparse(url)
+        except ValueError:
+            continue
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc or url in seen:
+            continue
+        seen.add(url)
+        links.append(url)
+    return links
+
+
+def read_snapshot_html(target: Target) -> Optional[str]:
+    """读取目标最近一次快照中存档的 HTML，快照已转入冷存储时从压缩包中读取"""
+    name = format_snapshot_timestamp(target.timestamp)
+    outputs = dict(Result.objects.filter(target_id=target, timestamp=target.timestamp, status=True,
+                                         extractor__in=HTML_EXTRACTORS).values_list('extractor', 'output'))
+    for extractor in HTML_EXTRACTORS:
+        output = snapshot_output_path(outputs.get(extractor))
+        if not output or '://' in output:
+            continue
+        try:
+            file = open_snapshot_file(name, os.path.normpath(output).replace(os.sep, '/'))
+            if file is None:
+                continue
+            if 'path' in file:
+                with open(file['path'], 'rb') as f:
+                    data = f.read()
+            else:
+                data = file['content'] if 'content' in file else b''.join(file['stream'])
+        except (OSError, BundleError):
+            continue
+        return data.decode('utf-8', errors='replace')
+    return None
+
+
+def existing_urls(urls: List[str]) -> set:
+    existing = set()
+    for start in range(0, len(urls), EXISTING_URL_BATCH):
+        existing.update(Target.objects.filter(url__in=urls[start:start + EXISTING_URL_BATCH])
+                        .values_list('url', flat=True))
+    return existing
+
+
+def collect_crawl_links(seed_urls: List[str], max_links: int = None) -> Dict[str, Any]:
+    """从种子页面的存档中提取链接，去掉已经存档过的 URL 和其他种子中重复的链接，
+    每个种子的链接继承该种子的标签"""
+    max_links = get_crawl_max_links() if max_links is None else max_links
+    seen = set(seed_urls)
+    seeds = []
+    for url in seed_urls:
+        target = Target.objects.filter(url=url).order_by('-timestamp').first()
+        html = read_snapshot_html(target) if target else None
+        if html is None:
+            seeds.append({'url': url, 'status': 'no_html', 'found': 0, 'links': [], 'tags': []})
+            continue
+        found = [link for link in extract_outlinks(html, url) if link not in seen]
+        existing = existing_urls(found)
+        links = [link for link in found if link not in existing][:max_links]
+        seen.update(found)
+        tags = sorted(Tagging.objects.filter(target_id=target).values_list('tag_id__name', flat=True))
+        seeds.append({'url': url, 'status': 'ok', 'found': len(found), 'existing': len(existing),
+                      'links': links, 'tags': tags})
+    return {'seeds': seeds, 'links': sum(len(seed['links']) for seed in seeds)}
+
+
+def crawl_failed_urls(job: Job) -> List[str]:
+    failed = []
+    for chunk in JobChunk.objects.filter(job_id__parent_id=job, status__in=['failed', 'partial_success']):
+        urls = chunk.result.get('failed_urls')
+        failed.extend(urls if urls else chunk.urls.split("\n") if chunk.status == 'failed' else [])
+    return failed
+
+
+def refresh_crawl_job(job: Job) -> Job:
+    """crawl 任务本身不执行命令，查询时根据各子任务的进度汇总进度、状态和失败的 URL"""
+    if job.kind != 'crawl' or job.status not in ('pending', 'running'):
+        return job
+    children = Job.objects.filter(parent_id=job)
+    totals = children.aggregate(processed=Sum('processed'), failed=Sum('failed'))
+    statuses = Counter(children.values_list('status', flat=True))
+    fields = {'processed': totals['processed'] or 0, 'failed': totals['failed'] or 0, 'updated_at': timezone.now()}
+    result = {**job.result, 'jobs': dict(statuses), 'succeeded': fields['processed'] - fields['failed'],
+              'failed_urls': crawl_failed_urls(job)}
+    if not statuses['pending'] and not statuses['running']:
+        finished = statuses['succeeded'] + statuses['partial_success']
+        if finished and (statuses['failed'] or statuses['partial_success']):
+            fields['status'], result['message'] = 'partial_success', "Crawl finished with some failed links."
+        elif finished or not statuses:
+            fields['status'], result['message'] = 'succeeded', "Crawl finished successfully."
+        elif statuses['cancelled'] == sum(statuses.values()):
+            fields['status'], result['message'] = 'cancelled', "Crawl cancelled."
+        else:
+            fields['status'], result['message'] = 'failed', "All crawl jobs failed."
+    Job.objects.filter(id=job.id, status__in=['pending', 'running']).update(result=result, **fields)
+    job.refresh_from_db()
+    return job
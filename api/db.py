@@ -0,0 +1,15 @@
+from django.db.backends.signals import connection_created
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """新建 SQLite 连接时设置 WAL 等参数，减少并发读写时的 database is locked"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('SQLITE_PRAGMAS') or {}
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value};")
+
+
+def connect_signals():
+    connection_created.connect(configure_sqlite, dispatch_uid='api.db.configure_sqlite')
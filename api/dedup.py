@@ -0,0 +1,275 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.models import ArchiveFile, Result, Target
+from api.utils import format_snapshot_timestamp
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# ArchiveBox 每次运行都会重写的索引文件，不参与去重
+SKIP_FILE_NAMES = {'index.json', 'index.html'}
+TMP_SUFFIX = '.dedup-tmp'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 等待去重的快照目录及其最近一次入库的时间，由本进程的后台线程处理
+_pending: Dict[str, float] = {}
+_pending_lock = threading.Lock()
+
+
+def get_archive_dir() -> str:
+    return os.path.join(os.getenv('PROJECT_DIR', ''), 'data', 'archive')
+
+
+def get_dedup_min_size() -> int:
+    return int(os.getenv('DEDUP_MIN_SIZE', '1'))
+
+
+def get_dedup_min_age() -> float:
+    return float(os.getenv('DEDUP_MIN_AGE', '300'))
+
+
+def get_dedup_interval() -> float:
+    return float(os.getenv('DEDUP_INTERVAL', '60'))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _same_file_state(st: os.stat_result, other: os.stat_result) -> bool:
+    return (st.st_ino, st.st_size, st.st_mtime_ns) == (other.st_ino, other.st_size, other.st_mtime_ns)
+
+
+def _iter_files(snapshot_dir: str) -> Iterable[os.DirEntry]:
+    stack = [snapshot_dir]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def _find_canonical(archive_dir: str, rel_path: str, sha256: str, size: int) -> Optional[ArchiveFile]:
+    """找到内容相同、且自入库后没有被修改过的文件作为硬链接的源文件"""
+    candidates = ArchiveFile.objects.filter(sha256=sha256, size=size).exclude(path=rel_path).order_by('created_at')
+    for candidate in candidates:
+        try:
+            st = os.stat(os.path.join(archive_dir, candidate.path))
+        except FileNotFoundError:
+            candidate.delete()
+            continue
+        if (st.st_ino, st.st_size, st.st_mtime_ns) == (candidate.inode, candidate.size, candidate.mtime_ns):
+            return candidate
+    return None
+
+
+def save_archive_file(rel_path: str, st: os.stat_result, sha256: str) -> None:
+    # 不使用 update_or_create：它在事务中先 SELECT ... FOR UPDATE 再写入，SQLite 并发入库时会直接报 database is locked
+    fields = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino, 'sha256': sha256,
+              'updated_at': timezone.now()}
+    if ArchiveFile.objects.filter(path=rel_path).update(**fields):
+        return
+    try:
+        with transaction.atomic():
+            ArchiveFile.objects.create(path=rel_path, **fields)
+    except IntegrityError:
+        ArchiveFile.objects.filter(path=rel_path).update(**fields)
+
+
+def replace_with_link(source: str, path: str, expected: os.stat_result) -> bool:
+    """先在同一目录创建硬链接再原子替换，替换前确认文件没有被 ArchiveBox 改写"""
+    tmp_path = path + TMP_SUFFIX
+    try:
+        os.link(source, tmp_path)
+    except FileExistsError:
+        os.unlink(tmp_path)
+        os.link(source, tmp_path)
+    try:
+        if not _same_file_state(os.stat(path), expected):
+            os.unlink(tmp_path)
+            return False
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return True
+
+
+def dedup_snapshot(snapshot_dir: str, archive_dir: str = None, min_age: float = None,
+                   now: float = None) -> Dict[str, int]:
+    """对单个快照目录去重，只处理与索引记录相比有变化的文件，重复内容替换为硬链接"""
+    archive_dir = archive_dir or get_archive_dir()
+    min_age = get_dedup_min_age() if min_age is None else min_age
+    min_size = get_dedup_min_size()
+    now = now or time.time()
+    stats = {'scanned': 0, 'hashed': 0, 'linked': 0, 'bytes_reclaimed': 0, 'skipped': 0}
+
+    prefix = os.path.relpath(snapshot_dir, archive_dir) + os.sep
+    indexed = {item.path: item for item in ArchiveFile.objects.filter(path__startswith=prefix)}
+    seen = set()
+
+    for entry in _iter_files(snapshot_dir):
+        if entry.name in SKIP_FILE_NAMES or entry.name.endswith(TMP_SUFFIX):
+            continue
+        rel_path = os.path.relpath(entry.path, archive_dir)
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        seen.add(rel_path)
+        stats['scanned'] += 1
+        record = indexed.get(rel_path)
+        if record and (record.inode, record.size, record.mtime_ns) == (st.st_ino, st.st_size, st.st_mtime_ns):
+            continue
+        # 最近修改过的文件可能仍在写入，留到下一次再处理
+        if st.st_size < min_size or now - st.st_mtime < min_age:
+            stats['skipped'] += 1
+            continue
+
+        try:
+            sha256 = file_sha256(entry.path)
+            if not _same_file_state(os.stat(entry.path), st):
+                stats['skipped'] += 1
+                continue
+            stats['hashed'] += 1
+
+            canonical = _find_canonical(archive_dir, rel_path, sha256, st.st_size)
+            if canonical and canonical.inode != st.st_ino:
+                if replace_with_link(os.path.join(archive_dir, canonical.path), entry.path, st):
+                    stats['linked'] += 1
+                    # 原文件没有其他链接时，其占用的空间被释放
+                    if st.st_nlink == 1:
+                        stats['bytes_reclaimed'] += st.st_size
+                    st = os.stat(entry.path)
+                else:
+                    stats['skipped'] += 1
+                    continue
+        except OSError as e:
+            logger.warning("Failed to deduplicate %s: %s", entry.path, e)
+            stats['skipped'] += 1
+            continue
+
+        save_archive_file(rel_path, st, sha256)
+
+    stale = [path for path in indexed if path not in seen]
+    if stale:
+        ArchiveFile.objects.filter(path__in=stale).delete()
+    return stats
+
+
+def dedup_archive(timestamps: List[str] = None, min_age: float = None) -> Dict[str, Any]:
+    """批量去重 data/archive 下的快照，timestamps 为空时处理全部快照"""
+    archive_dir = get_archive_dir()
+    totals = {'snapshots': 0, 'scanned': 0, 'hashed': 0, 'linked': 0, 'bytes_reclaimed': 0, 'skipped': 0}
+    if timestamps:
+        snapshot_dirs = [os.path.join(archive_dir, str(timestamp)) for timestamp in timestamps]
+    else:
+        snapshot_dirs = sorted(entry.path for entry in os.scandir(archive_dir) if entry.is_dir(follow_symlinks=False))
+
+    now = time.time()
+    for snapshot_dir in snapshot_dirs:
+        if not os.path.isdir(snapshot_dir):
+            continue
+        stats = dedup_snapshot(snapshot_dir, archive_dir, min_age, now)
+        totals['snapshots'] += 1
+        for key, value in stats.items():
+            totals[key] += value
+    return totals
+
+
+def detach_file(path: str) -> None:
+    """把硬链接的文件替换为独立的副本"""
+    tmp_path = path + TMP_SUFFIX
+    shutil.copy2(path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def queue_dedup(snapshot_dir: str) -> None:
+    """入库后不在请求中去重：快照可能仍在被写入（例如慢速通道补跑提取器），
+    由后台线程在快照超过 DEDUP_MIN_AGE 秒没有再次入库后处理"""
+    with _pending_lock:
+        _pending[snapshot_dir] = time.time()
+    from api.jobs import start_periodic_task
+    start_periodic_task('dedup', dedup_pending, get_dedup_interval())
+
+
+def dedup_pending(now: float = None) -> Dict[str, int]:
+    """对等待时间超过 DEDUP_MIN_AGE 的快照去重，最近修改过的文件仍会被 dedup_snapshot 跳过"""
+    now = now or time.time()
+    min_age = get_dedup_min_age()
+    with _pending_lock:
+        ready = [snapshot_dir for snapshot_dir, queued_at in _pending.items() if now - queued_at >= min_age]
+        for snapshot_dir in ready:
+            del _pending[snapshot_dir]
+    totals = {'snapshots': 0, 'scanned': 0, 'hashed': 0, 'linked': 0, 'bytes_reclaimed': 0, 'skipped': 0}
+    for snapshot_dir in ready:
+        if not os.path.isdir(snapshot_dir):
+            continue
+        stats = dedup_snapshot(snapshot_dir, min_age=min_age, now=now)
+        totals['snapshots'] += 1
+        for key, value in stats.items():
+            totals[key] += value
+    return totals
+
+
+def detach_snapshot_dir(snapshot_dir: str) -> int:
+    detached = 0
+    for entry in _iter_files(snapshot_dir):
+        try:
+            if entry.stat(follow_symlinks=False).st_nlink > 1:
+                detach_file(entry.path)
+                detached += 1
+        except OSError as e:
+            logger.warning("Failed to detach %s: %s", entry.path, e)
+    return detached
+
+
+def detach_snapshot_links(urls: List[str]) -> int:
+    """ArchiveBox 重新存档时会原地改写输出文件，改写前先解除硬链接，避免影响其他快照"""
+    return _detach_timestamps(Target.objects.filter(url__in=urls).values_list('timestamp', flat=True))
+
+
+def _detach_timestamps(timestamps: Iterable[float]) -> int:
+    archive_dir = get_archive_dir()
+    return sum(detach_snapshot_dir(os.path.join(archive_dir, format_snapshot_timestamp(timestamp)))
+               for timestamp in set(timestamps))
+
+
+def detach_before_add(urls: List[str], update: bool, update_all: bool, overwrite: bool) -> int:
+    """update、update_all、overwrite 都会让 ArchiveBox 改写已有的快照，执行前只解除会被改写的快照中的硬链接。
+    update_all 不带 overwrite 时 ArchiveBox 只重新执行失败的提取器，成功的输出不会被改写，
+    因此只处理本次的 URL 和存在失败结果的快照，其他快照保持去重"""
+    if update_all and overwrite:
+        archive_dir = get_archive_dir()
+        if not os.path.isdir(archive_dir):
+            return 0
+        return sum(detach_snapshot_dir(entry.path) for entry in os.scandir(archive_dir)
+                   if entry.is_dir(follow_symlinks=False))
+    if update_all:
+        failed = Result.objects.filter(status=False).values_list('target_id__timestamp', flat=True).distinct()
+        return _detach_timestamps(list(Target.objects.filter(url__in=urls).values_list('timestamp', flat=True))
+                                  + list(failed))
+    if update or overwrite:
+        return detach_snapshot_links(urls)
+    return 0
@@ -0,0 +1,158 @@
+import csv
+import json
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q, QuerySet
+
+from api.models import Result, Tagging
+from api.utils import apply_target_filters
+
+EXPORT_CHUNK_SIZE = 2000
+
+_END = object()
+
+EXPORT_FIELDS = {
+    'targets': ['id', 'url', 'domain', 'timestamp', 'created_at', 'updated_at'],
+    'results': ['id', 'target_id', 'target_id__url', 'extractor', 'status', 'output', 'timestamp', 'start_ts',
+                'end_ts', 'created_at', 'updated_at'],
+    'tags': ['id', 'target_id', 'target_id__url', 'tag_id__name', 'created_at', 'updated_at'],
+}
+
+# 导出列名，去掉 ORM 的关联查询写法
+EXPORT_COLUMNS = {
+    'targets': ['id', 'url', 'domain', 'timestamp', 'created_at', 'updated_at'],
+    'results': ['id', 'target_id', 'url', 'extractor', 'status', 'output', 'timestamp', 'start_ts', 'end_ts',
+                'created_at', 'updated_at'],
+    'tags': ['id', 'target_id', 'url', 'tag', 'created_at', 'updated_at'],
+}
+
+
+class _Echo:
+    """csv.writer 需要一个带 write 方法的对象，这里直接把写入的行返回"""
+
+    @staticmethod
+    def write(value: str) -> str:
+        return value
+
+
+def build_export_queryset(entity: str, data: Dict[str, Any], since: Optional[datetime] = None,
+                          since_id: Optional[UUID] = None) -> QuerySet:
+    """since 为上次导出的最后一条记录的 updated_at，只导出之后的记录；同时传入该记录的 id 时以 (updated_at, id)
+    为游标，updated_at 相同但排在其后的记录也会导出，边界上的记录不会重复"""
+    targets, has_target_filter = apply_target_filters(data)
+
+    if entity == 'targets':
+        queryset = targets
+    elif entity == 'results':
+        queryset = Result.objects.all()
+        if has_target_filter:
+            queryset = queryset.filter(target_id__in=targets.values('id'))
+        extractors = data.get('extractors', [])
+        if extractors:
+            queryset = queryset.filter(extractor__in=extractors)
+    elif entity == 'tags':
+        queryset = Tagging.objects.all()
+        if has_target_filter:
+            queryset = queryset.filter(target_id__in=targets.values('id'))
+    else:
+        raise ValueError(f"Unknown export entity '{entity}'.")
+
+    if since and since_id:
+        queryset = queryset.filter(Q(updated_at__gt=since) | Q(updated_at=since, id__gt=since_id))
+    elif since:
+        queryset = queryset.filter(updated_at__gt=since)
+
+    # 按 updated_at 排序，便于下游记录上次导出的位置做增量导出
+    return queryset.order_by('updated_at', 'id').values_list(*EXPORT_FIELDS[entity])
+
+
+def iter_export_rows(entity: str, data: Dict[str, Any], since: Optional[datetime] = None,
+                     chunk_size: int = EXPORT_CHUNK_SIZE, since_id: Optional[UUID] = None) -> Iterator[tuple]:
+    queryset = build_export_queryset(entity, data, since, since_id)
+    # iterator() 在 PostgreSQL 上使用服务端游标，内存占用与数据量无关
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def _export_value(value: Any) -> Any:
+    # 保留微秒精度，下游用最后一条的 updated_at 和 id 作为下次的 since 和 since_id
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def iter_ndjson(entity: str, rows: Iterator[tuple]) -> Iterator[str]:
+    columns = EXPORT_COLUMNS[entity]
+    for row in rows:
+        record = {column: _export_value(value) for column, value in zip(columns, row)}
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def iter_csv(entity: str, rows: Iterator[tuple]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS[entity])
+    for row in rows:
+        yield writer.writerow([_export_value(value) for value in row])
+
+
+def iter_plain(lines: Iterator[str], flush_size: int = 64 * 1024) -> Iterator[bytes]:
+    buffer: List[bytes] = []
+    buffered = 0
+    for line in lines:
+        chunk = line.encode('utf-8')
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= flush_size:
+            yield b"".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_gzip(lines: Iterator[str], flush_size: int = 64 * 1024) -> Iterator[bytes]:
+    # wbits=31 生成带 gzip 头的流，可以直接用 gunzip 解压
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in iter_plain(lines, flush_size):
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(entity: str, export_format: str, data: Dict[str, Any], since: Optional[datetime] = None,
+                  compress: bool = True, chunk_size: int = EXPORT_CHUNK_SIZE,
+                  since_id: Optional[UUID] = None) -> Iterator[bytes]:
+    rows = iter_export_rows(entity, data, since, chunk_size, since_id)
+    if export_format == 'csv':
+        lines = iter_csv(entity, rows)
+    else:
+        lines = iter_ndjson(entity, rows)
+    return iter_gzip(lines) if compress else iter_plain(lines)
+
+
+async def astream_export(entity: str, export_format: str, data: Dict[str, Any], since: Optional[datetime] = None,
+                         compress: bool = True, chunk_size: int = EXPORT_CHUNK_SIZE,
+                         since_id: Optional[UUID] = None) -> AsyncIterator[bytes]:
+    """ASGI 下使用：同步的迭代器会被 Django 整个读入内存后才发送，这里每次在线程中只取一块。
+    游标要在同一个数据库连接上读取，使用 thread_sensitive 让所有读取在同一个线程中执行"""
+    chunks = stream_export(entity, export_format, data, since, compress, chunk_size, since_id)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, _END)
+            if chunk is _END:
+                break
+            yield chunk
+    finally:
+        # 客户端断开时关闭生成器，释放服务端游标
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+def export_filename(entity: str, export_format: str, compress: bool) -> str:
+    extension = 'csv' if export_format == 'csv' else 'ndjson'
+    return f"{entity}.{extension}.gz" if compress else f"{entity}.{extension}"
@@ -0,0 +1,102 @@
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import OuterRef, QuerySet, Subquery
+
+from api.models import Result, Tagging
+
+TARGET_FIELDS = ('url', 'domain', 'results', 'tags')
+RESULT_FIELDS = ('timestamp', 'status', 'output', 'extractor')
+DEFAULT_FIELDS = ('url', 'domain', 'tags') + tuple(f'results.{field}' for field in RESULT_FIELDS)
+
+
+class FieldSet:
+    """list 接口返回的字段，例如 url,domain,tags,results.extractor,results.status"""
+
+    def __init__(self, fields: Iterable[str] = DEFAULT_FIELDS):
+        self.target: List[str] = []
+        self.result: List[str] = []
+        for field in fields:
+            field = field.strip()
+            if not field:
+                continue
+            if field == 'results':
+                self.result = list(RESULT_FIELDS)
+                continue
+            if field.startswith('results.'):
+                name = field[len('results.'):]
+                if name not in RESULT_FIELDS:
+                    raise ValueError(f"Unknown field: {field}")
+                if name not in self.result:
+                    self.result.append(name)
+                continue
+            if field not in TARGET_FIELDS:
+                raise ValueError(f"Unknown field: {field}")
+            if field not in self.target:
+                self.target.append(field)
+        if not self.target and not self.result:
+            raise ValueError("No fields selected.")
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> 'FieldSet':
+        return cls(value.split(',')) if value else cls()
+
+    @property
+    def target_columns(self) -> List[str]:
+        return ['id'] + [field for field in ('url', 'domain') if field in self.target]
+
+    @property
+    def result_columns(self) -> List[str]:
+        # 排序依赖 status 和 timestamp，失败的结果不返回 output，这两列总是读取
+        columns = ['target_id', 'status', 'timestamp']
+        columns += [field for field in ('extractor', 'output') if field in self.result]
+        return columns
+
+
+def result_queryset(targets: QuerySet, fieldset: FieldSet, extractors: List[str] = None,
+                    latest_only: bool = False) -> QuerySet:
+    """只读取需要的列，提取器筛选和每个提取器只保留最新结果都在数据库中完成"""
+    results = Result.objects.filter(target_id__in=targets.values('id'))
+    if extractors:
+        results = results.filter(extractor__in=extractors)
+    if latest_only:
+        latest = Result.objects.filter(target_id=OuterRef('target_id'), extractor=OuterRef('extractor'))
+        results = results.filter(timestamp=Subquery(latest.order_by('-timestamp').values('timestamp')[:1]))
+    return results.order_by('-timestamp').values_list(*fieldset.result_columns)
+
+
+def tag_queryset(targets: QuerySet) -> QuerySet:
+    return Tagging.objects.filter(target_id__in=targets.values('id')).values_list('target_id', 'tag_id__name')
+
+
+def serialize_result_row(row: Tuple, fieldset: FieldSet) -> Dict[str, Any]:
+    values = dict(zip(fieldset.result_columns, row))
+    # 与 ResultSerializer 保持一致：成功的结果先输出 timestamp，失败的结果不输出 output
+    order = ('timestamp', 'status', 'output', 'extractor') if values['status'] else ('status', 'timestamp', 'extractor')
+    return {field: values[field] for field in order if field in fieldset.result}
+
+
+def build_targets(target_rows: Iterable[Tuple], result_rows: Iterable[Tuple], tag_rows: Iterable[Tuple],
+                  fieldset: FieldSet) -> List[Dict[str, Any]]:
+    """把按列读取的目标、结果和标签组装为 list 接口的返回结构"""
+    results = defaultdict(list)
+    for row in result_rows:
+        results[row[0]].append(row)
+    tags = defaultdict(list)
+    for target_id, name in tag_rows:
+        tags[target_id].append(name)
+
+    items = []
+    for row in target_rows:
+        values = dict(zip(fieldset.target_columns, row))
+        item = {}
+        for field in TARGET_FIELDS:
+            if field in ('url', 'domain') and field in fieldset.target:
+                item[field] = values[field]
+            elif field == 'results' and fieldset.result:
+                rows = sorted(results[values['id']], key=lambda x: (not x[1], -x[2]))
+                item['results'] = [serialize_result_row(result, fieldset) for result in rows]
+            elif field == 'tags' and 'tags' in fieldset.target:
+                item['tags'] = tags[values['id']]
+        items.append(item)
+    return items
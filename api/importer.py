@@ -0,0 +1,97 @@
+import html
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+
+from api.models import Job, JobChunk
+
+IMPORT_PARSERS = ['txt', 'jsonl', 'netscape_html']
+
+_url_validator = URLValidator(schemes=['http', 'https'])
+_netscape_href = re.compile(r'<a\s[^>]*href="([^"]+)"', re.IGNORECASE)
+
+
+def normalize_url(raw: str) -> Optional[str]:
+    url = raw.strip()
+    if not url:
+        return None
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    url = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, parts.fragment))
+    try:
+        _url_validator(url)
+    except ValidationError:
+        return None
+    return url
+
+
+def iter_upload_lines(file: Iterable[bytes]) -> Iterator[str]:
+    # 上传文件按行迭代，大文件由 Django 落盘，不会整体读入内存
+    for line in file:
+        yield line.decode('utf-8', errors='replace').strip()
+
+
+def iter_upload_urls(file: Iterable[bytes], parser: str) -> Iterator[str]:
+    for line in iter_upload_lines(file):
+        if not line:
+            continue
+        if parser == 'txt':
+            if not line.startswith('#'):
+                yield line
+        elif parser == 'jsonl':
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                yield ''
+                continue
+            if isinstance(item, dict):
+                yield item.get('url') or item.get('href') or ''
+            elif isinstance(item, str):
+                yield item
+            else:
+                yield ''
+        elif parser == 'netscape_html':
+            # 书签文件中的 href 是 HTML 属性值，& 等字符经过转义
+            for match in _netscape_href.finditer(line):
+                yield html.unescape(match.group(1))
+        else:
+            raise ValueError(f"Unsupported import parser '{parser}'.")
+
+
+def create_import_chunks(job: Job, file: Iterable[bytes], parser: str, chunk_size: int) -> Dict[str, Any]:
+    seen = set()
+    buffer: List[str] = []
+    chunks = 0
+    total = 0
+    invalid = 0
+    duplicates = 0
+
+    def flush():
+        nonlocal chunks
+        JobChunk.objects.create(job_id=job, index=chunks, urls="\n".join(buffer), size=len(buffer))
+        chunks += 1
+        buffer.clear()
+
+    for raw in iter_upload_urls(file, parser):
+        url = normalize_url(raw)
+        if url is None:
+            invalid += 1
+            continue
+        if url in seen:
+            duplicates += 1
+            continue
+        seen.add(url)
+        buffer.append(url)
+        total += 1
+        if len(buffer) >= chunk_size:
+            flush()
+    if buffer:
+        flush()
+
+    return {'chunks': chunks, 'total': total, 'invalid': invalid, 'duplicates': duplicates}
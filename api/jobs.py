@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, List
+
+from django.db import close_old_connections, connections
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.locks import acquire_lock, new_lock_owner
+from api.models import Job, JobChunk
+from api.processes import current_job_id
+from api.utils import error_response
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+_periodic_tasks: Dict[str, threading.Thread] = {}
+_periodic_lock = threading.Lock()
+
+
+def get_executor(pool: str = 'default') -> ThreadPoolExecutor:
+    """default 线程池执行一般任务；heavy 线程池执行慢速通道的任务，并发数单独限制"""
+    with _executor_lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            if pool == 'heavy':
+                from api.lanes import get_heavy_lane_workers
+                max_workers, prefix = get_heavy_lane_workers(), 'archivebox-heavy'
+            else:
+                max_workers, prefix = int(os.getenv('JOB_WORKERS', '1')), 'archivebox-job'
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=prefix)
+            _executors[pool] = executor
+    return executor
+
+
+def get_job_execution_mode() -> str:
+    """local：在服务进程的线程池中执行；worker：由 run_worker 进程通过数据库租约认领执行"""
+    return os.getenv('JOB_EXECUTION_MODE', 'local').lower()
+
+
+def background_tasks_enabled() -> bool:
+    return os.getenv('BACKGROUND_TASKS_ENABLED', 'true').lower() == 'true'
+
+
+def start_background_tasks() -> None:
+    """由 wsgi/asgi 入口调用，在服务进程中启动定期维护任务。每个服务进程都会调用，
+    创建任务的 auto-retry 和 refresh 通过数据库锁保证同一时间只有一个进程执行；
+    BACKGROUND_TASKS_ENABLED=false 时该进程不启动任何定期任务"""
+    if not background_tasks_enabled():
+        return
+    from api.service import reap_orphan_containers, schedule_auto_retry, run_refresh_tick
+    # 容器清理只处理本机的容器，需要每个节点都执行
+    start_periodic_task('container-reaper', reap_orphan_containers,
+                        float(os.getenv('CONTAINER_REAPER_INTERVAL', '300')))
+    start_periodic_task('auto-retry', schedule_auto_retry, float(os.getenv('AUTO_RETRY_INTERVAL', '0')),
+                        exclusive=True)
+    if os.getenv('REFRESH_ENABLED', 'false').lower() == 'true':
+        start_periodic_task('refresh', run_refresh_tick, float(os.getenv('REFRESH_TICK_INTERVAL', '300')),
+                            exclusive=True)
+    from api.webhooks import dispatch_webhooks
+    start_periodic_task('webhooks', dispatch_webhooks, float(os.getenv('WEBHOOK_DISPATCH_INTERVAL', '5')))
+    from api.tiering import tier_snapshots
+    start_periodic_task('tiering', tier_snapshots, float(os.getenv('TIER_INTERVAL', '0')))
+
+
+def start_periodic_task(name: str, func: Callable[[], Any], interval: float, exclusive: bool = False) -> None:
+    """启动按固定间隔执行的后台线程，interval 小于等于 0 时不启动；
+    exclusive 为 True 时所有进程中只有持有数据库锁的一个执行"""
+    with _periodic_lock:
+        if interval <= 0 or name in _periodic_tasks:
+            return
+        thread = threading.Thread(target=_periodic_loop, args=(name, func, interval, exclusive),
+                                  name=f'archivebox-{name}', daemon=True)
+        _periodic_tasks[name] = thread
+    thread.start()
+
+
+def run_periodic_once(name: str, func: Callable[[], Any], interval: float, owner: str = None) -> bool:
+    """执行一次定期任务，返回是否执行。指定 owner 时先获取或续期名为 periodic:<name> 的锁：
+    持有锁的进程每个周期执行一次，其他进程跳过，锁在两个周期内没有续期才会被其他进程接管"""
+    if owner is not None:
+        if not acquire_lock(f'periodic:{name}', owner, interval * 2):
+            return False
+    func()
+    return True
+
+
+def _periodic_loop(name: str, func: Callable[[], Any], interval: float, exclusive: bool = False) -> None:
+    owner = new_lock_owner() if exclusive else None
+    while True:
+        try:
+            run_periodic_once(name, func, interval, owner)
+        except Exception:
+            logger.exception("Periodic task %s failed", name)
+        finally:
+            connections.close_all()
+        time.sleep(interval)
+
+
+def create_job(kind: str, params: Dict[str, Any] = None, total: int = 0, parent: Job = None) -> Job:
+    return Job.objects.create(kind=kind, params=params or {}, total=total, parent_id=parent)
+
+
+def create_job_chunks(job: Job, urls: List[str], chunk_size: int) -> int:
+    chunks = [
+        JobChunk(job_id=job, index=index, urls="\n".join(urls[start:start + chunk_size]),
+                 size=len(urls[start:start + chunk_size]))
+        for index, start in enumerate(range(0, len(urls), chunk_size))
+    ]
+    JobChunk.objects.bulk_create(chunks)
+    return len(chunks)
+
+
+def run_job(job_id: str, func: Callable[[Job], Dict[str, Any]]) -> None:
+    """在后台线程中执行任务，并把执行状态写回 Job"""
+    close_old_connections()
+    token = current_job_id.set(str(job_id))
+    try:
+        # 只有仍处于 pending 的任务才会开始执行，已取消的任务直接跳过
+        if not Job.objects.filter(id=job_id, status='pending').update(status='running', updated_at=timezone.now()):
+            return
+        job = Job.objects.get(id=job_id)
+        try:
+            result = func(job)
+        except Exception as e:
+            result = error_response(f"Job failed: {e}", error=e)
+        now = timezone.now()
+        # 任务执行期间可能已被取消，此时保留 cancelled 状态
+        status = job_status_from_response(result)
+        finished = Job.objects.filter(id=job_id, status='running').update(
+            status=status, error=result.get('error', ''), updated_at=now)
+        Job.objects.filter(id=job_id).update(
+            result={key: value for key, value in result.items() if key not in ('status', 'error')}, updated_at=now)
+        if finished and job.kind == 'heavy':
+            from api.service import notify_heavy_lane_completed
+            notify_heavy_lane_completed(job_id, status)
+    finally:
+        current_job_id.reset(token)
+        connections.close_all()
+
+
+def is_job_cancelled(job_id: str) -> bool:
+    return Job.objects.filter(id=job_id, status='cancelled').exists()
+
+
+def submit_job(job: Job, func: Callable[[Job], Dict[str, Any]], pool: str = 'default') -> Future:
+    return get_executor(pool).submit(run_job, job.id, func)
+
+
+def job_status_from_response(result: Dict[str, Any]) -> str:
+    if result["status"] == "success":
+        return 'succeeded'
+    elif result["status"] == "partial_success":
+        return 'partial_success'
+    else:
+        return 'failed'
+
+
+def serialize_job(job: Job, include_chunks: bool = True) -> Dict[str, Any]:
+    data = {
+        'id': str(job.id),
+        'kind': job.kind,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'failed': job.failed,
+        'parent_id': str(job.parent_id_id) if job.parent_id_id else None,
+        'params': job.params,
+        'result': job.result,
+        'error': job.error,
+        'created_at': job.created_at,
+        'updated_at': job.updated_at,
+    }
+    if include_chunks:
+        data['chunks'] = [
+            {
+                'index': chunk.index,
+                'size': chunk.size,
+                'status': chunk.status,
+                'succeeded': chunk.succeeded,
+                'failed': chunk.failed,
+            }
+            for chunk in JobChunk.objects.filter(job_id=job).order_by('index')
+        ]
+    return data
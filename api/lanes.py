@@ -0,0 +1,151 @@
+import copy
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from api.serializers import EXTRACTOR_CHOICES
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 内存受限的 ArchiveBox 服务，由 prepare_docker_compose 根据 archivebox 服务生成
+HEAVY_SERVICE = 'archivebox_heavy'
+DEFAULT_SERVICE = 'archivebox'
+# headers 用于判断存档是否成功，始终在快速通道中执行
+PROTECTED_EXTRACTORS = ('headers',)
+MEMORY_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+_fast_lane_slots = None
+_fast_lane_lock = threading.Lock()
+_compose_services: Dict[str, Tuple[float, Set[str]]] = {}
+_compose_lock = threading.Lock()
+_missing_service_warned = False
+
+
+def lanes_enabled() -> bool:
+    return os.getenv('EXTRACTOR_LANES_ENABLED', 'false').lower() == 'true'
+
+
+def get_fast_extractors() -> List[str]:
+    names = os.getenv('LANE_FAST_EXTRACTORS', 'title,favicon,headers')
+    return [name.strip() for name in names.split(',') if name.strip()]
+
+
+def get_heavy_memory_limit() -> str:
+    return os.getenv('HEAVY_LANE_MEMORY_LIMIT', '').strip()
+
+
+def get_heavy_chunk_size() -> int:
+    return int(os.getenv('HEAVY_LANE_CHUNK_SIZE', '10'))
+
+
+def get_heavy_service() -> str:
+    """设置了内存上限时，慢速通道在内存受限的服务中运行；该服务由初始化时生成，
+    初始化之后才设置 HEAVY_LANE_MEMORY_LIMIT 时 docker-compose.yml 中没有该服务，退回 archivebox 服务"""
+    global _missing_service_warned
+    if not get_heavy_memory_limit():
+        return DEFAULT_SERVICE
+    if HEAVY_SERVICE in compose_services(os.getenv('PROJECT_DIR', '')):
+        return HEAVY_SERVICE
+    if not _missing_service_warned:
+        _missing_service_warned = True
+        logger.warning("HEAVY_LANE_MEMORY_LIMIT is set but docker-compose.yml has no %s service, "
+                       "running heavy extractors in %s without a memory limit; run init again to create it.",
+                       HEAVY_SERVICE, DEFAULT_SERVICE)
+    return DEFAULT_SERVICE
+
+
+def compose_services(project_dir: str) -> Set[str]:
+    """读取 docker-compose.yml 中的服务名，按修改时间缓存"""
+    # 只有启用了慢速通道时才用到，不在服务进程启动时导入
+    import yaml
+
+    path = os.path.join(project_dir, 'docker-compose.yml')
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return set()
+    with _compose_lock:
+        cached = _compose_services.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path, 'r') as file:
+            services = set((yaml.safe_load(file) or {}).get('services') or {})
+    except (OSError, yaml.YAMLError, AttributeError):
+        services = set()
+    with _compose_lock:
+        _compose_services[path] = (mtime, services)
+    return services
+
+
+def parse_memory(value: str) -> Optional[int]:
+    """解析 docker 的内存写法，如 512m、2g"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([bkmg]?)b?\s*', (value or '').lower())
+    if not match:
+        return None
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def total_memory() -> Optional[int]:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_fast_lane_workers() -> int:
+    return int(os.getenv('FAST_LANE_WORKERS', '0')) or os.cpu_count() or 4
+
+
+def get_heavy_lane_workers() -> int:
+    """慢速通道的并发数：未配置时取 CPU 核数的一半，并保证所有容器的内存上限之和不超过本机内存的一半"""
+    configured = int(os.getenv('HEAVY_LANE_WORKERS', '0'))
+    if configured > 0:
+        return configured
+    workers = max(1, (os.cpu_count() or 2) // 2)
+    limit = parse_memory(get_heavy_memory_limit() or os.getenv('HEAVY_LANE_MEMORY_PER_RUN', '2g'))
+    memory = total_memory()
+    if limit and memory:
+        workers = min(workers, max(1, memory // 2 // limit))
+    return workers
+
+
+def fast_lane_slots() -> threading.BoundedSemaphore:
+    """限制同时执行的快速通道命令数量，add 请求在各自的线程中执行"""
+    global _fast_lane_slots
+    with _fast_lane_lock:
+        if _fast_lane_slots is None:
+            _fast_lane_slots = threading.BoundedSemaphore(get_fast_lane_workers())
+        return _fast_lane_slots
+
+
+def split_lanes(extractors: str) -> Tuple[str, str]:
+    """把请求的提取器分为快速通道和慢速通道，extractors 为空表示全部提取器；
+    任一通道为空时返回 ('', '')，表示不需要拆分"""
+    requested = [name for name in extractors.split(',') if name] if extractors else list(EXTRACTOR_CHOICES)
+    fast_names = set(get_fast_extractors()) | set(PROTECTED_EXTRACTORS)
+    fast = [name for name in requested if name in fast_names]
+    heavy = [name for name in requested if name not in fast_names]
+    if not fast or not heavy:
+        return '', ''
+    for name in PROTECTED_EXTRACTORS:
+        if name not in fast:
+            fast.append(name)
+    return ",".join(fast), ",".join(heavy)
+
+
+def heavy_service_config(service: Dict[str, Any], memory_limit: str) -> Dict[str, Any]:
+    """基于 archivebox 服务生成内存受限的服务：容器内 Chromium 超出上限时只会被内核结束，不影响宿主机"""
+    heavy = copy.deepcopy(service)
+    heavy.pop('ports', None)
+    heavy.pop('container_name', None)
+    heavy['mem_limit'] = memory_limit
+    # 不允许使用 swap 绕过内存上限
+    heavy['memswap_limit'] = memory_limit
+    return heavy
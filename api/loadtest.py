@@ -0,0 +1,273 @@
+import json
+import os
+import random
+import shlex
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from django.db import connection, connections
+
+from api.tag_index import batch_tag_index_invalidation
+from api.utils import format_snapshot_timestamp, process_json_data, remove_protocol, save_result, save_tags, \
+    success_response, error_response
+
+ENDPOINTS = {
+    'add': ('post', '/api/add'),
+    'list': ('post', '/api/list'),
+    'sync': ('get', '/api/sync'),
+}
+DEFAULT_MIX = {'add': 1, 'list': 8, 'sync': 1}
+
+# 模拟快照中的提取器及其输出文件，文件内容只有几十个字节
+SIMULATED_OUTPUTS = {
+    'title': None,
+    'favicon': 'favicon.ico',
+    'headers': 'headers.json',
+    'wget': 'index.html',
+    'screenshot': 'screenshot.png',
+    'pdf': 'output.pdf',
+    'singlefile': 'singlefile.html',
+}
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    """解析 add=1,list=8,sync=1 形式的请求比例"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint: {name}")
+        try:
+            mix[name] = int(weight or 1)
+        except ValueError:
+            raise ValueError(f"Invalid weight for {name}: {weight}")
+        if mix[name] < 0:
+            raise ValueError(f"Invalid weight for {name}: {weight}")
+    if not any(mix.values()):
+        raise ValueError("Request mix is empty.")
+    return mix
+
+
+def percentile(values: List[float], quantile: float) -> Optional[float]:
+    """已排序数据的分位数，相邻两个值之间线性插值"""
+    if not values:
+        return None
+    position = (len(values) - 1) * quantile
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class SimulatedArchiveBox:
+    """代替 docker compose 执行 archivebox add：按设定的耗时等待，在数据目录中写出快照和 index.json，并输出与
+    ArchiveBox 相同格式的日志，入库流程与真实执行时一致"""
+
+    def __init__(self, data_dir: str, latency: float = 0.05, per_url_latency: float = 0.01,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.archive_dir = os.path.join(data_dir, 'archive')
+        self.latency = latency
+        self.per_url_latency = per_url_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.snapshots: Dict[str, float] = {}
+        self.last_timestamp = time.time()
+        self.lock = threading.Lock()
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+    def next_timestamp(self) -> float:
+        with self.lock:
+            self.last_timestamp = round(max(time.time(), self.last_timestamp + 0.001), 3)
+            return self.last_timestamp
+
+    def write_snapshot(self, url: str, timestamp: float) -> str:
+        snapshot_dir = os.path.join(self.archive_dir, format_snapshot_timestamp(timestamp))
+        os.makedirs(snapshot_dir, exist_ok=True)
+        with self.lock:
+            failed = self.random.random() < self.failure_rate
+        now = datetime.now(dt_timezone.utc)
+        history = {}
+        for index, (extractor, output) in enumerate(SIMULATED_OUTPUTS.items()):
+            if output:
+                with open(os.path.join(snapshot_dir, output), 'w', encoding='utf-8') as f:
+                    f.write(f"{extractor} {url}\n")
+            start_ts = now + timedelta(milliseconds=index * 50)
+            history[extractor] = [{
+                'start_ts': start_ts.isoformat(),
+                'end_ts': (start_ts + timedelta(milliseconds=40)).isoformat(),
+                'status': 'failed' if failed else 'succeeded',
+                'output': output or f"Title of {url}",
+            }]
+        with open(os.path.join(snapshot_dir, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'timestamp': format_snapshot_timestamp(timestamp), 'history': history}, f)
+        return snapshot_dir
+
+    def archive(self, urls: List[str], update: bool = False) -> str:
+        """存档 URL 并返回日志；已存在的 URL 只有在 update 时才会重新存档"""
+        lines = []
+        for url in urls:
+            with self.lock:
+                timestamp = self.snapshots.get(url)
+            if timestamp is not None and not update:
+                lines.append(f'[*] [{datetime.now():%Y-%m-%d %H:%M:%S}] "{remove_protocol(url)}"\n    {url}\n'
+                             f'    √ ./archive/{format_snapshot_timestamp(timestamp)} (already exists)')
+                continue
+            timestamp = timestamp or self.next_timestamp()
+            self.write_snapshot(url, timestamp)
+            with self.lock:
+                self.snapshots[url] = timestamp
+            lines.append(f'[+] [{datetime.now():%Y-%m-%d %H:%M:%S}] "{remove_protocol(url)}"\n    {url}\n'
+                         f'    > ./archive/{format_snapshot_timestamp(timestamp)}')
+        return "\n".join(lines) + "\n"
+
+    def execute(self, command_args: str, stdin: str = None, timeout: float = None) -> Dict[str, Any]:
+        """与 execute_docker_compose_archivebox_command 的签名和返回值一致"""
+        argv = shlex.split(command_args)
+        if not argv or argv[0] != 'add':
+            return error_response(f"Simulated ArchiveBox does not support '{command_args}'.")
+        urls = [line.strip() for line in stdin.splitlines() if line.strip()] if stdin is not None else \
+            [arg for arg in argv[1:] if not arg.startswith('--')]
+        time.sleep(self.latency + self.per_url_latency * len(urls))
+        update = '--update' in argv or '--overwrite' in argv
+        return success_response("Simulated command executed successfully.", stdout=self.archive(urls, update))
+
+    def seed(self, count: int, tags: List[str], tags_per_target: int = 2) -> int:
+        """写出 count 个快照并通过正常的入库流程保存，作为压测开始时的数据"""
+        with batch_tag_index_invalidation():
+            for index in range(count):
+                url = f"https://seed{index % 50}.example.com/page/{index}"
+                timestamp = self.next_timestamp()
+                snapshot_dir = self.write_snapshot(url, timestamp)
+                self.snapshots[url] = timestamp
+                save_result(process_json_data(os.path.join(snapshot_dir, 'index.json')))
+                save_tags(url, self.random.sample(tags, min(tags_per_target, len(tags))))
+        return count
+
+
+class LoadTest:
+    """在多个线程中按比例请求 Django 接口，记录每个请求的耗时、状态码和数据库查询次数"""
+
+    def __init__(self, mix: Dict[str, int], concurrency: int, tags: List[str], add_batch: int = 5,
+                 list_body: Dict[str, Any] = None, seed: int = 0):
+        self.mix = mix
+        self.concurrency = concurrency
+        self.tags = tags
+        self.add_batch = add_batch
+        self.list_body = list_body
+        self.seed = seed
+        self.samples: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.lock = threading.Lock()
+        self.issued = 0
+        self.url_counter = 0
+
+    def next_url(self) -> str:
+        with self.lock:
+            self.url_counter += 1
+            return f"https://load{self.url_counter % 50}.example.com/item/{self.url_counter}"
+
+    def request_body(self, endpoint: str, rng: random.Random) -> Optional[Dict[str, Any]]:
+        if endpoint == 'add':
+            return {'urls': [self.next_url() for _ in range(self.add_batch)], 'tag': [rng.choice(self.tags)]}
+        if endpoint == 'list':
+            return self.list_body if self.list_body is not None else {'tag_names': [rng.choice(self.tags)]}
+        return None
+
+    def take_ticket(self, total: Optional[int], deadline: Optional[float]) -> bool:
+        with self.lock:
+            if total is not None and self.issued >= total:
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self.issued += 1
+            return True
+
+    def worker(self, index: int, total: Optional[int], deadline: Optional[float]) -> None:
+        from django.test import Client
+
+        # 测试客户端通过全局信号收集视图异常，多线程时会抛到其他线程的请求中，这里统一按 500 响应统计
+        client = Client(raise_request_exception=False)
+        rng = random.Random(self.seed + index)
+        endpoints = list(self.mix)
+        weights = [self.mix[name] for name in endpoints]
+        queries = [0]
+
+        def count_queries(execute: Callable, sql: str, params: Any, many: bool, context: Dict[str, Any]) -> Any:
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        try:
+            while self.take_ticket(total, deadline):
+                endpoint = rng.choices(endpoints, weights)[0]
+                method, path = ENDPOINTS[endpoint]
+                body = self.request_body(endpoint, rng)
+                queries[0] = 0
+                started = time.perf_counter()
+                try:
+                    with connection.execute_wrapper(count_queries):
+                        if method == 'post':
+                            response = client.post(path, body, content_type='application/json')
+                        else:
+                            response = client.get(path)
+                    status = response.status_code
+                except Exception as e:
+                    status = type(e).__name__
+                elapsed = (time.perf_counter() - started) * 1000
+                with self.lock:
+                    self.samples[endpoint].append({'ms': elapsed, 'status': status, 'queries': queries[0]})
+        finally:
+            connections.close_all()
+
+    def run(self, total: Optional[int] = None, duration: Optional[float] = None) -> Dict[str, Any]:
+        deadline = time.monotonic() + duration if duration else None
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='archivebox-load') as executor:
+            for future in [executor.submit(self.worker, index, total, deadline) for index in range(self.concurrency)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {name: summarize_samples(samples, elapsed) for name, samples in sorted(self.samples.items())}
+        all_samples = [sample for samples in self.samples.values() for sample in samples]
+        return {
+            'duration_s': round(elapsed, 3),
+            'concurrency': self.concurrency,
+            'mix': self.mix,
+            'total': summarize_samples(all_samples, elapsed),
+            'endpoints': endpoints,
+        }
+
+
+def summarize_samples(samples: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(sample['ms'] for sample in samples)
+    queries = sorted(sample['queries'] for sample in samples)
+    errors = sum(1 for sample in samples if not isinstance(sample['status'], int) or sample['status'] >= 400)
+    status_codes = defaultdict(int)
+    for sample in samples:
+        status_codes[str(sample['status'])] += 1
+
+    def rounded(value: Optional[float]) -> Optional[float]:
+        return round(value, 2) if value is not None else None
+
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': rounded(percentile(latencies, 0.5)),
+            'p95': rounded(percentile(latencies, 0.95)),
+            'p99': rounded(percentile(latencies, 0.99)),
+            'mean': rounded(sum(latencies) / len(latencies)) if latencies else None,
+            'max': rounded(latencies[-1]) if latencies else None,
+        },
+        'queries': {
+            'mean': rounded(sum(queries) / len(queries)) if queries else None,
+            'p95': percentile(queries, 0.95),
+            'max': queries[-1] if queries else None,
+        },
+        'status_codes': dict(status_codes),
+    }
@@ -0,0 +1,48 @@
+import os
+import socket
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Iterator, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import TaskLock
+
+
+def new_lock_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def acquire_lock(name: str, owner: str, ttl: float) -> bool:
+    """获取或续期数据库中的锁：锁不存在、已过期或本来就由 owner 持有时成功"""
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    if TaskLock.objects.filter(Q(expires_at__lt=now) | Q(owner=owner), name=name).update(
+            owner=owner, expires_at=expires_at, updated_at=now):
+        return True
+    try:
+        with transaction.atomic():
+            TaskLock.objects.create(name=name, owner=owner, expires_at=expires_at)
+        return True
+    except IntegrityError:
+        return False
+
+
+def release_lock(name: str, owner: str) -> None:
+    TaskLock.objects.filter(name=name, owner=owner).delete()
+
+
+@contextmanager
+def task_lock(name: str, ttl: float, owner: str = None) -> Iterator[Optional[str]]:
+    """在多个进程中只允许一个执行同名任务；获得锁时返回持有者标识，可用于续期，否则返回 None"""
+    owner = owner or new_lock_owner()
+    if not acquire_lock(name, owner, ttl):
+        yield None
+        return
+    try:
+        yield owner
+    finally:
+        release_lock(name, owner)
@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import warnings
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api import service
+from api.loadtest import DEFAULT_MIX, LoadTest, SimulatedArchiveBox, parse_mix
+
+
+class Command(BaseCommand):
+    help = ("对 add、list、sync 接口进行压测：使用独立的测试数据库和模拟的 ArchiveBox，"
+            "以 JSON 输出各接口的吞吐量、p50/p95/p99 延迟、错误率和数据库查询次数。")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="并发请求的线程数。")
+        parser.add_argument('--requests', type=int, default=200, help="请求总数，设置 --duration 时忽略。")
+        parser.add_argument('--duration', type=float, default=None, help="压测时长（秒）。")
+        parser.add_argument('--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+                            help="各接口的请求比例，例如 add=1,list=8,sync=1。")
+        parser.add_argument('--seed-targets', type=int, default=200, help="压测前写入的快照数量。")
+        parser.add_argument('--tags', type=int, default=10, help="标签数量。")
+        parser.add_argument('--add-batch', type=int, default=5, help="每个 add 请求包含的 URL 数量。")
+        parser.add_argument('--list-body', default=None, help="list 请求的 JSON 请求体，默认随机按一个标签筛选。")
+        parser.add_argument('--latency', type=float, default=0.05, help="模拟的 ArchiveBox 每条命令的耗时（秒）。")
+        parser.add_argument('--per-url-latency', type=float, default=0.01, help="模拟的每个 URL 的额外耗时（秒）。")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="模拟存档失败的比例。")
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('-o', '--output', default=None, help="结果写入的文件，默认输出到标准输出。")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+            list_body = json.loads(options['list_body']) if options['list_body'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        tags = [f'tag{index}' for index in range(max(options['tags'], 1))]
+        # 入库时 start_ts/end_ts 是不带时区的时间，每条结果都会产生警告，压测时不输出
+        warnings.filterwarnings('ignore', r'DateTimeField .* received a naive datetime', RuntimeWarning)
+
+        with tempfile.TemporaryDirectory(prefix='archivebox-load-') as project_dir:
+            # SQLite 默认的测试库在内存中，多线程压测使用临时目录下的文件数据库
+            old_name = connection.settings_dict['NAME']
+            old_test = dict(connection.settings_dict.get('TEST') or {})
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(project_dir, 'loadtest.sqlite3')
+            setup_test_environment()
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                simulator = SimulatedArchiveBox(os.path.join(project_dir, 'data'), options['latency'],
+                                                options['per_url_latency'], options['failure_rate'],
+                                                options['random_seed'])
+                with mock.patch.dict(os.environ, {'PROJECT_DIR': project_dir}), \
+                        mock.patch.object(service, 'execute_docker_compose_archivebox_command', simulator.execute):
+                    self.stderr.write(f"Seeding {options['seed_targets']} snapshots...")
+                    simulator.seed(options['seed_targets'], tags)
+                    load_test = LoadTest(mix, options['concurrency'], tags, options['add_batch'], list_body,
+                                         options['random_seed'])
+                    report = load_test.run(total=None if options['duration'] else options['requests'],
+                                           duration=options['duration'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                connection.settings_dict['TEST'] = old_test
+                teardown_test_environment()
+
+        report['database'] = connection.vendor
+        report['seed_targets'] = options['seed_targets']
+        report['simulator'] = {
+            'latency': options['latency'],
+            'per_url_latency': options['per_url_latency'],
+            'failure_rate': options['failure_rate'],
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(text + "\n")
+        self.stdout.write(text)
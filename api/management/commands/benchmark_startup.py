@@ -0,0 +1,113 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# 在全新的解释器中执行，分别统计 Django 初始化、加载 WSGI 应用、首个请求和第二个请求的耗时
+CHILD_SCRIPT = r"""
+import io
+import json
+import os
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+started = time.perf_counter()
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+setup_done = time.perf_counter()
+from archivebox_api_server.wsgi import application
+wsgi_done = time.perf_counter()
+
+
+def request(path):
+    path, _, query = path.partition('?')
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET', 'wsgi.errors': io.StringIO()}
+    setup_testing_defaults(environ)
+    status = []
+    body = b''.join(application(environ, lambda code, headers, exc_info=None: status.append(code)))
+    return status[0], len(body)
+
+
+first_status, _ = request(sys.argv[1])
+first_done = time.perf_counter()
+request(sys.argv[1])
+second_done = time.perf_counter()
+print(json.dumps({
+    'setup_ms': (setup_done - started) * 1000,
+    'wsgi_ms': (wsgi_done - setup_done) * 1000,
+    'first_request_ms': (first_done - wsgi_done) * 1000,
+    'second_request_ms': (second_done - first_done) * 1000,
+    'status': first_status,
+}))
+"""
+
+
+def summarize(values):
+    return {
+        'median': round(statistics.median(values), 2),
+        'min': round(min(values), 2),
+        'max': round(max(values), 2),
+    }
+
+
+def parse_importtime(stderr: str, top: int):
+    """解析 -X importtime 的输出，返回累计耗时最长的顶层模块"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        # 模块名前的缩进表示嵌套层级，只有一个空格的是顶层导入
+        name = fields[2]
+        if len(name) - len(name.lstrip(' ')) == 1:
+            modules.append((name.strip(), int(fields[1]) / 1000))
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return [{'module': name, 'ms': round(ms, 2)} for name, ms in modules[:top]]
+
+
+class Command(BaseCommand):
+    help = "测量服务进程冷启动耗时：导入、初始化以及首个请求的延迟。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--path', default='/api/stats', help="首个请求访问的路径。")
+        parser.add_argument('--top', type=int, default=15, help="输出导入耗时最长的模块数量。")
+
+    def handle(self, *args, **options):
+        runs = []
+        importtime = ''
+        for run in range(options['runs']):
+            argv = [sys.executable]
+            # 只在最后一次统计各模块的导入耗时，避免 importtime 本身的开销影响其他轮次
+            if run == options['runs'] - 1:
+                argv += ['-X', 'importtime']
+            argv += ['-c', CHILD_SCRIPT, options['path']]
+            started = time.perf_counter()
+            process = subprocess.run(argv, cwd=settings.BASE_DIR, capture_output=True, text=True)
+            elapsed = (time.perf_counter() - started) * 1000
+            if process.returncode != 0:
+                raise CommandError(process.stderr[-2000:])
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+            result['process_ms'] = elapsed
+            runs.append(result)
+            if run == options['runs'] - 1:
+                importtime = process.stderr
+
+        report = {
+            'runs': len(runs),
+            'path': options['path'],
+            'status': runs[-1]['status'],
+            'openapi_prebuilt': settings.OPENAPI_PREBUILT,
+        }
+        for key in ('process_ms', 'setup_ms', 'wsgi_ms', 'first_request_ms', 'second_request_ms'):
+            report[key] = summarize([run[key] for run in runs[:-1] or runs])
+        report['top_imports'] = parse_importtime(importtime, options['top'])
+        self.stdout.write(json.dumps(report, indent=2))
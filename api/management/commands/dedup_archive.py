@@ -0,0 +1,19 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.dedup import dedup_archive
+
+
+class Command(BaseCommand):
+    help = "对 data/archive 中内容相同的提取结果文件去重，重复的文件替换为硬链接。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snapshot', action='append', dest='timestamps', default=[],
+                            help="只处理指定时间戳的快照，可重复。")
+        parser.add_argument('--min-age', type=float, default=None,
+                            help="跳过最近多少秒内修改过的文件，默认使用 DEDUP_MIN_AGE。")
+
+    def handle(self, *args, **options):
+        result = dedup_archive(options['timestamps'], options['min_age'])
+        self.stdout.write(json.dumps(result, ensure_ascii=False))
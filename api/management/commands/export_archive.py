@@ -0,0 +1,63 @@
+import sys
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.export import stream_export, EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "以流式方式导出 Target/Result/Tag 数据（NDJSON 或 CSV，可选 gzip 压缩）。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entity', choices=['targets', 'results', 'tags'], default='results')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--tag', action='append', dest='tag_names', default=[], help="按标签筛选，可重复。")
+        parser.add_argument('--tag-query', default=None, help="标签表达式。")
+        parser.add_argument('--domain', action='append', dest='domains', default=[], help="按域名筛选，可重复。")
+        parser.add_argument('--url', action='append', dest='urls', default=[], help="按 URL 筛选，可重复。")
+        parser.add_argument('--extractor', action='append', dest='extractors', default=[],
+                            help="按提取器筛选，仅对 results 生效，可重复。")
+        parser.add_argument('--since', help="增量导出，只导出 updated_at 晚于该时间（ISO 8601）的记录。")
+        parser.add_argument('--since-id', help="与 --since 一起使用，updated_at 相同的记录中只导出 id 更大的。")
+        parser.add_argument('--no-compress', action='store_true', help="不使用 gzip 压缩。")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--output', '-o', help="输出文件路径，默认输出到标准输出。")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since value '{options['since']}'.")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        since_id = None
+        if options['since_id']:
+            if since is None:
+                raise CommandError("--since-id requires --since.")
+            try:
+                since_id = uuid.UUID(options['since_id'])
+            except ValueError:
+                raise CommandError(f"Invalid --since-id value '{options['since_id']}'.")
+
+        data = {
+            'tag_names': options['tag_names'],
+            'tag_query': options['tag_query'],
+            'domains': options['domains'],
+            'urls': options['urls'],
+            'extractors': options['extractors'],
+        }
+        chunks = stream_export(options['entity'], options['format'], data, since, not options['no_compress'],
+                               options['chunk_size'], since_id)
+
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
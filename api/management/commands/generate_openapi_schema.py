@@ -0,0 +1,27 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.schema import apply_schema_annotations
+
+
+class Command(BaseCommand):
+    help = "生成 OpenAPI 文档文件，部署时执行一次，服务进程启动时不再加载 drf_yasg。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', default=str(settings.OPENAPI_SCHEMA_FILE),
+                            help="输出文件，默认使用 OPENAPI_SCHEMA_FILE。")
+
+    def handle(self, *args, **options):
+        from drf_yasg.codecs import OpenAPICodecJson
+        from drf_yasg.generators import OpenAPISchemaGenerator
+
+        from archivebox_api_server.openapi import api_info
+
+        import_module(settings.ROOT_URLCONF)
+        apply_schema_annotations()
+        schema = OpenAPISchemaGenerator(api_info).get_schema(request=None, public=True)
+        with open(options['output'], 'wb') as f:
+            f.write(OpenAPICodecJson(validators=[], pretty=True).encode(schema))
+        self.stdout.write(f"OpenAPI schema written to {options['output']}")
@@ -0,0 +1,22 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.service import reap_orphan_containers
+
+
+class Command(BaseCommand):
+    help = "清理服务异常退出或任务结束后遗留的 ArchiveBox 容器。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="按指定间隔（秒）循环执行，默认只执行一次。")
+
+    def handle(self, *args, **options):
+        while True:
+            result = reap_orphan_containers()
+            self.stdout.write(json.dumps(result, ensure_ascii=False))
+            if options['interval'] <= 0:
+                break
+            time.sleep(options['interval'])
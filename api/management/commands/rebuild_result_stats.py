@@ -0,0 +1,13 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.stats import rebuild_result_summary
+
+
+class Command(BaseCommand):
+    help = "扫描 Result 表，重新生成按域名、标签和提取器汇总的成功率和耗时统计。"
+
+    def handle(self, *args, **options):
+        rows = rebuild_result_summary()
+        self.stdout.write(json.dumps({'rows': rows}))
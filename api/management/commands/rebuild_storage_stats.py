@@ -0,0 +1,24 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from api.stats import measure_results, rebuild_storage_usage
+from api.utils import snapshot_index_file
+
+
+class Command(BaseCommand):
+    help = "根据 Result 记录的大小重新生成存储空间统计。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--measure', action='store_true',
+                            help="先统计磁盘上尚未记录大小的提取结果，用于升级前已入库的数据。")
+        parser.add_argument('--measure-all', action='store_true', help="重新统计所有提取结果的大小。")
+
+    def handle(self, *args, **options):
+        measured = 0
+        if options['measure'] or options['measure_all']:
+            measured = measure_results(lambda timestamp: os.path.dirname(snapshot_index_file(timestamp)),
+                                       only_missing=not options['measure_all'])
+        rows = rebuild_storage_usage()
+        self.stdout.write(json.dumps({'measured': measured, 'rows': rows}))
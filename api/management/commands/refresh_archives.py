@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.service import run_refresh_tick
+
+
+class Command(BaseCommand):
+    help = "按刷新策略派发一轮过期目标的重新存档任务。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="忽略刷新时间窗口。")
+
+    def handle(self, *args, **options):
+        result = run_refresh_tick(options['force'])
+        self.stdout.write(json.dumps(result, ensure_ascii=False, default=str))
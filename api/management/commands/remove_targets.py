@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.jobs import run_job, serialize_job
+from api.models import Job
+from api.service import create_remove_job, run_remove_job
+
+
+class Command(BaseCommand):
+    help = "按筛选条件批量删除目标：分批执行 archivebox remove，再分批删除数据库中的记录。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tag', action='append', dest='tag_names', default=[], help="按标签筛选，可重复。")
+        parser.add_argument('--tag-query', default=None, help="标签表达式。")
+        parser.add_argument('--domain', action='append', dest='domains', default=[], help="按域名筛选，可重复。")
+        parser.add_argument('--url', action='append', dest='urls', default=[], help="按 URL 筛选，可重复。")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--keep-files', action='store_true', help="只从 ArchiveBox 索引中删除，保留快照文件。")
+
+    def handle(self, *args, **options):
+        data = {key: options[key] for key in ('tag_names', 'tag_query', 'domains', 'urls') if options[key]}
+        if not data:
+            raise CommandError("At least one filter is required to remove targets.")
+        job = create_remove_job(data, options['batch_size'], not options['keep_files'])
+        if job is None:
+            self.stdout.write("No targets matched.")
+            return
+        # 在当前进程中执行，进度同样可以通过 /api/jobs/<id> 查看
+        self.stdout.write(f"Remove job {job.id} created for {job.total} targets.")
+        run_job(job.id, run_remove_job)
+        job = Job.objects.get(id=job.id)
+        self.stdout.write(json.dumps(serialize_job(job, include_chunks=False), ensure_ascii=False, default=str))
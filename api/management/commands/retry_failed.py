@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.service import retry_failed_extractors
+
+
+class Command(BaseCommand):
+    help = "只重新执行失败的提取器，已成功的提取器不会重复执行。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tag', action='append', dest='tag_names', default=[], help="按标签筛选，可重复。")
+        parser.add_argument('--tag-query', default=None, help="标签表达式。")
+        parser.add_argument('--domain', action='append', dest='domains', default=[], help="按域名筛选，可重复。")
+        parser.add_argument('--url', action='append', dest='urls', default=[], help="按 URL 筛选，可重复。")
+        parser.add_argument('--extractor', action='append', dest='extractors', default=[],
+                            help="只重试指定的提取器，可重复。")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--force', action='store_true', help="忽略重试次数上限和退避时间。")
+
+    def handle(self, *args, **options):
+        data = {key: options[key] for key in ('tag_names', 'tag_query', 'domains', 'urls', 'extractors')}
+        result = retry_failed_extractors(data, options['batch_size'], options['force'])
+        self.stdout.write(json.dumps(result, ensure_ascii=False, default=str))
@@ -0,0 +1,25 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from api.workers import Worker
+
+
+class Command(BaseCommand):
+    help = "从数据库认领导入和刷新任务的批次并在本机执行，可在多个节点上同时运行。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None, help="同时执行的批次数，默认读取 WORKER_CONCURRENCY。")
+        parser.add_argument('--worker-id', default=None, help="节点标识，默认由主机名和进程号生成。")
+        parser.add_argument('--once', action='store_true', help="只认领一轮批次，执行完成后退出。")
+        parser.add_argument('--lane', choices=['all', 'fast', 'heavy'], default='all',
+                            help="只认领指定通道的批次，heavy 节点的并发数默认由 CPU 和内存计算。")
+
+    def handle(self, *args, **options):
+        worker = Worker(worker_id=options['worker_id'], concurrency=options['concurrency'], lane=options['lane'])
+        # 收到终止信号后不再认领新批次，等待正在执行的批次结束
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        signal.signal(signal.SIGINT, lambda *_: worker.stop())
+        self.stdout.write(f"Worker {worker.worker_id} started with concurrency {worker.concurrency}.")
+        worker.run(once=options['once'])
+        self.stdout.write(f"Worker {worker.worker_id} stopped.")
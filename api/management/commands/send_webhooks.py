@@ -0,0 +1,27 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.webhooks import dispatch_webhooks
+
+
+class Command(BaseCommand):
+    help = "投递待发送的 webhook 通知，服务进程未启动定期投递时可单独运行。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="只投递一轮到期的事件，完成后退出。")
+        parser.add_argument('--interval', type=float, default=None,
+                            help="两轮投递之间的间隔（秒），默认读取 WEBHOOK_DISPATCH_INTERVAL。")
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or float(os.getenv('WEBHOOK_DISPATCH_INTERVAL', '5')) or 5
+        while True:
+            stats = dispatch_webhooks()
+            if options['once']:
+                self.stdout.write(json.dumps(stats))
+                return
+            if stats['requests']:
+                self.stdout.write(json.dumps(stats))
+            time.sleep(interval)
@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.tiering import tier_snapshots
+
+
+class Command(BaseCommand):
+    help = "把长时间没有修改的快照打包为压缩包转入冷存储，删除快照目录中已打包的文件。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=float, default=None,
+                            help="只打包最近多少天内没有修改的快照，默认使用 TIER_MIN_AGE_DAYS。")
+        parser.add_argument('--limit', type=int, default=None, help="本次最多打包的快照数量。")
+        parser.add_argument('--dry-run', action='store_true', help="只统计符合条件的快照，不打包。")
+
+    def handle(self, *args, **options):
+        min_age = options['min_age'] * 86400 if options['min_age'] is not None else None
+        result = tier_snapshots(min_age, options['limit'], options['dry_run'])
+        self.stdout.write(json.dumps(result, ensure_ascii=False))
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:07
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=20)),
+                ('status', models.CharField(default='pending', max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('params', models.JSONField(default=dict)),
+                ('result', models.JSONField(default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='JobChunk',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('index', models.IntegerField()),
+                ('urls', models.TextField()),
+                ('size', models.IntegerField(default=0)),
+                ('status', models.CharField(default='pending', max_length=20)),
+                ('succeeded', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('result', models.JSONField(default=dict)),
+                ('job_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.job')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
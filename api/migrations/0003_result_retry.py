@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='next_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='retry_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
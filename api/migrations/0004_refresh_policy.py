@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:18
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_result_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='target',
+            name='refresh_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RefreshPolicy',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('interval', models.DurationField()),
+                ('priority', models.IntegerField(default=0)),
+                ('enabled', models.BooleanField(default=True)),
+                ('tag_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='api.tag')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:21
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_refresh_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveFile',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('path', models.CharField(max_length=1000, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('inode', models.BigIntegerField()),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
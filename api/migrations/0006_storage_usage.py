@@ -0,0 +1,40 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:23
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_archive_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='file_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('scope', models.CharField(max_length=20)),
+                ('key', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(default=0)),
+                ('file_count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', '-size'], name='api_storage_scope_b8c85f_idx')],
+                'unique_together': {('scope', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:24
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_storage_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultSummary',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('scope', models.CharField(max_length=20)),
+                ('key', models.CharField(max_length=255)),
+                ('total', models.BigIntegerField(default=0)),
+                ('succeeded', models.BigIntegerField(default=0)),
+                ('failed', models.BigIntegerField(default=0)),
+                ('duration_total', models.FloatField(default=0)),
+                ('duration_count', models.BigIntegerField(default=0)),
+                ('histogram', models.JSONField(default=list)),
+            ],
+            options={
+                'unique_together': {('scope', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_cache_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobchunk',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='jobchunk',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobchunk',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='jobchunk',
+            index=models.Index(fields=['status', 'lease_expires_at'], name='api_jobchun_status_eeb3dd_idx'),
+        ),
+    ]
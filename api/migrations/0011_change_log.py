@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_webhooks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=20)),
+                ('data', models.JSONField(default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='api_changel_created_df91d4_idx')],
+            },
+        ),
+    ]
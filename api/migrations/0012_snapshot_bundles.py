@@ -0,0 +1,50 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:54
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotBundle',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('timestamp', models.CharField(max_length=50, unique=True)),
+                ('path', models.CharField(max_length=1000)),
+                ('size', models.BigIntegerField(default=0)),
+                ('original_size', models.BigIntegerField(default=0)),
+                ('file_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='BundleMember',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=1000)),
+                ('offset', models.BigIntegerField()),
+                ('compressed_size', models.BigIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('compress_type', models.IntegerField()),
+                ('crc32', models.BigIntegerField()),
+                ('mtime', models.FloatField(default=0)),
+                ('bundle_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.snapshotbundle')),
+            ],
+            options={
+                'unique_together': {('bundle_id', 'name')},
+            },
+        ),
+    ]
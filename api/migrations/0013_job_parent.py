@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-19 19:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_snapshot_bundles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='parent_id',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.job'),
+        ),
+    ]
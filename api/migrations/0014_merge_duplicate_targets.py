@@ -0,0 +1,59 @@
+# Generated by Django 5.0.7 on 2026-10-19 20:14
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def duplicate_values(model, *fields):
+    return model.objects.values(*fields).annotate(n=Count('id')).filter(n__gt=1).values(*fields)
+
+
+def merge_duplicate_targets(apps, schema_editor):
+    """并发的 sync/add 可能为同一 URL 或同一提取结果创建了多条记录，添加唯一约束前合并：
+    保留最早创建的记录，其他记录的结果和标签转移到保留的记录上；
+    合并后需要执行 rebuild_storage_stats 和 rebuild_result_stats 重新生成汇总"""
+    Tag = apps.get_model('api', 'Tag')
+    Target = apps.get_model('api', 'Target')
+    Result = apps.get_model('api', 'Result')
+    Tagging = apps.get_model('api', 'Tagging')
+    RefreshPolicy = apps.get_model('api', 'RefreshPolicy')
+    WebhookSubscription = apps.get_model('api', 'WebhookSubscription')
+
+    for row in duplicate_values(Tag, 'name'):
+        keep, *others = Tag.objects.filter(name=row['name']).order_by('created_at', 'id')
+        Tagging.objects.filter(tag_id__in=others).update(tag_id=keep)
+        WebhookSubscription.objects.filter(tag_id__in=others).update(tag_id=keep)
+        if not RefreshPolicy.objects.filter(tag_id=keep).exists():
+            policy = RefreshPolicy.objects.filter(tag_id__in=others).order_by('created_at').first()
+            if policy:
+                RefreshPolicy.objects.filter(id=policy.id).update(tag_id=keep)
+        Tag.objects.filter(id__in=[tag.id for tag in others]).delete()
+
+    for row in duplicate_values(Target, 'url'):
+        targets = Target.objects.filter(url=row['url'])
+        timestamp = targets.aggregate(timestamp=Max('timestamp'))['timestamp']
+        keep, *others = targets.order_by('created_at', 'id')
+        Result.objects.filter(target_id__in=others).update(target_id=keep)
+        Tagging.objects.filter(target_id__in=others).update(target_id=keep)
+        Target.objects.filter(id=keep.id).update(timestamp=timestamp)
+        Target.objects.filter(id__in=[target.id for target in others]).delete()
+
+    # 同一快照的同一提取器保留最后更新的结果
+    for row in duplicate_values(Result, 'target_id', 'extractor', 'timestamp'):
+        keep, *others = Result.objects.filter(**row).order_by('-updated_at', '-id')
+        Result.objects.filter(id__in=[result.id for result in others]).delete()
+
+    for row in duplicate_values(Tagging, 'tag_id', 'target_id'):
+        keep, *others = Tagging.objects.filter(**row).order_by('created_at', 'id')
+        Tagging.objects.filter(id__in=[tagging.id for tagging in others]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_job_parent'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_targets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-19 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_merge_duplicate_targets'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='target',
+            name='url',
+            field=models.URLField(max_length=2000, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='result',
+            unique_together={('target_id', 'extractor', 'timestamp')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagging',
+            unique_together={('tag_id', 'target_id')},
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-19 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_unique_targets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskLock',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('owner', models.CharField(max_length=200)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -12,9 +12,10 @@ class BaseModel(models.Model):
 
 class Target(BaseModel):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    url = models.URLField(max_length=2000)
+    url = models.URLField(max_length=2000, unique=True)
     domain = models.CharField(max_length=100)
     timestamp = models.FloatField()
+    refresh_queued_at = models.DateTimeField(null=True, blank=True)
 
 
 class Result(BaseModel):
@@ -26,14 +27,178 @@ class Result(BaseModel):
     output = models.TextField()
     target_id = models.ForeignKey(Target, on_delete=models.CASCADE)
     extractor = models.CharField(max_length=100)
+    retry_count = models.IntegerField(default=0)
+    next_retry_at = models.DateTimeField(null=True, blank=True)
+    size = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+
+    class Meta:
+        # 并发的 sync/add 依靠唯一约束保证 get_or_create 只创建一条记录
+        unique_together = ('target_id', 'extractor', 'timestamp')
 
 
 class Tag(BaseModel):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    name = models.CharField(max_length=50)
+    name = models.CharField(max_length=100, unique=True)
 
 
 class Tagging(BaseModel):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     tag_id = models.ForeignKey(Tag, on_delete=models.CASCADE)
     target_id = models.ForeignKey(Target, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('tag_id', 'target_id')
+
+
+class RefreshPolicy(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tag_id = models.OneToOneField(Tag, on_delete=models.CASCADE)
+    interval = models.DurationField()
+    priority = models.IntegerField(default=0)
+    enabled = models.BooleanField(default=True)
+
+
+class ArchiveFile(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    path = models.CharField(max_length=1000, unique=True)
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    inode = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, db_index=True)
+
+
+class StorageUsage(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    scope = models.CharField(max_length=20)
+    key = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    file_count = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('scope', 'key')
+        indexes = [models.Index(fields=['scope', '-size'])]
+
+
+class ResultSummary(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    scope = models.CharField(max_length=20)
+    key = models.CharField(max_length=255)
+    total = models.BigIntegerField(default=0)
+    succeeded = models.BigIntegerField(default=0)
+    failed = models.BigIntegerField(default=0)
+    duration_total = models.FloatField(default=0)
+    duration_count = models.BigIntegerField(default=0)
+    histogram = models.JSONField(default=list)
+
+    class Meta:
+        unique_together = ('scope', 'key')
+
+
+class CacheVersion(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+
+
+class Job(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20)
+    status = models.CharField(max_length=20, default='pending')
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    params = models.JSONField(default=dict)
+    result = models.JSONField(default=dict)
+    error = models.TextField(blank=True, default='')
+    # 拆分抓取（crawl）中每批链接的任务指向其所属的 crawl 任务
+    parent_id = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE)
+
+
+class JobChunk(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    job_id = models.ForeignKey(Job, on_delete=models.CASCADE)
+    index = models.IntegerField()
+    urls = models.TextField()
+    size = models.IntegerField(default=0)
+    status = models.CharField(max_length=20, default='pending')
+    succeeded = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    result = models.JSONField(default=dict)
+    # 多节点 worker 认领批次时写入的租约，过期后批次会被重新分配
+    lease_owner = models.CharField(max_length=200, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'lease_expires_at'])]
+
+
+class WebhookSubscription(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tag_id = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    url = models.URLField(max_length=2000)
+    secret = models.CharField(max_length=100)
+    enabled = models.BooleanField(default=True)
+
+
+class WebhookEvent(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # 为空表示请求中的 callback_url，使用 WEBHOOK_SECRET 签名
+    subscription_id = models.ForeignKey(WebhookSubscription, null=True, blank=True, on_delete=models.CASCADE)
+    url = models.URLField(max_length=2000)
+    event = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    claim = models.CharField(max_length=64, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+
+class ChangeLog(BaseModel):
+    # 自增主键保证按写入顺序应用，内存读模型据此增量更新
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20)
+    data = models.JSONField(default=dict)
+
+    class Meta:
+        indexes = [models.Index(fields=['created_at'])]
+
+
+class SnapshotBundle(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # 快照目录名，即格式化后的 timestamp
+    timestamp = models.CharField(max_length=50, unique=True)
+    path = models.CharField(max_length=1000)
+    size = models.BigIntegerField(default=0)
+    original_size = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+
+
+class BundleMember(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    bundle_id = models.ForeignKey(SnapshotBundle, on_delete=models.CASCADE)
+    name = models.CharField(max_length=1000)
+    # 压缩数据在文件中的起始位置，读取时不需要解析 zip 目录
+    offset = models.BigIntegerField()
+    compressed_size = models.BigIntegerField()
+    size = models.BigIntegerField()
+    compress_type = models.IntegerField()
+    crc32 = models.BigIntegerField()
+    mtime = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('bundle_id', 'name')
+
+
+class TaskLock(BaseModel):
+    # 多个服务进程共享的互斥锁，持有者在 expires_at 前没有续期时其他进程可以接管
+    name = models.CharField(max_length=50, primary_key=True)
+    owner = models.CharField(max_length=200)
+    expires_at = models.DateTimeField()
@@ -0,0 +1,99 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.models import ResultSummary
+from api.serializers import EXTRACTOR_CHOICES
+from api.stats import domain_extractor_key, histogram_quantile
+from api.utils import get_domain
+
+load_dotenv()
+
+# headers 用于判断存档是否成功，始终执行
+PROTECTED_EXTRACTORS = {'headers'}
+
+
+def planner_enabled() -> bool:
+    return os.getenv('EXTRACTOR_PLANNER_ENABLED', 'false').lower() == 'true'
+
+
+def get_planner_settings() -> Dict[str, float]:
+    return {
+        'min_samples': int(os.getenv('PLANNER_MIN_SAMPLES', '10')),
+        'drop_success_rate': float(os.getenv('PLANNER_DROP_SUCCESS_RATE', '0.05')),
+        'defer_success_rate': float(os.getenv('PLANNER_DEFER_SUCCESS_RATE', '0.3')),
+        'defer_duration': float(os.getenv('PLANNER_DEFER_DURATION', '300')),
+        'reprobe_interval': float(os.getenv('PLANNER_REPROBE_INTERVAL', '604800')),
+    }
+
+
+def decide(summary: Optional[ResultSummary], settings: Dict[str, float],
+           now: datetime = None) -> Tuple[str, Optional[str]]:
+    """根据域名下该提取器的历史结果决定 run、defer 或 drop，同时返回原因。
+    被移除的提取器不会再产生结果，汇总超过 reprobe_interval 秒没有更新时改为推迟执行一次，
+    站点恢复后新的结果会逐渐提高成功率"""
+    if summary is None or summary.total < settings['min_samples']:
+        return 'run', None
+    success_rate = summary.succeeded / summary.total
+    if success_rate <= settings['drop_success_rate']:
+        interval = settings.get('reprobe_interval')
+        if interval and summary.updated_at and \
+                ((now or timezone.now()) - summary.updated_at).total_seconds() >= interval:
+            return 'defer', f"re-probing, {summary.succeeded} of {summary.total} previous runs succeeded"
+        return 'drop', f"{summary.succeeded} of {summary.total} previous runs succeeded"
+    if success_rate <= settings['defer_success_rate']:
+        return 'defer', f"only {success_rate:.0%} of {summary.total} previous runs succeeded"
+    p95 = histogram_quantile(summary.histogram or [], 0.95)
+    if settings['defer_duration'] and p95 is not None and p95 >= settings['defer_duration']:
+        return 'defer', f"p95 duration is {p95:.0f}s"
+    return 'run', None
+
+
+def plan_extractors(urls: List[str], extractors: str) -> Dict[str, Any]:
+    """按域名为 URL 选择提取器，返回分组后的 add 参数和每个决定的原因；
+    extractors 为空表示全部提取器，没有需要调整的域名保持原参数不变"""
+    requested = [name for name in extractors.split(',') if name] if extractors else list(EXTRACTOR_CHOICES)
+    settings = get_planner_settings()
+    now = timezone.now()
+    domains: Dict[str, List[str]] = {}
+    for url in urls:
+        domains.setdefault(get_domain(url), []).append(url)
+
+    keys = [domain_extractor_key(domain, name) for domain in domains for name in requested
+            if name not in PROTECTED_EXTRACTORS]
+    summaries = {summary.key: summary for summary in
+                 ResultSummary.objects.filter(scope='domain_extractor', key__in=keys)}
+
+    groups: Dict[Tuple[str, Tuple[str, ...]], List[str]] = {}
+    decisions = []
+    for domain, domain_urls in domains.items():
+        run, deferred = [], []
+        for name in requested:
+            summary = summaries.get(domain_extractor_key(domain, name))
+            action, reason = ('run', None) if name in PROTECTED_EXTRACTORS else decide(summary, settings, now)
+            if action == 'run':
+                run.append(name)
+                continue
+            if action == 'defer':
+                deferred.append(name)
+            decisions.append({
+                'domain': domain,
+                'extractor': name,
+                'action': action,
+                'reason': reason,
+                'samples': summary.total,
+                'success_rate': round(summary.succeeded / summary.total, 4),
+            })
+        # 没有调整的域名沿用请求中的参数，为空时仍由 ArchiveBox 执行全部提取器；
+        # 全部被移除时只执行 headers，空参数会被 ArchiveBox 当作全部提取器
+        run_arg = ",".join(run or ['headers']) if len(run) != len(requested) else extractors
+        groups.setdefault((run_arg, tuple(deferred)), []).extend(domain_urls)
+
+    return {
+        'groups': [{'urls': group_urls, 'extractors': run_arg, 'deferred': list(deferred)}
+                   for (run_arg, deferred), group_urls in groups.items()],
+        'decisions': decisions,
+    }
@@ -0,0 +1,178 @@
+import contextvars
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LABEL_PREFIX = 'archivebox_api_server'
+TERMINAL_JOB_STATUSES = ('succeeded', 'partial_success', 'failed', 'cancelled')
+
+# 当前线程/协程所属的任务 ID，用于取消任务时找到对应的进程和容器
+current_job_id = contextvars.ContextVar('current_job_id', default=None)
+# 当前执行的批次 ID，同一任务的多个批次可能在同一节点上并行执行，失去租约时只结束对应批次的进程
+current_chunk_id = contextvars.ContextVar('current_chunk_id', default=None)
+# 执行 ArchiveBox 命令使用的 docker compose 服务，慢速通道的任务使用内存受限的服务
+archivebox_service = contextvars.ContextVar('archivebox_service', default='archivebox')
+
+_processes: Dict[Optional[str], List[Tuple[int, str, Optional[str]]]] = {}
+_processes_lock = threading.Lock()
+
+
+def get_batch_seconds_per_url() -> float:
+    # ARCHIVEBOX_URL_TIMEOUT 是旧名称，实际含义一直是整批的预算
+    return float(os.getenv('ARCHIVEBOX_BATCH_SECONDS_PER_URL', os.getenv('ARCHIVEBOX_URL_TIMEOUT', '0')))
+
+
+def get_url_timeout() -> int:
+    return int(float(os.getenv('ARCHIVEBOX_PER_URL_TIMEOUT', '0')))
+
+
+def archivebox_env() -> Dict[str, str]:
+    """每条 docker compose run 命令传给 ArchiveBox 的环境变量。ARCHIVEBOX_PER_URL_TIMEOUT 作为 ArchiveBox 的
+    TIMEOUT 传入，由 ArchiveBox 限制每个 URL 上每个提取器的耗时，慢的 URL 不会占用整批的预算"""
+    timeout = get_url_timeout()
+    return {'TIMEOUT': str(timeout)} if timeout > 0 else {}
+
+
+def get_command_timeout(url_count: int = 0) -> Optional[float]:
+    """整条命令的超时时间（秒），取 ARCHIVEBOX_COMMAND_TIMEOUT 和整批预算中较小的一个，都未设置时不限制。
+    整批预算为 URL 数量乘以 ARCHIVEBOX_BATCH_SECONDS_PER_URL，前面的 URL 提前完成时，剩余的时间可以留给后面较慢的 URL；
+    单个 URL 的上限见 archivebox_env，整批预算仍然是外层的上限"""
+    timeouts = []
+    command_timeout = float(os.getenv('ARCHIVEBOX_COMMAND_TIMEOUT', '0'))
+    seconds_per_url = get_batch_seconds_per_url()
+    if command_timeout > 0:
+        timeouts.append(command_timeout)
+    if seconds_per_url > 0 and url_count:
+        timeouts.append(seconds_per_url * url_count)
+    return min(timeouts) if timeouts else None
+
+
+def new_container_name() -> str:
+    return f"archivebox-api-{uuid.uuid4().hex[:12]}"
+
+
+def container_labels() -> Dict[str, str]:
+    return {
+        f'{LABEL_PREFIX}.managed': 'true',
+        f'{LABEL_PREFIX}.job': current_job_id.get() or '',
+        f'{LABEL_PREFIX}.host': socket.gethostname(),
+        f'{LABEL_PREFIX}.pid': str(os.getpid()),
+        f'{LABEL_PREFIX}.started': str(int(time.time())),
+    }
+
+
+def container_run_options(container_name: str) -> List[str]:
+    options = ["--name", container_name]
+    for key, value in container_labels().items():
+        options.extend(["--label", f"{key}={value}"])
+    return options
+
+
+def register_process(pid: int, container_name: str) -> None:
+    with _processes_lock:
+        _processes.setdefault(current_job_id.get(), []).append((pid, container_name, current_chunk_id.get()))
+
+
+def unregister_process(pid: int) -> None:
+    with _processes_lock:
+        for job_id, entries in list(_processes.items()):
+            entries[:] = [entry for entry in entries if entry[0] != pid]
+            if not entries:
+                del _processes[job_id]
+
+
+def kill_process_group(pid: int) -> bool:
+    # 命令以 start_new_session 启动，进程组 ID 与 pid 相同
+    try:
+        os.killpg(pid, signal.SIGKILL)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+
+def remove_containers(names: List[str]) -> List[str]:
+    if not names:
+        return []
+    try:
+        subprocess.run(["docker", "rm", "-f", *names], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    return names
+
+
+def terminate_command(pid: int, container_name: str = None) -> None:
+    kill_process_group(pid)
+    # 结束 docker compose 客户端并不会停止容器，需要单独删除
+    if container_name:
+        remove_containers([container_name])
+
+
+def kill_job_processes(job_id: str, chunk_id: str = None) -> int:
+    """结束任务在本进程中启动的命令，指定 chunk_id 时只结束该批次的命令"""
+    with _processes_lock:
+        entries = list(_processes.get(str(job_id), []))
+    if chunk_id is not None:
+        entries = [entry for entry in entries if entry[2] == str(chunk_id)]
+    for pid, container_name, _ in entries:
+        terminate_command(pid, container_name)
+    return len(entries)
+
+
+def list_managed_containers(job_id: str = None) -> List[Dict[str, str]]:
+    label_filter = f"label={LABEL_PREFIX}.job={job_id}" if job_id else f"label={LABEL_PREFIX}.managed=true"
+    template = "\t".join(['{{.ID}}', '{{.Names}}'] + [
+        '{{.Label "%s.%s"}}' % (LABEL_PREFIX, key) for key in ('job', 'host', 'pid', 'started')
+    ])
+    output = subprocess.check_output(["docker", "ps", "-a", "--filter", label_filter, "--format", template],
+                                     encoding='utf-8', timeout=60)
+    containers = []
+    for line in output.splitlines():
+        fields = line.split("\t")
+        if len(fields) != 6:
+            continue
+        containers.append(dict(zip(('id', 'name', 'job', 'host', 'pid', 'started'), fields)))
+    return containers
+
+
+def remove_job_containers(job_id: str) -> List[str]:
+    try:
+        containers = list_managed_containers(job_id)
+    except (OSError, subprocess.SubprocessError):
+        return []
+    return remove_containers([container['name'] for container in containers])
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def find_orphan_containers(containers: List[Dict[str, str]], finished_jobs: set,
+                           max_age: Optional[float], now: float = None) -> List[Tuple[Dict[str, str], str]]:
+    now = now or time.time()
+    hostname = socket.gethostname()
+    orphans = []
+    for container in containers:
+        if container['job'] and container['job'] in finished_jobs:
+            orphans.append((container, 'job finished'))
+        elif container['host'] == hostname and container['pid'].isdigit() and \
+                not _process_alive(int(container['pid'])):
+            orphans.append((container, 'owner process exited'))
+        elif max_age and container['started'].isdigit() and now - int(container['started']) > max_age:
+            orphans.append((container, 'exceeded max lifetime'))
+    return orphans
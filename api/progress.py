@@ -0,0 +1,96 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api.utils import remove_protocol
+
+_snapshot_header = re.compile(r'^\[\+] \[[^\]]+] "(.+)"\s*$')
+_snapshot_url = re.compile(r'^\s+(https?://\S+)\s*$')
+_archive_path = re.compile(r'^\s+> (\./archive/\S+)\s*$')
+_extractor = re.compile(r'^\s+> ([a-z_]+)\s*$')
+_snapshot_stats = re.compile(r'^\s+\d+ files? \(.*\) in ')
+
+
+class ArchiveLogParser:
+    """逐行解析 ArchiveBox add 的输出，在读取过程中产生每个 URL 的进度事件"""
+
+    def __init__(self, urls: List[str]):
+        self.urls = {remove_protocol(url): url for url in urls}
+        self.url: Optional[str] = None
+        self.archive_path: Optional[str] = None
+        self.extractor: Optional[str] = None
+        self.extractor_failed = False
+        self.in_snapshot = False
+
+    def feed(self, line: str) -> List[Dict[str, Any]]:
+        line = line.rstrip("\r\n")
+        events = []
+
+        if line.startswith('['):
+            events.extend(self._finish_snapshot())
+            if _snapshot_header.match(line):
+                self.in_snapshot = True
+            return events
+
+        if not self.in_snapshot:
+            return events
+
+        if self.url is None:
+            match = _snapshot_url.match(line)
+            if match:
+                self.url = self.urls.get(remove_protocol(match.group(1)), match.group(1))
+                events.append({'event': 'url_started', 'url': self.url})
+            return events
+
+        if self.archive_path is None:
+            match = _archive_path.match(line)
+            if match:
+                self.archive_path = match.group(1)
+                events.append({'event': 'archive_path', 'url': self.url, 'archive_path': self.archive_path})
+            return events
+
+        match = _extractor.match(line)
+        if match:
+            events.extend(self._finish_extractor())
+            self.extractor = match.group(1)
+            events.append({'event': 'extractor_started', 'url': self.url, 'extractor': self.extractor})
+        elif 'Extractor failed' in line:
+            self.extractor_failed = True
+        elif _snapshot_stats.match(line):
+            events.extend(self._finish_snapshot())
+
+        return events
+
+    def close(self) -> List[Dict[str, Any]]:
+        return self._finish_snapshot()
+
+    def _finish_extractor(self) -> List[Dict[str, Any]]:
+        if self.extractor is None:
+            return []
+        event = {
+            'event': 'extractor_finished',
+            'url': self.url,
+            'extractor': self.extractor,
+            'status': 'failed' if self.extractor_failed else 'succeeded',
+        }
+        self.extractor = None
+        self.extractor_failed = False
+        return [event]
+
+    def _finish_snapshot(self) -> List[Dict[str, Any]]:
+        if not self.in_snapshot:
+            return []
+        events = self._finish_extractor()
+        if self.url is not None:
+            events.append({'event': 'snapshot_finished', 'url': self.url, 'archive_path': self.archive_path})
+        self.url = None
+        self.archive_path = None
+        self.in_snapshot = False
+        return events
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    data = {key: value for key, value in event.items() if key != 'event'}
+    return f"event: {event['event']}\ndata: {json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)}\n\n"
@@ -0,0 +1,452 @@
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from array import array
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.fieldsets import FieldSet, build_targets
+from api.models import ChangeLog, Result, Tagging, Target
+from api.tag_index import parse_tag_query
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL = 60
+# 同时等待的日志 ID 空洞上限，序列一次跳过大量 ID 时只等待最近的部分
+MAX_LOG_GAPS = 10000
+
+_model = None
+_model_lock = threading.Lock()
+_building = False
+
+
+def read_model_enabled() -> bool:
+    return os.getenv('READ_MODEL_ENABLED', 'false').lower() == 'true'
+
+
+def get_max_lag() -> float:
+    return float(os.getenv('READ_MODEL_MAX_LAG', '30'))
+
+
+def get_log_retention() -> timedelta:
+    return timedelta(seconds=float(os.getenv('READ_MODEL_LOG_RETENTION', '86400')))
+
+
+def get_gap_timeout() -> float:
+    return float(os.getenv('READ_MODEL_GAP_TIMEOUT', '300'))
+
+
+def record_changes(changes: List[Tuple[str, Dict[str, Any]]]) -> None:
+    """写入变更日志，未启用读模型时不写入"""
+    if changes and read_model_enabled():
+        ChangeLog.objects.bulk_create([ChangeLog(kind=kind, data=data) for kind, data in changes])
+
+
+def target_change(target: Target) -> Tuple[str, Dict[str, Any]]:
+    return 'target', {'id': str(target.id), 'url': target.url, 'domain': target.domain}
+
+
+def result_change(result: Result) -> Tuple[str, Dict[str, Any]]:
+    return 'result', {'target_id': str(result.target_id_id), 'timestamp': float(result.timestamp),
+                      'extractor': result.extractor, 'status': bool(result.status), 'output': result.output}
+
+
+def tagging_change(target: Target, tag_name: str) -> Tuple[str, Dict[str, Any]]:
+    return 'tagging', {'target_id': str(target.id), 'tag': tag_name}
+
+
+def removal_change(target_id: Any) -> Tuple[str, Dict[str, Any]]:
+    return 'target_removed', {'id': str(target_id)}
+
+
+class StringPool:
+    """相同的字符串只保存一份，列中只存编号"""
+    __slots__ = ('strings', 'codes')
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def lookup(self, value: str) -> Optional[int]:
+        return self.codes.get(value)
+
+    def __getitem__(self, code: int) -> str:
+        return self.strings[code]
+
+    def memory(self) -> int:
+        return (sys.getsizeof(self.strings) + sys.getsizeof(self.codes)
+                + sum(sys.getsizeof(value) for value in self.strings))
+
+
+class TargetRecord:
+    __slots__ = ('url', 'domain', 'tags', 'first_result', 'last_result')
+
+    def __init__(self, url: str, domain: int):
+        self.url = url
+        self.domain = domain
+        self.tags: Tuple[int, ...] = ()
+        self.first_result = -1
+        self.last_result = -1
+
+
+class ResultColumns:
+    """每个结果占各列中的一行，同一目标的结果通过 next 串成链表，不为每个目标单独分配数组；
+    output 拆成目录和文件名分别去重，同一快照的结果共享目录"""
+    __slots__ = ('extractor', 'status', 'timestamp', 'output_dir', 'output_name', 'next')
+
+    def __init__(self):
+        self.extractor = array('I')
+        self.status = bytearray()
+        self.timestamp = array('d')
+        self.output_dir = array('I')
+        self.output_name = array('I')
+        self.next = array('i')
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def memory(self) -> int:
+        return sum(sys.getsizeof(getattr(self, name)) for name in self.__slots__)
+
+
+class ReadModel:
+    """目标、标签和提取结果的内存副本，回答 list 接口的筛选而不访问数据库"""
+
+    def __init__(self):
+        self.strings = StringPool()
+        self.targets: List[TargetRecord] = []
+        self.ordinals: Dict[uuid.UUID, int] = {}
+        self.urls: Dict[str, int] = {}
+        self.results = ResultColumns()
+        self.domain_postings: Dict[int, array] = {}
+        self.tag_postings: Dict[int, array] = {}
+        # 删除的目标只做标记，查询时排除，数量较多时重新构建
+        self.removed: Set[int] = set()
+        self.synced_at = 0.0
+        # 已应用的最大日志 ID，以及小于它但尚未读到的 ID（分配后尚未提交的事务）及其发现时间
+        self.last_log_id = 0
+        self.log_gaps: Dict[int, float] = {}
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls) -> 'ReadModel':
+        model = cls()
+        # 先记录日志位置再读取快照，之后应用该位置之后的日志，快照与日志重叠的部分重复应用不影响结果
+        model.start_log_cursor()
+        started = time.monotonic()
+        for target_id, url, domain in Target.objects.order_by('created_at', 'id').values_list(
+                'id', 'url', 'domain').iterator(chunk_size=10000):
+            model.add_target(target_id, url, domain)
+        for target_id, name in Tagging.objects.order_by('created_at', 'id').values_list(
+                'target_id', 'tag_id__name').iterator(chunk_size=10000):
+            model.add_tagging(target_id, name)
+        for row in Result.objects.order_by('created_at', 'id').values_list(
+                'target_id', 'timestamp', 'extractor', 'status', 'output').iterator(chunk_size=10000):
+            model.upsert_result(*row)
+        model.synced_at = started
+        return model
+
+    def add_target(self, target_id: uuid.UUID, url: str, domain: str) -> int:
+        ordinal = self.ordinals.get(target_id)
+        if ordinal is not None:
+            return ordinal
+        ordinal = len(self.targets)
+        record = TargetRecord(url, self.strings.code(domain))
+        self.targets.append(record)
+        self.ordinals[target_id] = ordinal
+        self.urls[url] = ordinal
+        self.domain_postings.setdefault(record.domain, array('I')).append(ordinal)
+        return ordinal
+
+    def add_tagging(self, target_id: uuid.UUID, name: str) -> None:
+        ordinal = self.ordinals.get(target_id)
+        if ordinal is None:
+            return
+        record = self.targets[ordinal]
+        code = self.strings.code(name)
+        if code not in record.tags:
+            record.tags += (code,)
+            self.tag_postings.setdefault(code, array('I')).append(ordinal)
+
+    def remove_target(self, target_id: uuid.UUID) -> None:
+        ordinal = self.ordinals.pop(target_id, None)
+        if ordinal is None:
+            return
+        if self.urls.get(self.targets[ordinal].url) == ordinal:
+            del self.urls[self.targets[ordinal].url]
+        self.removed.add(ordinal)
+
+    def needs_rebuild(self) -> bool:
+        return len(self.removed) > max(len(self.targets) // 4, 1000)
+
+    def upsert_result(self, target_id: uuid.UUID, timestamp: float, extractor: str, status: bool,
+                      output: str) -> None:
+        ordinal = self.ordinals.get(target_id)
+        if ordinal is None:
+            return
+        record = self.targets[ordinal]
+        results = self.results
+        extractor_code = self.strings.code(extractor)
+        output = output or ''
+        split = output.rfind('/') + 1
+        output_dir, output_name = self.strings.code(output[:split]), self.strings.code(output[split:])
+
+        row = record.first_result
+        while row != -1:
+            if results.extractor[row] == extractor_code and results.timestamp[row] == timestamp:
+                results.status[row] = bool(status)
+                results.output_dir[row] = output_dir
+                results.output_name[row] = output_name
+                return
+            row = results.next[row]
+
+        row = len(results)
+        results.extractor.append(extractor_code)
+        results.status.append(bool(status))
+        results.timestamp.append(timestamp)
+        results.output_dir.append(output_dir)
+        results.output_name.append(output_name)
+        results.next.append(-1)
+        if record.last_result == -1:
+            record.first_result = row
+        else:
+            results.next[record.last_result] = row
+        record.last_result = row
+
+    def apply(self, kind: str, data: Dict[str, Any]) -> None:
+        if kind == 'target':
+            self.add_target(uuid.UUID(data['id']), data['url'], data['domain'])
+        elif kind == 'tagging':
+            self.add_tagging(uuid.UUID(data['target_id']), data['tag'])
+        elif kind == 'result':
+            self.upsert_result(uuid.UUID(data['target_id']), data['timestamp'], data['extractor'], data['status'],
+                               data['output'])
+        elif kind == 'target_removed':
+            self.remove_target(uuid.UUID(data['id']))
+
+    def start_log_cursor(self) -> None:
+        """从当前最大的日志 ID 开始读取。最近 READ_MODEL_GAP_TIMEOUT 秒内写入的日志中缺少的 ID
+        可能属于尚未提交的事务，记为空洞，提交后补充应用"""
+        now = time.monotonic()
+        window = timezone.now() - timedelta(seconds=get_gap_timeout())
+        recent = list(ChangeLog.objects.filter(created_at__gte=window).order_by('id').values_list('id', flat=True))
+        self.last_log_id = ChangeLog.objects.aggregate(last=Max('id'))['last'] or 0
+        self.log_gaps = {}
+        if recent:
+            self.advance_log_cursor(recent, now, start=recent[0] - 1)
+
+    def advance_log_cursor(self, ids: List[int], now: float, start: int = None) -> None:
+        """记录读到的日志 ID：补上的空洞移除，跳过的 ID 记为新的空洞，超过 READ_MODEL_GAP_TIMEOUT 秒的空洞
+        视为已回滚的事务，不再等待"""
+        previous = self.last_log_id if start is None else start
+        for log_id in ids:
+            self.log_gaps.pop(log_id, None)
+            if log_id > previous + 1:
+                for missing in range(max(previous + 1, log_id - MAX_LOG_GAPS), log_id):
+                    self.log_gaps.setdefault(missing, now)
+            previous = max(previous, log_id)
+        self.last_log_id = max(self.last_log_id, previous)
+        timeout = get_gap_timeout()
+        expired = [log_id for log_id, seen_at in self.log_gaps.items() if now - seen_at > timeout]
+        for log_id in expired:
+            del self.log_gaps[log_id]
+        if len(self.log_gaps) > MAX_LOG_GAPS:
+            for log_id in sorted(self.log_gaps)[:len(self.log_gaps) - MAX_LOG_GAPS]:
+                del self.log_gaps[log_id]
+
+    def catch_up(self) -> int:
+        """按自增 ID 应用上次读取之后的变更日志，返回读取的条数。并发写入时 ID 的提交顺序与分配顺序不一定一致，
+        先分配后提交的日志通过空洞补充读取，不依赖固定的回看时间"""
+        started = time.monotonic()
+        condition = Q(id__gt=self.last_log_id)
+        if self.log_gaps:
+            condition |= Q(id__in=list(self.log_gaps))
+        changes = list(ChangeLog.objects.filter(condition).order_by('id').values_list('id', 'kind', 'data'))
+        with self.lock:
+            for _, kind, data in changes:
+                self.apply(kind, data)
+            self.advance_log_cursor([log_id for log_id, _, _ in changes], started)
+            self.synced_at = started
+        return len(changes)
+
+    def lag(self) -> float:
+        return time.monotonic() - self.synced_at
+
+    def postings_union(self, postings: Dict[int, array], names: Iterable[str]) -> Set[int]:
+        ordinals = set()
+        for name in names:
+            code = self.strings.lookup(name)
+            if code is not None:
+                ordinals.update(postings.get(code, ()))
+        return ordinals
+
+    def evaluate(self, node: Tuple) -> Set[int]:
+        if node[0] == 'tag':
+            return self.postings_union(self.tag_postings, [node[1]])
+        if node[0] == 'not':
+            return set(range(len(self.targets))) - self.evaluate(node[1])
+        values = [self.evaluate(item) for item in node[1]]
+        return set.intersection(*values) if node[0] == 'and' else set.union(*values)
+
+    def select(self, data: Dict[str, Any]) -> Iterable[int]:
+        """与 filter_target_queryset 相同的筛选条件，返回按写入顺序排列的目标编号"""
+        selected: Optional[Set[int]] = None
+        filters = []
+        if data.get('tag_names'):
+            filters.append(lambda: self.postings_union(self.tag_postings, data['tag_names']))
+        if data.get('tag_query'):
+            filters.append(lambda: self.evaluate(parse_tag_query(data['tag_query'])))
+        if data.get('domains'):
+            filters.append(lambda: self.postings_union(self.domain_postings, data['domains']))
+        if data.get('urls'):
+            filters.append(lambda: {self.urls[url] for url in data['urls'] if url in self.urls})
+        for build in filters:
+            selected = build() if selected is None else selected & build()
+            if not selected:
+                return []
+        if selected is None:
+            ordinals = range(len(self.targets))
+            return [ordinal for ordinal in ordinals if ordinal not in self.removed] if self.removed else ordinals
+        return sorted(selected - self.removed)
+
+    def result_rows(self, ordinal: int, fieldset: FieldSet, extractors: Set[int], latest_only: bool) -> List[Tuple]:
+        results = self.results
+        rows = []
+        row = self.targets[ordinal].first_result
+        while row != -1:
+            if not extractors or results.extractor[row] in extractors:
+                rows.append(row)
+            row = results.next[row]
+        if latest_only:
+            latest: Dict[int, float] = {}
+            for row in rows:
+                latest[results.extractor[row]] = max(latest.get(results.extractor[row], results.timestamp[row]),
+                                                     results.timestamp[row])
+            rows = [row for row in rows if results.timestamp[row] == latest[results.extractor[row]]]
+        rows.sort(key=lambda x: -results.timestamp[x])
+
+        columns = {
+            'target_id': lambda _: ordinal,
+            'status': lambda x: bool(results.status[x]),
+            'timestamp': lambda x: results.timestamp[x],
+            'extractor': lambda x: self.strings[results.extractor[x]],
+            'output': lambda x: self.strings[results.output_dir[x]] + self.strings[results.output_name[x]],
+        }
+        getters = [columns[name] for name in fieldset.result_columns]
+        return [tuple(getter(row) for getter in getters) for row in rows]
+
+    def filter_targets(self, data: Dict[str, Any], fieldset: FieldSet) -> List[Dict[str, Any]]:
+        """返回与数据库查询相同结构的结果，行的组装复用 build_targets"""
+        extractor_names = data.get('extractors') or []
+        with self.lock:
+            # 不存在的提取器编号为 None，不会匹配任何结果
+            extractors = {self.strings.lookup(name) for name in extractor_names}
+            target_rows, result_rows, tag_rows = [], [], []
+            for ordinal in self.select(data):
+                record = self.targets[ordinal]
+                values = {'id': ordinal, 'url': record.url, 'domain': self.strings[record.domain]}
+                target_rows.append(tuple(values[name] for name in fieldset.target_columns))
+                if fieldset.result:
+                    result_rows.extend(self.result_rows(ordinal, fieldset, extractors,
+                                                        data.get('latest_only', False)))
+                if 'tags' in fieldset.target:
+                    tag_rows.extend((ordinal, self.strings[code]) for code in record.tags)
+        return build_targets(target_rows, result_rows, tag_rows, fieldset)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            records = sum(sys.getsizeof(record) + sys.getsizeof(record.url) + sys.getsizeof(record.tags)
+                          for record in self.targets) + sys.getsizeof(self.targets)
+            lookups = (sys.getsizeof(self.ordinals) + sys.getsizeof(self.urls)
+                       + sum(sys.getsizeof(target_id) + sys.getsizeof(target_id.int) for target_id in self.ordinals))
+            postings = sum(sys.getsizeof(postings) + sum(sys.getsizeof(value) for value in postings.values())
+                           for postings in (self.domain_postings, self.tag_postings))
+            memory = {
+                'targets': records,
+                'results': self.results.memory(),
+                'strings': self.strings.memory(),
+                'lookups': lookups,
+                'postings': postings,
+            }
+            memory['total'] = sum(memory.values())
+            return {
+                'targets': len(self.targets) - len(self.removed),
+                'removed': len(self.removed),
+                'results': len(self.results),
+                'tags': len(self.tag_postings),
+                'domains': len(self.domain_postings),
+                'strings': len(self.strings.strings),
+                'lag_seconds': round(self.lag(), 3),
+                'memory_bytes': memory,
+            }
+
+
+def _run_model() -> None:
+    """构建读模型后持续应用变更日志；落后超过日志保留时间时重新构建"""
+    global _model, _building
+    poll_interval = float(os.getenv('READ_MODEL_POLL_INTERVAL', '1'))
+    retention = get_log_retention()
+    model = None
+    pruned_at = 0.0
+    try:
+        while read_model_enabled():
+            try:
+                if model is None or model.lag() > retention.total_seconds() / 2 or model.needs_rebuild():
+                    model = ReadModel.build()
+                    with _model_lock:
+                        _model = model
+                else:
+                    model.catch_up()
+                if time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                    ChangeLog.objects.filter(created_at__lt=timezone.now() - retention).delete()
+                    pruned_at = time.monotonic()
+            except Exception:
+                logger.exception("Failed to update read model")
+            finally:
+                connections.close_all()
+            time.sleep(poll_interval)
+    finally:
+        with _model_lock:
+            _building = False
+
+
+def get_read_model() -> Optional[ReadModel]:
+    """返回已同步的读模型；未启用、尚未构建完成或同步落后超过 READ_MODEL_MAX_LAG 秒时返回 None，
+    调用方回退到数据库查询。首次调用时在后台线程中构建"""
+    global _building
+    if not read_model_enabled():
+        return None
+    with _model_lock:
+        model = _model
+        if not _building:
+            _building = True
+            threading.Thread(target=_run_model, name='archivebox-read-model', daemon=True).start()
+    if model is None or model.lag() > get_max_lag():
+        return None
+    return model
+
+
+def read_model_stats() -> Dict[str, Any]:
+    with _model_lock:
+        model = _model
+    stats = {'enabled': read_model_enabled(), 'ready': get_read_model() is not None}
+    if model is not None:
+        stats.update(model.stats())
+    return stats
@@ -0,0 +1,82 @@
+import math
+import os
+from datetime import datetime, time, timedelta
+from typing import List, Optional, Tuple
+
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, IntegerField, Max, Min, Q, \
+    QuerySet, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.models import Target
+
+load_dotenv()
+
+
+def parse_windows(value: str) -> List[Tuple[time, time]]:
+    """解析 "01:00-06:00,22:00-23:30" 形式的时间窗口，结束时间早于开始时间表示跨越午夜"""
+    windows = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        start, end = item.split("-")
+        windows.append((time.fromisoformat(start.strip()), time.fromisoformat(end.strip())))
+    return windows
+
+
+def seconds_left_in_window(now: datetime, windows: List[Tuple[time, time]]) -> Optional[float]:
+    """当前所在时间窗口的剩余秒数，不在任何窗口内时返回 None；未配置窗口视为全天可用"""
+    if not windows:
+        return float(24 * 3600)
+    current = now.time().replace(tzinfo=None)
+    for start, end in windows:
+        start_dt = now.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+        end_dt = now.replace(hour=end.hour, minute=end.minute, second=0, microsecond=0)
+        if start <= end:
+            if start <= current < end:
+                return (end_dt - now).total_seconds()
+        elif current >= start:
+            return (end_dt + timedelta(days=1) - now).total_seconds()
+        elif current < end:
+            return (end_dt - now).total_seconds()
+    return None
+
+
+def refresh_budget(due_count: int, free_slots: int, batch_size: int, ticks_left: int) -> int:
+    """本轮最多派发的目标数：受空闲任务槽限制，并把到期目标平均分摊到窗口内剩余的轮次"""
+    if due_count <= 0 or free_slots <= 0:
+        return 0
+    spread = math.ceil(due_count / max(ticks_left, 1))
+    return min(free_slots * batch_size, due_count, max(spread, 1))
+
+
+def get_default_refresh_interval() -> Optional[timedelta]:
+    seconds = float(os.getenv('REFRESH_DEFAULT_INTERVAL', '0'))
+    return timedelta(seconds=seconds) if seconds > 0 else None
+
+
+def due_targets(now: datetime = None) -> QuerySet:
+    """按优先级和过期程度排序的待刷新目标，最近一次存档时间取 Result.end_ts 的最大值"""
+    now = now or timezone.now()
+    requeue_after = timedelta(seconds=float(os.getenv('REFRESH_REQUEUE_AFTER', '21600')))
+    policy_filter = Q(tagging__tag_id__refreshpolicy__enabled=True)
+    default_interval = get_default_refresh_interval()
+
+    interval = Min('tagging__tag_id__refreshpolicy__interval', filter=policy_filter)
+    if default_interval:
+        interval = Coalesce(interval, Value(default_interval, output_field=DurationField()))
+
+    return Target.objects.annotate(
+        last_archived=Max('result__end_ts'),
+        refresh_interval=interval,
+        refresh_priority=Coalesce(Max('tagging__tag_id__refreshpolicy__priority', filter=policy_filter), Value(0),
+                                  output_field=IntegerField()),
+    ).annotate(
+        due_at=ExpressionWrapper(F('last_archived') + F('refresh_interval'), output_field=DateTimeField()),
+    ).filter(
+        refresh_interval__isnull=False, last_archived__isnull=False, due_at__lte=now
+    ).exclude(
+        refresh_queued_at__gte=now - requeue_after
+    ).order_by('-refresh_priority', 'due_at')
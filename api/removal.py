@@ -0,0 +1,88 @@
+import os
+from typing import Any, Dict, List
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.models import ArchiveFile, Result, Tagging, Target
+from api.processes import get_command_timeout
+from api.read_model import record_changes, removal_change
+from api.stats import release_targets_summary, release_targets_usage
+from api.tag_index import invalidate_tag_index
+from api.tiering import delete_bundles
+from api.utils import error_response, execute_docker_compose_archivebox_command, format_snapshot_timestamp, \
+    success_response
+
+load_dotenv()
+
+# 每个 ArchiveFile 删除语句中的快照目录数量，避免 OR 条件过长
+ARCHIVE_FILE_BATCH = 100
+
+
+def get_transaction_size() -> int:
+    return int(os.getenv('REMOVE_TRANSACTION_SIZE', '200'))
+
+
+def build_remove_args(delete_files: bool) -> str:
+    # URL 通过标准输入传入，按完整 URL 精确匹配
+    args = "remove --yes --filter-type=exact"
+    if delete_files:
+        args += " --delete"
+    return args
+
+
+def remove_snapshots(urls: List[str], delete_files: bool = True) -> Dict[str, Any]:
+    """通过 ArchiveBox 删除一批 URL 的快照，ArchiveBox 中已经不存在的 URL 视为删除成功"""
+    result = execute_docker_compose_archivebox_command(build_remove_args(delete_files),
+                                                       stdin="\n".join(urls) + "\n",
+                                                       timeout=get_command_timeout(len(urls)))
+    if result["status"] == "error" and 'No matching' in (result.get('stderr') or ''):
+        return success_response("No matching snapshots in ArchiveBox.")
+    return result
+
+
+def delete_targets(urls: List[str]) -> int:
+    """删除 URL 对应的目标及其结果和标签，每个事务最多 REMOVE_TRANSACTION_SIZE 个目标，
+    不会长时间占用数据库写锁；统计与删除在同一事务中扣除"""
+    target_ids = list(Target.objects.filter(url__in=urls).values_list('id', flat=True))
+    size = get_transaction_size()
+    for start in range(0, len(target_ids), size):
+        batch = target_ids[start:start + size]
+        with transaction.atomic():
+            # 先执行不需要读取的写语句，SQLite 在事务开始时即获得写锁，不会在读之后升级锁失败；
+            # 统计在同一事务中扣除，删除失败时统计随之回滚，并发写入也不会在扣除和删除之间插入新的结果
+            Target.objects.filter(id__in=batch).update(updated_at=timezone.now())
+            release_targets_usage(batch)
+            release_targets_summary(batch)
+            timestamps = set(Result.objects.filter(target_id__in=batch).values_list('timestamp', flat=True))
+            timestamps.update(Target.objects.filter(id__in=batch).values_list('timestamp', flat=True))
+            Result.objects.filter(target_id__in=batch).delete()
+            Tagging.objects.filter(target_id__in=batch).delete()
+            Target.objects.filter(id__in=batch).delete()
+        delete_archive_files(timestamps)
+        delete_bundles({format_snapshot_timestamp(timestamp) for timestamp in timestamps})
+        record_changes([removal_change(target_id) for target_id in batch])
+    if target_ids:
+        invalidate_tag_index()
+    return len(target_ids)
+
+
+def delete_archive_files(timestamps: Any) -> None:
+    """删除去重索引中属于这些快照目录的文件记录"""
+    prefixes = sorted({f"{format_snapshot_timestamp(timestamp)}/" for timestamp in timestamps})
+    for start in range(0, len(prefixes), ARCHIVE_FILE_BATCH):
+        condition = Q()
+        for prefix in prefixes[start:start + ARCHIVE_FILE_BATCH]:
+            condition |= Q(path__startswith=prefix)
+        ArchiveFile.objects.filter(condition).delete()
+
+
+def remove_targets_chunk(urls: List[str], delete_files: bool = True) -> Dict[str, Any]:
+    """删除一批 URL：ArchiveBox 删除失败时保留数据库中的记录，以便重新执行"""
+    result = remove_snapshots(urls, delete_files)
+    if result["status"] == "error":
+        return error_response(f"ArchiveBox failed to remove snapshots: {result['message']}",
+                              stderr=result.get('stderr', ''))
+    return success_response("Targets removed.", removed=delete_targets(urls))
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Any, Dict, List, Tuple
+
+from django.db.models import Exists, F, OuterRef, Q, QuerySet
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.models import Result, Target
+from api.utils import apply_target_filters
+
+load_dotenv()
+
+
+def get_retry_max_attempts() -> int:
+    return int(os.getenv('RETRY_MAX_ATTEMPTS', '3'))
+
+
+def retry_backoff(retry_count: int) -> timedelta:
+    """第 n 次重试失败后等待 base * 2^(n-1) 秒，最长不超过 RETRY_BACKOFF_MAX"""
+    base = float(os.getenv('RETRY_BACKOFF_BASE', '600'))
+    maximum = float(os.getenv('RETRY_BACKOFF_MAX', '86400'))
+    return timedelta(seconds=min(base * 2 ** max(retry_count - 1, 0), maximum))
+
+
+def failed_results(data: Dict[str, Any], force: bool = False, now: datetime = None) -> QuerySet:
+    """目标当前快照中失败、且没有其他成功记录的提取结果"""
+    now = now or timezone.now()
+    results = Result.objects.filter(status=False, timestamp=F('target_id__timestamp'))
+    targets, has_target_filter = apply_target_filters(data)
+    if has_target_filter:
+        results = results.filter(target_id__in=targets.values('id'))
+    extractors = data.get('extractors', [])
+    if extractors:
+        results = results.filter(extractor__in=extractors)
+    if not force:
+        results = results.filter(retry_count__lt=get_retry_max_attempts()).filter(
+            Q(next_retry_at__isnull=True) | Q(next_retry_at__lte=now))
+    succeeded = Result.objects.filter(status=True, target_id=OuterRef('target_id'), extractor=OuterRef('extractor'))
+    return results.exclude(Exists(succeeded))
+
+
+def group_failed_targets(data: Dict[str, Any], force: bool = False,
+                         now: datetime = None) -> Dict[Tuple[str, ...], List[Tuple[str, str, float]]]:
+    """按失败的提取器组合对目标分组，同一组的目标可以用同一条命令重试"""
+    rows = failed_results(data, force, now).order_by('target_id', 'extractor').values_list(
+        'target_id', 'target_id__url', 'target_id__timestamp', 'extractor')
+    groups: Dict[Tuple[str, ...], List[Tuple[str, str, float]]] = {}
+    for (target_id, url, timestamp), items in groupby(rows.iterator(), key=lambda row: row[:3]):
+        extractors = tuple(sorted({row[3] for row in items}))
+        groups.setdefault(extractors, []).append((str(target_id), url, timestamp))
+    return groups
+
+
+def record_retry_attempt(target: Target, timestamp: float, extractors: List[str], now: datetime = None) -> int:
+    """记录一次重试，仍然失败的结果按退避时间推迟下次重试，返回成功的数量"""
+    now = now or timezone.now()
+    results = Result.objects.filter(target_id=target, timestamp=timestamp, extractor__in=extractors)
+    succeeded = 0
+    for result in results:
+        result.retry_count += 1
+        if result.status:
+            succeeded += 1
+            result.next_retry_at = None
+        else:
+            result.next_retry_at = now + retry_backoff(result.retry_count)
+        result.save(update_fields=['retry_count', 'next_retry_at', 'updated_at'])
+    return succeeded
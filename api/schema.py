@@ -0,0 +1,39 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple, Type
+
+# 服务进程中只记录视图上的文档参数，生成 OpenAPI 文档时才导入 drf_yasg 并应用，避免每个进程启动时加载
+_pending_annotations: List[Tuple[Callable, Dict[str, Any]]] = []
+
+
+class SchemaResponse(NamedTuple):
+    description: str
+    serializer: Type
+
+
+def swagger_auto_schema(**kwargs) -> Callable:
+    """与 drf_yasg.utils.swagger_auto_schema 参数相同，延迟到 apply_schema_annotations 时生效"""
+    def decorator(view: Callable) -> Callable:
+        _pending_annotations.append((view, kwargs))
+        return view
+    return decorator
+
+
+def _resolve_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    from drf_yasg import openapi
+
+    responses = kwargs.get('responses')
+    if not responses:
+        return kwargs
+    return {**kwargs, 'responses': {
+        code: openapi.Response(description=response.description, schema=response.serializer())
+        if isinstance(response, SchemaResponse) else response
+        for code, response in responses.items()
+    }}
+
+
+def apply_schema_annotations() -> None:
+    """按声明顺序把记录的参数交给 drf_yasg，需要在加载 URL 配置之后调用"""
+    from drf_yasg.utils import swagger_auto_schema as drf_yasg_swagger_auto_schema
+
+    while _pending_annotations:
+        view, kwargs = _pending_annotations.pop(0)
+        drf_yasg_swagger_auto_schema(**_resolve_kwargs(kwargs))(view)
@@ -1,7 +1,26 @@
-from drf_yasg import openapi
 from rest_framework import serializers
 
+from api.fieldsets import FieldSet
+from api.importer import IMPORT_PARSERS
 from api.models import Result, Target, Tag, Tagging
+from api.schema import SchemaResponse
+from api.tag_index import TagQueryError, parse_tag_query
+from api.webhooks import check_webhook_url, get_webhook_secret
+
+EXTRACTOR_CHOICES = [
+    "title", "screenshot", "git", "favicon", "headers", "singlefile", "pdf", "dom", "wget", "readability",
+    "mercury", "htmltotext", "media", "archive_org"
+]
+
+
+def check_callback_url(value: str) -> str:
+    # callback_url 的通知使用 WEBHOOK_SECRET 签名，未配置时接收方无法验证通知来源
+    if not get_webhook_secret():
+        raise serializers.ValidationError("callback_url requires WEBHOOK_SECRET to be configured.")
+    error = check_webhook_url(value)
+    if error:
+        raise serializers.ValidationError(error)
+    return value
 
 
 class AddUrlsSerializer(serializers.Serializer):
@@ -39,10 +58,7 @@ class AddUrlsSerializer(serializers.Serializer):
         help_text="从头开始重新存档 URL，覆盖任何现有文件。"
     )
     extractors = serializers.ListField(
-        child=serializers.ChoiceField(choices=[
-            "title", "screenshot", "git", "favicon", "headers", "singlefile", "pdf", "dom", "wget", "readability",
-            "mercury", "htmltotext", "media", "archive_org"
-        ]),
+        child=serializers.ChoiceField(choices=EXTRACTOR_CHOICES),
         required=False,
         help_text="传递要使用的提取器列表，使用列表形式。例如：['title','screenshot','git']"
     )
@@ -53,6 +69,28 @@ class AddUrlsSerializer(serializers.Serializer):
         required=False,
         help_text="用于读取输入 URL 的解析器。",
     )
+    plan = serializers.BooleanField(
+        default=None,
+        allow_null=True,
+        required=False,
+        help_text="是否根据各域名的历史结果调整提取器，不传时由 EXTRACTOR_PLANNER_ENABLED 决定。"
+    )
+    callback_url = serializers.URLField(
+        max_length=2000,
+        required=False,
+        help_text="完成后接收签名 POST 通知的地址，使用 WEBHOOK_SECRET 签名，需要先配置 WEBHOOK_SECRET，只能是公网地址。"
+    )
+    lanes = serializers.BooleanField(
+        default=None,
+        allow_null=True,
+        required=False,
+        help_text="是否先执行轻量提取器并立即入库，重量级提取器放到慢速通道的任务中，不传时由 EXTRACTOR_LANES_ENABLED 决定。"
+    )
+    fan_out = serializers.BooleanField(
+        default=False,
+        required=False,
+        help_text="与 depth=1 一起使用：先存档种子页面，再把页面中尚未存档的链接拆分为并行执行的任务。"
+    )
 
     @staticmethod
     def validate_extractors(value):
@@ -66,6 +104,70 @@ class AddUrlsSerializer(serializers.Serializer):
             return ",".join(value)
         return ""
 
+    @staticmethod
+    def validate_callback_url(value):
+        return check_callback_url(value)
+
+    def validate(self, attrs):
+        if attrs.get('fan_out') and attrs.get('depth', 0) != 1:
+            raise serializers.ValidationError({'fan_out': "fan_out requires depth=1."})
+        return attrs
+
+
+class ImportUrlsSerializer(serializers.Serializer):
+    file = serializers.FileField(
+        required=True,
+        help_text="包含 URL 的文件，支持 txt、jsonl 和 netscape_html 格式。"
+    )
+    parser = serializers.ChoiceField(
+        choices=IMPORT_PARSERS,
+        default='txt',
+        required=False,
+        help_text="上传文件的格式。"
+    )
+    tag = serializers.ListField(
+        child=serializers.CharField(max_length=100),
+        required=False,
+        help_text="为导入的 URL 打上标签。"
+    )
+    update = serializers.BooleanField(
+        default=False,
+        required=False,
+        help_text="重试之前跳过/失败的链接。"
+    )
+    overwrite = serializers.BooleanField(
+        default=False,
+        required=False,
+        help_text="从头开始重新存档 URL，覆盖任何现有文件。"
+    )
+    extractors = serializers.ListField(
+        child=serializers.ChoiceField(choices=EXTRACTOR_CHOICES),
+        required=False,
+        help_text="传递要使用的提取器列表，使用列表形式。例如：['title','screenshot','git']"
+    )
+    chunk_size = serializers.IntegerField(
+        default=500,
+        required=False,
+        min_value=1,
+        max_value=5000,
+        help_text="每批交给 ArchiveBox 处理的 URL 数量。"
+    )
+    callback_url = serializers.URLField(
+        max_length=2000,
+        required=False,
+        help_text="每批完成后接收签名 POST 通知的地址，使用 WEBHOOK_SECRET 签名，需要先配置 WEBHOOK_SECRET，只能是公网地址。"
+    )
+
+    @staticmethod
+    def validate_extractors(value):
+        if value:
+            return ",".join(value)
+        return ""
+
+    @staticmethod
+    def validate_callback_url(value):
+        return check_callback_url(value)
+
 
 class ResultSerializer(serializers.ModelSerializer):
     class Meta:
@@ -120,12 +222,17 @@ class TargetSerializer(serializers.ModelSerializer):
         return [tagging.tag_id.name for tagging in taggings]
 
 
-class FilterTargetsSerializer(serializers.Serializer):
+class BaseTargetFilterSerializer(serializers.Serializer):
     tag_names = serializers.ListField(
         child=serializers.CharField(max_length=100),
         required=False,
         help_text="用于筛选目标的标签名称列表。"
     )
+    tag_query = serializers.CharField(
+        max_length=2000,
+        required=False,
+        help_text="标签表达式，支持 AND、OR、NOT 和括号，例如：(news OR tech) AND NOT spam。含空格的标签用双引号。"
+    )
     domains = serializers.ListField(
         child=serializers.CharField(max_length=100),
         required=False,
@@ -137,14 +244,203 @@ class FilterTargetsSerializer(serializers.Serializer):
         help_text="用于筛选目标的URL列表。"
     )
     extractors = serializers.ListField(
-        child=serializers.ChoiceField(choices=[
-            "title", "screenshot", "git", "favicon", "headers", "singlefile", "pdf", "dom", "wget", "readability",
-            "mercury", "htmltotext", "media", "archive_org"
-        ]),
+        child=serializers.ChoiceField(choices=EXTRACTOR_CHOICES),
         required=False,
         help_text="用于筛选提取器。"
     )
 
+    def validate_tag_query(self, value):
+        try:
+            parse_tag_query(value)
+        except TagQueryError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+
+class FilterTargetsSerializer(BaseTargetFilterSerializer):
+    fields = serializers.CharField(
+        max_length=500,
+        required=False,
+        help_text="只返回指定的字段，用逗号分隔，例如：url,domain,tags,results.extractor,results.status。"
+    )
+    latest_only = serializers.BooleanField(
+        default=False,
+        required=False,
+        help_text="每个提取器只返回最新一次的结果。"
+    )
+
+    @staticmethod
+    def validate_fields(value):
+        try:
+            FieldSet.parse(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+
+class ExportSerializer(BaseTargetFilterSerializer):
+    entity = serializers.ChoiceField(
+        choices=['targets', 'results', 'tags'],
+        default='results',
+        required=False,
+        help_text="导出的数据类型：targets、results 或 tags。"
+    )
+    format = serializers.ChoiceField(
+        choices=['ndjson', 'csv'],
+        default='ndjson',
+        required=False,
+        help_text="导出格式：ndjson 或 csv。"
+    )
+    since = serializers.DateTimeField(
+        required=False,
+        help_text="增量导出，只导出 updated_at 晚于该时间的记录，传上次导出的最后一条记录的 updated_at。"
+    )
+    since_id = serializers.UUIDField(
+        required=False,
+        help_text="与 since 一起使用，传上次导出的最后一条记录的 id，updated_at 相同的记录中只导出 id 更大的。"
+    )
+    compress = serializers.BooleanField(
+        default=True,
+        required=False,
+        help_text="是否使用 gzip 压缩导出内容。"
+    )
+
+    def validate(self, attrs):
+        if attrs.get('since_id') and not attrs.get('since'):
+            raise serializers.ValidationError({'since_id': "since_id requires since."})
+        return attrs
+
+
+class RetryFailedSerializer(BaseTargetFilterSerializer):
+    batch_size = serializers.IntegerField(
+        default=50,
+        required=False,
+        min_value=1,
+        max_value=1000,
+        help_text="每条 ArchiveBox 命令重试的目标数量。"
+    )
+    force = serializers.BooleanField(
+        default=False,
+        required=False,
+        help_text="忽略重试次数上限和退避时间，立即重试所有失败的提取器。"
+    )
+
+
+class RemoveTargetsSerializer(BaseTargetFilterSerializer):
+    # 删除以目标为单位，不按提取器筛选
+    extractors = None
+    batch_size = serializers.IntegerField(
+        default=100,
+        required=False,
+        min_value=1,
+        max_value=1000,
+        help_text="每条 archivebox remove 命令删除的目标数量。"
+    )
+    delete_files = serializers.BooleanField(
+        default=True,
+        required=False,
+        help_text="是否同时删除快照文件（archivebox remove --delete）。"
+    )
+
+    def validate(self, attrs):
+        if not any(attrs.get(key) for key in ('tag_names', 'tag_query', 'domains', 'urls')):
+            raise serializers.ValidationError("At least one filter is required to remove targets.")
+        return attrs
+
+
+class RefreshPolicySerializer(serializers.Serializer):
+    tag = serializers.CharField(
+        max_length=100,
+        help_text="应用刷新策略的标签名称。"
+    )
+    interval = serializers.IntegerField(
+        min_value=60,
+        help_text="重新存档的间隔（秒），距离最近一次存档超过该时间的目标会被刷新。"
+    )
+    priority = serializers.IntegerField(
+        default=0,
+        required=False,
+        help_text="优先级，数值越大越先刷新。"
+    )
+    enabled = serializers.BooleanField(
+        default=True,
+        required=False,
+        help_text="是否启用该策略。"
+    )
+
+
+class WebhookSubscriptionSerializer(serializers.Serializer):
+    tag = serializers.CharField(
+        max_length=100,
+        help_text="订阅的标签名称，带有该标签的 URL 每次存档完成后都会发送通知。"
+    )
+    url = serializers.URLField(
+        max_length=2000,
+        help_text="接收通知的地址，只能是公网地址。"
+    )
+    secret = serializers.CharField(
+        max_length=100,
+        required=False,
+        help_text="签名密钥，不传时自动生成，只在创建时返回。"
+    )
+
+    @staticmethod
+    def validate_url(value):
+        error = check_webhook_url(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
+
+class RefreshRunSerializer(serializers.Serializer):
+    force = serializers.BooleanField(
+        default=False,
+        required=False,
+        help_text="忽略刷新时间窗口，立即派发到期的目标。"
+    )
+
+
+class StorageStatsSerializer(serializers.Serializer):
+    scope = serializers.ChoiceField(
+        choices=['target', 'domain', 'tag', 'extractor'],
+        default='tag',
+        required=False,
+        help_text="统计维度：target、domain、tag 或 extractor。"
+    )
+    key = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        help_text="只返回指定的目标 ID、域名、标签或提取器，可重复。"
+    )
+    limit = serializers.IntegerField(
+        default=100,
+        required=False,
+        min_value=1,
+        max_value=10000,
+        help_text="按占用空间从大到小返回的条数。"
+    )
+
+
+class ResultStatsSerializer(serializers.Serializer):
+    scope = serializers.ChoiceField(
+        choices=['domain', 'tag', 'extractor'],
+        default='extractor',
+        required=False,
+        help_text="统计维度：domain、tag 或 extractor。"
+    )
+    key = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        help_text="只返回指定的域名、标签或提取器，可重复。"
+    )
+    limit = serializers.IntegerField(
+        default=100,
+        required=False,
+        min_value=1,
+        max_value=10000,
+        help_text="按结果数量从多到少返回的条数。"
+    )
+
 
 # 定义基础响应序列化器
 class BaseResponseSerializer(serializers.Serializer):
@@ -167,17 +463,9 @@ class ErrorResponseSerializer(BaseResponseSerializer):
     error = serializers.CharField(required=False, allow_null=True)
 
 
+# 生成文档时由 api.schema 转换为 drf_yasg 的 openapi.Response
 common_responses = {
-    200: openapi.Response(
-        description="成功返回的响应结构",
-        schema=SuccessResponseSerializer()
-    ),
-    207: openapi.Response(
-        description="部分成功返回的响应结构",
-        schema=PartialSuccessResponseSerializer()
-    ),
-    400: openapi.Response(
-        description="请求出错",
-        schema=ErrorResponseSerializer()
-    )
+    200: SchemaResponse("成功返回的响应结构", SuccessResponseSerializer),
+    207: SchemaResponse("部分成功返回的响应结构", PartialSuccessResponseSerializer),
+    400: SchemaResponse("请求出错", ErrorResponseSerializer),
 }
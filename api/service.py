@@ -1,17 +1,39 @@
 import json
+import math
 import os
 import subprocess
+from datetime import timedelta
 from typing import List, Dict, Any, Union
 from dotenv import load_dotenv
 
-import requests
-import yaml
-
-from api.models import Target, Tag, Tagging
-from api.serializers import TargetSerializer
+from django.db.models import F
+from django.utils import timezone
+
+from api.crawl import collect_crawl_links, get_crawl_links_per_job, refresh_crawl_job
+from api.dedup import detach_before_add, detach_snapshot_links
+from api.fieldsets import FieldSet, build_targets, result_queryset, tag_queryset
+from api.importer import create_import_chunks
+from api.jobs import create_job, submit_job, job_status_from_response, serialize_job, is_job_cancelled, \
+    create_job_chunks, get_job_execution_mode
+from api.lanes import DEFAULT_SERVICE, HEAVY_SERVICE, fast_lane_slots, get_heavy_chunk_size, \
+    get_heavy_memory_limit, get_heavy_service, heavy_service_config, lanes_enabled, split_lanes
+from api.models import Job, JobChunk, Target, Tag, RefreshPolicy, WebhookSubscription
+from api.planner import planner_enabled, plan_extractors
+from api.processes import get_command_timeout, kill_job_processes, remove_job_containers, list_managed_containers, \
+    find_orphan_containers, remove_containers, archivebox_service, TERMINAL_JOB_STATUSES
+from api.read_model import get_read_model, read_model_stats
+from api.refresh import parse_windows, seconds_left_in_window, refresh_budget, due_targets
+from api.removal import remove_targets_chunk
+from api.retry import group_failed_targets, record_retry_attempt
+from api.stats import storage_usage, result_summary
+from api.tag_index import batch_tag_index_invalidation
+from api.tiering import BundleError, open_snapshot_file, rehydrate_before_add, rehydrate_urls
 from api.utils import check_docker_version, check_docker_compose, execute_docker_compose_archivebox_command, \
     success_response, error_response, parse_log, clean_path, partial_success_response, save_result, save_tags, \
-    build_add_args, process_archive_paths, build_response, process_json_data
+    build_add_args, process_archive_paths, build_response, process_json_data, filter_target_queryset, \
+    snapshot_index_file, target_filters
+from api.webhooks import batch_payload, enqueue_event, notify_add_completed, notify_batch_completed, new_secret, \
+    serialize_subscription
 
 load_dotenv()
 
@@ -27,6 +49,35 @@ def initialize_archivebox() -> Dict[str, Any]:
     if docker_compose_result["status"] != "success":
         return docker_compose_result
 
+    prepare_result = prepare_docker_compose(project_dir)
+    if prepare_result["status"] != "success":
+        return prepare_result
+
+    init_result = execute_docker_compose_archivebox_command("init --setup", timeout=get_command_timeout())
+    if init_result["status"] != "success":
+        return init_result
+    if not archivebox_server_enabled():
+        return success_response("ArchiveBox initialized, server not started.")
+
+    up_command = "docker compose up -d"
+    try:
+        subprocess.run(up_command, shell=True, check=True, cwd=project_dir, encoding='utf-8')
+        return success_response("ArchiveBox server started successfully.")
+    except subprocess.CalledProcessError as e:
+        return error_response(f"Failed to start ArchiveBox server: {e}", error=e)
+
+
+def archivebox_server_enabled() -> bool:
+    """init 之后是否启动 ArchiveBox 的 Web 服务。通过 Web 界面重新存档时 ArchiveBox 会原地改写输出文件，
+    不经过本服务解除硬链接，启用去重时可以关闭，只通过本服务的接口存档"""
+    return os.getenv('ARCHIVEBOX_START_SERVER', 'true').lower() == 'true'
+
+
+def prepare_docker_compose(project_dir: str) -> Dict[str, Any]:
+    # 只有初始化时才用到，不在服务进程启动时导入
+    import requests
+    import yaml
+
     if not os.path.exists(project_dir):
         os.makedirs(project_dir)
 
@@ -67,26 +118,115 @@ def initialize_archivebox() -> Dict[str, Any]:
     if deployment_ports:
         docker_compose['services']['archivebox']['ports'].append(deployment_ports)
 
+    heavy_memory_limit = get_heavy_memory_limit()
+    if heavy_memory_limit:
+        docker_compose['services'][HEAVY_SERVICE] = heavy_service_config(docker_compose['services']['archivebox'],
+                                                                         heavy_memory_limit)
+
     with open(docker_compose_path, 'w') as file:
         yaml.safe_dump(docker_compose, file)
 
-    init_result = execute_docker_compose_archivebox_command("init --setup")
-    if init_result["status"] != "success":
-        return init_result
-
-    up_command = "docker compose up -d"
-    try:
-        subprocess.run(up_command, shell=True, check=True, cwd=project_dir, encoding='utf-8')
-        return success_response("ArchiveBox server started successfully.")
-    except subprocess.CalledProcessError as e:
-        return error_response(f"Failed to start ArchiveBox server: {e}", error=e)
+    return success_response("docker-compose.yml prepared successfully.", path=docker_compose_path)
 
 
 def add_url(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool, overwrite: bool,
-            extractors: str, parser: str) -> Dict[str, Any]:
-    command_args = build_add_args(urls, tags, depth, update, update_all, overwrite, extractors, parser)
+            extractors: str, parser: str, stdin_urls: bool = False, plan: bool = None,
+            callback_url: str = None, lanes: bool = None) -> Dict[str, Any]:
+    """plan 为 None 时由 EXTRACTOR_PLANNER_ENABLED 决定是否根据历史结果按域名调整提取器；
+    lanes 为 None 时由 EXTRACTOR_LANES_ENABLED 决定是否把提取器分为快速通道和慢速通道；
+    完成后向 callback_url 和订阅了相关标签的地址发送通知"""
+    if lanes_enabled() if lanes is None else lanes:
+        fast, heavy = split_lanes(extractors)
+        if fast:
+            return add_url_lanes(urls, tags, depth, update, update_all, overwrite, fast, heavy, parser, stdin_urls,
+                                 plan, callback_url)
+    rehydrate_before_add(urls, update, update_all, overwrite)
+    detach_before_add(urls, update, update_all, overwrite)
+    if not (planner_enabled() if plan is None else plan):
+        result = run_add_command(urls, tags, depth, update, update_all, overwrite, extractors, parser, stdin_urls)
+        notify_add_completed(urls, result, callback_url)
+        return result
 
-    result = execute_docker_compose_archivebox_command(command_args)
+    extraction_plan = plan_extractors(urls, extractors)
+    groups = extraction_plan['groups']
+    results = [run_add_command(group['urls'], tags, depth, update, update_all, overwrite, group['extractors'],
+                               parser, stdin_urls) for group in groups]
+    result = results[0] if len(results) == 1 else merge_add_results(urls, results)
+    result['plan'] = {
+        'decisions': extraction_plan['decisions'],
+        'deferred_jobs': dispatch_deferred_extractors(groups, results, tags),
+    }
+    notify_add_completed(urls, result, callback_url)
+    return result
+
+
+def add_url_lanes(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool, overwrite: bool,
+                  fast: str, heavy: str, parser: str, stdin_urls: bool, plan: bool,
+                  callback_url: str) -> Dict[str, Any]:
+    """先在快速通道中执行轻量提取器并立即入库，存档成功的 URL 再交给慢速通道的任务补跑重量级提取器；
+    callback_url 只在两个通道都结束后收到一次通知"""
+    with fast_lane_slots():
+        result = add_url(urls, tags, depth, update, update_all, overwrite, fast, parser, stdin_urls, plan=plan,
+                         lanes=False)
+    job = dispatch_heavy_lane(urls, result, tags, overwrite, heavy, plan, callback_url)
+    result['lanes'] = {'fast': fast, 'heavy': heavy, 'heavy_job': str(job.id) if job else None}
+    if job is None:
+        notify_batch_completed(callback_url, urls, result)
+    return result
+
+
+def dispatch_heavy_lane(urls: List[str], fast_result: Dict[str, Any], tags: List[str], overwrite: bool, heavy: str,
+                        plan: bool = None, callback_url: str = None) -> Union[Job, None]:
+    """为快速通道中存档成功的 URL 创建慢速通道任务，以 --update 在内存受限的服务中执行重量级提取器；
+    快速通道的结果保存在任务中，任务结束后连同慢速通道的状态一起发给 callback_url"""
+    archived = list(fast_result.get('archive_paths', {}))
+    if not archived:
+        return None
+    chunk_size = get_heavy_chunk_size()
+    job = create_job('heavy', params={
+        'tags': tags or [],
+        'update': True,
+        'overwrite': overwrite,
+        'extractors': heavy,
+        'chunk_size': chunk_size,
+        'plan': plan,
+        'callback_url': callback_url,
+        'batch': batch_payload(urls, fast_result) if callback_url else None,
+        'lane': 'heavy',
+    }, total=len(archived))
+    create_job_chunks(job, archived, chunk_size)
+    dispatch_add_chunks_job(job)
+    return job
+
+
+def notify_heavy_lane_completed(job_id: Any, status: str) -> int:
+    """慢速通道任务结束（包括取消）时向 callback_url 发送整批的通知，
+    调用方只在把任务更新为结束状态成功时调用，保证只发送一次"""
+    job = Job.objects.filter(id=job_id, kind='heavy').first()
+    if job is None or not job.params.get('callback_url') or not job.params.get('batch'):
+        return 0
+    heavy_failed = [url for result in JobChunk.objects.filter(job_id=job).order_by('index').values_list(
+        'result', flat=True) for url in (result or {}).get('failed_urls', [])]
+    payload = dict(job.params['batch'], lanes={
+        'extractors': job.params['extractors'],
+        'heavy_job': str(job.id),
+        'heavy_status': status,
+        'heavy_failed_urls': heavy_failed,
+    })
+    enqueue_event(job.params['callback_url'], 'batch.completed', payload)
+    return 1
+
+
+def run_add_command(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool, overwrite: bool,
+                    extractors: str, parser: str, stdin_urls: bool = False) -> Dict[str, Any]:
+    if stdin_urls:
+        # URL 通过标准输入传给 ArchiveBox，避免命令行过长
+        command_args = build_add_args([], tags, depth, update, update_all, overwrite, extractors, parser)
+        result = execute_docker_compose_archivebox_command(command_args, stdin="\n".join(urls) + "\n",
+                                                           timeout=get_command_timeout(len(urls)))
+    else:
+        command_args = build_add_args(urls, tags, depth, update, update_all, overwrite, extractors, parser)
+        result = execute_docker_compose_archivebox_command(command_args, timeout=get_command_timeout(len(urls)))
     if result["status"] == "error":
         return result
 
@@ -98,11 +238,432 @@ def add_url(urls: List[str], tags: List[str], depth: int, update: bool, update_a
     project_dir = os.getenv('PROJECT_DIR')
     data_dir = os.path.join(project_dir, "data")
 
-    url_archive_paths, crawl_status = process_archive_paths(archive_result["data"], data_dir, tags)
+    url_archive_paths, crawl_status = process_archive_paths(archive_result["data"], data_dir, tags,
+                                                            overwrite=update or overwrite)
+
+    return build_response(urls, url_archive_paths, crawl_status)
+
 
+def merge_add_results(urls: List[str], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    url_archive_paths = {}
+    for result in results:
+        url_archive_paths.update(result.get('archive_paths', {}))
+    crawl_status = {url: 'succeeded' if url in url_archive_paths else 'failed' for url in urls}
     return build_response(urls, url_archive_paths, crawl_status)
 
 
+def dispatch_deferred_extractors(groups: List[Dict[str, Any]], results: List[Dict[str, Any]],
+                                 tags: List[str]) -> List[str]:
+    """为存档成功的 URL 创建 deferred 任务，排在当前任务之后以 --update 补跑被推迟的提取器"""
+    jobs = []
+    chunk_size = int(os.getenv('PLANNER_DEFERRED_CHUNK_SIZE', '50'))
+    for group, result in zip(groups, results):
+        archived = [url for url in group['urls'] if url in result.get('archive_paths', {})]
+        if not group['deferred'] or not archived:
+            continue
+        job = create_job('deferred', params={
+            'tags': tags or [],
+            'update': True,
+            'overwrite': False,
+            'extractors': ",".join(group['deferred']),
+            'chunk_size': chunk_size,
+            'plan': False,
+        }, total=len(archived))
+        create_job_chunks(job, archived, chunk_size)
+        dispatch_add_chunks_job(job)
+        jobs.append(str(job.id))
+    return jobs
+
+
+def crawl_urls(urls: List[str], tags: List[str], update: bool, overwrite: bool, extractors: str, parser: str,
+               plan: bool = None, callback_url: str = None) -> Dict[str, Any]:
+    """depth=1 的拆分模式：先以 depth=0 存档种子页面，再把页面中的新链接拆分为可以并行执行的任务"""
+    # 种子页面需要立即得到 HTML 输出，不拆分通道
+    result = add_url(urls, tags, 0, update, False, overwrite, extractors, parser, plan=plan,
+                     callback_url=callback_url, lanes=False)
+    result['crawl'] = schedule_crawl(list(result.get('archive_paths', {})), extractors, plan)
+    return result
+
+
+def schedule_crawl(seed_urls: List[str], extractors: str, plan: bool = None) -> Dict[str, Any]:
+    """为存档成功的种子创建 crawl 任务，每 CRAWL_LINKS_PER_JOB 个链接一个 crawl_links 子任务"""
+    if not seed_urls:
+        return {'job': None, 'links': 0, 'jobs': 0, 'seeds': []}
+    links = collect_crawl_links(seed_urls)
+    seeds = [dict(seed, links=len(seed['links'])) for seed in links['seeds']]
+    parent = create_job('crawl', params={'seeds': seeds, 'extractors': extractors}, total=links['links'])
+    links_per_job = get_crawl_links_per_job()
+    jobs = 0
+    for seed in links['seeds']:
+        for start in range(0, len(seed['links']), links_per_job):
+            batch = seed['links'][start:start + links_per_job]
+            job = create_job('crawl_links', params={
+                'seed': seed['url'],
+                'tags': seed['tags'],
+                'update': False,
+                'overwrite': False,
+                'extractors': extractors,
+                'chunk_size': links_per_job,
+                'plan': plan,
+            }, total=len(batch), parent=parent)
+            create_job_chunks(job, batch, links_per_job)
+            dispatch_add_chunks_job(job)
+            jobs += 1
+    Job.objects.filter(id=parent.id).update(status='running', updated_at=timezone.now())
+    parent = refresh_crawl_job(Job.objects.get(id=parent.id))
+    return {'job': serialize_job(parent, include_chunks=False), 'links': links['links'], 'jobs': jobs,
+            'seeds': seeds}
+
+
+def import_urls(file: Any, parser: str, tags: List[str], update: bool, overwrite: bool, extractors: str,
+                chunk_size: int, callback_url: str = None) -> Dict[str, Any]:
+    job = create_job('import', params={
+        'parser': parser,
+        'tags': tags or [],
+        'update': update,
+        'overwrite': overwrite,
+        'extractors': extractors,
+        'chunk_size': chunk_size,
+        'callback_url': callback_url,
+    })
+    summary = create_import_chunks(job, file, parser, chunk_size)
+    job.total = summary['total']
+    job.params.update(invalid=summary['invalid'], duplicates=summary['duplicates'])
+    job.save(update_fields=['total', 'params', 'updated_at'])
+
+    if not summary['total']:
+        job.status = 'failed'
+        job.error = "No valid URLs found in the uploaded file."
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        return error_response(job.error, job=serialize_job(job, include_chunks=False))
+
+    dispatch_add_chunks_job(job)
+    return success_response("Import job created.", job=serialize_job(job, include_chunks=False), **summary)
+
+
+def execute_add_chunk(params: Dict[str, Any], urls: List[str]) -> Dict[str, Any]:
+    """执行一批 URL 的 add，返回需要写回 JobChunk 的字段，本地任务和多节点 worker 共用"""
+    heavy_lane = params.get('lane') == 'heavy'
+    token = archivebox_service.set(get_heavy_service() if heavy_lane else DEFAULT_SERVICE)
+    try:
+        # 慢速通道的批次不单独通知 callback_url，由 notify_heavy_lane_completed 在任务结束后统一通知
+        result = add_url(urls, params['tags'], 0, params['update'], False, params['overwrite'],
+                         params['extractors'], 'url_list', stdin_urls=True, plan=params.get('plan'),
+                         callback_url=None if heavy_lane else params.get('callback_url'), lanes=False)
+    finally:
+        archivebox_service.reset(token)
+    succeeded = len(result.get('archive_paths', {}))
+    chunk_result = {'message': result['message'], 'failed_urls': result.get('failed_urls', [])}
+    if 'plan' in result:
+        chunk_result['plan'] = result['plan']
+    return {
+        'succeeded': succeeded,
+        'failed': len(urls) - succeeded,
+        'status': job_status_from_response(result),
+        'result': chunk_result,
+    }
+
+
+def dispatch_add_chunks_job(job: Job) -> None:
+    # worker 模式下任务留在数据库中，由各节点的 run_worker 认领执行
+    if get_job_execution_mode() != 'worker':
+        submit_job(job, run_add_chunks_job, pool='heavy' if job.kind == 'heavy' else 'default')
+
+
+def run_add_chunks_job(job: Job) -> Dict[str, Any]:
+    """逐批执行任务中的 URL，导入和定期刷新共用"""
+    params = job.params
+    succeeded_chunks = 0
+    failed_chunks = 0
+
+    for chunk in JobChunk.objects.filter(job_id=job, status='pending').order_by('index'):
+        if is_job_cancelled(job.id):
+            break
+        chunk.status = 'running'
+        chunk.save(update_fields=['status', 'updated_at'])
+
+        fields = execute_add_chunk(params, chunk.urls.split("\n"))
+        for field, value in fields.items():
+            setattr(chunk, field, value)
+        if is_job_cancelled(job.id):
+            chunk.status = 'cancelled'
+        chunk.save(update_fields=['succeeded', 'failed', 'status', 'result', 'updated_at'])
+
+        Job.objects.filter(id=job.id).update(processed=F('processed') + chunk.size, failed=F('failed') + chunk.failed)
+        if chunk.status == 'cancelled':
+            break
+        elif chunk.status == 'failed':
+            failed_chunks += 1
+        else:
+            succeeded_chunks += 1
+
+    if is_job_cancelled(job.id):
+        return error_response("Job cancelled.", succeeded_chunks=succeeded_chunks, failed_chunks=failed_chunks)
+    if succeeded_chunks and failed_chunks:
+        return partial_success_response("Job finished with some failed chunks.", succeeded_chunks=succeeded_chunks,
+                                        failed_chunks=failed_chunks)
+    elif succeeded_chunks:
+        return success_response("Job finished successfully.", succeeded_chunks=succeeded_chunks)
+    else:
+        return error_response("All chunks failed.", failed_chunks=failed_chunks)
+
+
+def retry_failed_extractors(data: Dict[str, Any], batch_size: int, force: bool = False) -> Dict[str, Any]:
+    groups = group_failed_targets(data, force)
+    total = sum(len(targets) for targets in groups.values())
+    if not total:
+        return success_response("No failed extractors to retry.", groups=[])
+
+    filters = dict(target_filters(data), extractors=data.get('extractors') or [])
+    job = create_job('retry', params={'filters': filters, 'batch_size': batch_size, 'force': force}, total=total)
+    submit_job(job, run_retry_job)
+    return success_response("Retry job created.", job=serialize_job(job, include_chunks=False), groups=[
+        {'extractors': list(extractors), 'targets': len(targets)} for extractors, targets in groups.items()
+    ])
+
+
+def run_retry_job(job: Job) -> Dict[str, Any]:
+    params = job.params
+    batch_size = params['batch_size']
+    groups = group_failed_targets(params['filters'], params['force'])
+    retried = 0
+    attempted = 0
+    recovered = 0
+
+    for extractors, targets in groups.items():
+        for start in range(0, len(targets), batch_size):
+            if is_job_cancelled(job.id):
+                return error_response("Retry job cancelled.", retried=retried, recovered=recovered)
+            batch = targets[start:start + batch_size]
+            urls = [url for _, url, _ in batch]
+            rehydrate_urls(urls)
+            detach_snapshot_links(urls)
+            # 只重新执行失败的提取器，--update 会跳过已经成功的提取器
+            command_args = build_add_args([], None, 0, True, False, False, ",".join(extractors), 'url_list')
+            result = execute_docker_compose_archivebox_command(command_args, stdin="\n".join(urls) + "\n",
+                                                               timeout=get_command_timeout(len(urls)))
+
+            batch_recovered = 0
+            for target_id, url, timestamp in batch:
+                index_file = snapshot_index_file(timestamp)
+                if result["status"] == "success" and os.path.exists(index_file):
+                    target = save_result(process_json_data(index_file), overwrite_extractors=list(extractors))
+                else:
+                    target = Target.objects.get(id=target_id)
+                batch_recovered += record_retry_attempt(target, timestamp, list(extractors))
+
+            retried += len(batch)
+            attempted += len(batch) * len(extractors)
+            recovered += batch_recovered
+            Job.objects.filter(id=job.id).update(processed=F('processed') + len(batch),
+                                                 failed=F('failed') + len(batch) * len(extractors) - batch_recovered)
+
+    if recovered == attempted:
+        return success_response("All failed extractors recovered.", retried=retried, recovered=recovered)
+    elif recovered:
+        return partial_success_response("Some failed extractors recovered.", retried=retried, recovered=recovered)
+    else:
+        return error_response("No failed extractors recovered.", retried=retried, recovered=recovered)
+
+
+def remove_targets(data: Dict[str, Any], batch_size: int, delete_files: bool = True) -> Dict[str, Any]:
+    job = create_remove_job(data, batch_size, delete_files)
+    if job is None:
+        return success_response("No targets matched.", removed=0)
+    submit_job(job, run_remove_job)
+    return success_response("Remove job created.", job=serialize_job(job, include_chunks=False))
+
+
+def create_remove_job(data: Dict[str, Any], batch_size: int, delete_files: bool = True) -> Union[Job, None]:
+    # 创建任务时确定要删除的 URL，之后新入库的目标即使符合条件也不会被删除
+    urls = list(filter_target_queryset(data).values_list('url', flat=True).distinct())
+    if not urls:
+        return None
+    filters = target_filters(data)
+    job = create_job('remove', params={'filters': filters, 'batch_size': batch_size, 'delete_files': delete_files},
+                     total=len(urls))
+    create_job_chunks(job, urls, batch_size)
+    return job
+
+
+def run_remove_job(job: Job) -> Dict[str, Any]:
+    """逐批删除：先由 ArchiveBox 删除快照，成功后再分批删除数据库中的记录"""
+    removed = 0
+    failed_chunks = 0
+    for chunk in JobChunk.objects.filter(job_id=job, status='pending').order_by('index'):
+        if is_job_cancelled(job.id):
+            return error_response("Remove job cancelled.", removed=removed)
+        chunk.status = 'running'
+        chunk.save(update_fields=['status', 'updated_at'])
+
+        result = remove_targets_chunk(chunk.urls.split("\n"), job.params.get('delete_files', True))
+        if result["status"] == "success":
+            chunk.succeeded = result['removed']
+            removed += result['removed']
+        else:
+            chunk.failed = chunk.size
+            failed_chunks += 1
+        chunk.status = job_status_from_response(result)
+        chunk.result = {'message': result['message']}
+        chunk.save(update_fields=['succeeded', 'failed', 'status', 'result', 'updated_at'])
+        Job.objects.filter(id=job.id).update(processed=F('processed') + chunk.size, failed=F('failed') + chunk.failed)
+
+    if failed_chunks and removed:
+        return partial_success_response("Some targets could not be removed.", removed=removed,
+                                        failed_chunks=failed_chunks)
+    elif failed_chunks:
+        return error_response("No targets removed.", failed_chunks=failed_chunks)
+    return success_response("Targets removed.", removed=removed)
+
+
+def schedule_auto_retry() -> Dict[str, Any]:
+    """自动重试：没有进行中的重试任务时，为到期的失败结果创建重试任务；
+    检查和创建不是原子的，由 start_background_tasks 的数据库锁保证只有一个进程执行"""
+    if Job.objects.filter(kind='retry', status__in=['pending', 'running']).exists():
+        return success_response("A retry job is already in progress.")
+    return retry_failed_extractors({}, int(os.getenv('RETRY_BATCH_SIZE', '50')))
+
+
+def run_refresh_tick(force: bool = False) -> Dict[str, Any]:
+    """按过期程度和优先级挑选目标，按空闲任务槽分批派发重新存档任务"""
+    now = timezone.now()
+    windows = parse_windows(os.getenv('REFRESH_WINDOWS', ''))
+    seconds_left = seconds_left_in_window(timezone.localtime(now), windows)
+    if seconds_left is None and not force:
+        return success_response("Outside of refresh windows.", dispatched=0)
+
+    batch_size = int(os.getenv('REFRESH_BATCH_SIZE', '50'))
+    tick_interval = float(os.getenv('REFRESH_TICK_INTERVAL', '300'))
+    busy = Job.objects.filter(status__in=['pending', 'running']).count()
+    free_slots = max(int(os.getenv('JOB_WORKERS', '1')) - busy, 0)
+
+    targets = due_targets(now)
+    due_count = targets.count()
+    ticks_left = 1 if force or seconds_left is None else math.ceil(seconds_left / tick_interval)
+    budget = refresh_budget(due_count, free_slots, batch_size, ticks_left)
+    if not budget:
+        return success_response("Nothing to refresh.", due=due_count, dispatched=0, free_slots=free_slots)
+
+    selected = list(targets.values_list('id', 'url')[:budget])
+    Target.objects.filter(id__in=[target_id for target_id, _ in selected]).update(refresh_queued_at=now)
+
+    jobs = []
+    for start in range(0, len(selected), batch_size):
+        urls = [url for _, url in selected[start:start + batch_size]]
+        job = create_job('refresh', params={
+            'tags': [],
+            'update': False,
+            'overwrite': True,
+            'extractors': os.getenv('REFRESH_EXTRACTORS', ''),
+            'chunk_size': batch_size,
+        }, total=len(urls))
+        create_job_chunks(job, urls, batch_size)
+        dispatch_add_chunks_job(job)
+        jobs.append(str(job.id))
+
+    return success_response("Refresh jobs dispatched.", due=due_count, dispatched=len(selected), jobs=jobs)
+
+
+def set_refresh_policy(tag_name: str, interval: int, priority: int, enabled: bool) -> Dict[str, Any]:
+    tag, _ = Tag.objects.get_or_create(name=tag_name)
+    policy, _ = RefreshPolicy.objects.update_or_create(tag_id=tag, defaults={
+        'interval': timedelta(seconds=interval),
+        'priority': priority,
+        'enabled': enabled,
+    })
+    return success_response("Refresh policy saved.", policy=serialize_refresh_policy(policy))
+
+
+def list_refresh_policies() -> Dict[str, Any]:
+    policies = RefreshPolicy.objects.select_related('tag_id').order_by('-priority', 'tag_id__name')
+    return success_response("Refresh policies fetched successfully",
+                            policies=[serialize_refresh_policy(policy) for policy in policies])
+
+
+def serialize_refresh_policy(policy: RefreshPolicy) -> Dict[str, Any]:
+    return {
+        'tag': policy.tag_id.name,
+        'interval': int(policy.interval.total_seconds()),
+        'priority': policy.priority,
+        'enabled': policy.enabled,
+    }
+
+
+def create_webhook_subscription(tag_name: str, url: str, secret: str = None) -> Dict[str, Any]:
+    tag, _ = Tag.objects.get_or_create(name=tag_name)
+    subscription = WebhookSubscription.objects.create(tag_id=tag, url=url, secret=secret or new_secret())
+    # 密钥只在创建时返回一次
+    return success_response("Webhook subscription created.",
+                            subscription=serialize_subscription(subscription, include_secret=True))
+
+
+def list_webhook_subscriptions() -> Dict[str, Any]:
+    subscriptions = WebhookSubscription.objects.select_related('tag_id').order_by('tag_id__name', 'created_at')
+    return success_response("Webhook subscriptions fetched successfully",
+                            subscriptions=[serialize_subscription(subscription) for subscription in subscriptions])
+
+
+def delete_webhook_subscription(subscription_id: str) -> Dict[str, Any]:
+    deleted, _ = WebhookSubscription.objects.filter(id=subscription_id).delete()
+    if not deleted:
+        return error_response(f"Webhook subscription {subscription_id} does not exist.")
+    return success_response("Webhook subscription deleted.")
+
+
+def get_job(job_id: str) -> Dict[str, Any]:
+    try:
+        job = Job.objects.get(id=job_id)
+    except Job.DoesNotExist:
+        return error_response(f"Job {job_id} does not exist.")
+    return success_response("Job fetched successfully", job=serialize_job(refresh_crawl_job(job)))
+
+
+def cancel_job(job_id: str) -> Dict[str, Any]:
+    try:
+        job = Job.objects.get(id=job_id)
+    except Job.DoesNotExist:
+        return error_response(f"Job {job_id} does not exist.")
+
+    if not Job.objects.filter(id=job.id, status__in=['pending', 'running']).update(status='cancelled'):
+        job.refresh_from_db()
+        return error_response(f"Job {job_id} has already finished.", job=serialize_job(job, include_chunks=False))
+    JobChunk.objects.filter(job_id=job, status='pending').update(status='cancelled')
+    notify_heavy_lane_completed(job.id, 'cancelled')
+    # 取消 crawl 任务时同时取消尚未结束的子任务
+    for child_id in Job.objects.filter(parent_id=job, status__in=['pending', 'running']).values_list('id', flat=True):
+        cancel_job(child_id)
+
+    # 结束本进程内该任务的命令，并删除其他进程或节点上带有该任务标签的容器
+    killed = kill_job_processes(job.id)
+    removed = remove_job_containers(job.id)
+
+    job.refresh_from_db()
+    return success_response("Job cancelled.", job=serialize_job(job, include_chunks=False),
+                            killed_processes=killed, removed_containers=removed)
+
+
+def reap_orphan_containers() -> Dict[str, Any]:
+    try:
+        containers = list_managed_containers()
+    except (OSError, subprocess.SubprocessError) as e:
+        return error_response(f"Failed to list containers: {e}", error=e)
+
+    job_ids = {container['job'] for container in containers if container['job']}
+    finished_jobs = {
+        str(job_id) for job_id in
+        Job.objects.filter(id__in=job_ids, status__in=TERMINAL_JOB_STATUSES).values_list('id', flat=True)
+    }
+    timeout = get_command_timeout()
+    # 超时后再多等一段时间，避免误删正在退出的容器
+    max_age = timeout + 300 if timeout else None
+
+    orphans = find_orphan_containers(containers, finished_jobs, max_age)
+    removed = remove_containers([container['name'] for container, _ in orphans])
+    return success_response(f"Removed {len(removed)} orphan containers.", removed=[
+        {'name': container['name'], 'reason': reason} for container, reason in orphans if container['name'] in removed
+    ])
+
+
 def synchronize_local_data() -> dict[str, Any]:
     project_dir: str = os.getenv('PROJECT_DIR')
     if not project_dir:
@@ -113,38 +674,55 @@ def synchronize_local_data() -> dict[str, Any]:
     if not os.path.exists(archive_dir):
         return error_response(f"{archive_dir} does not exist.")
 
-    for folder_name in os.listdir(archive_dir):
-        folder_path: str = os.path.join(archive_dir, folder_name)
-        if os.path.isdir(folder_path):
-            index_file_path: str = os.path.join(folder_path, 'index.json')
-            if os.path.exists(index_file_path):
-                data: dict = process_json_data(index_file_path)
-                save_result(data)
+    with batch_tag_index_invalidation():
+        for folder_name in os.listdir(archive_dir):
+            folder_path: str = os.path.join(archive_dir, folder_name)
+            if os.path.isdir(folder_path):
+                index_file_path: str = os.path.join(folder_path, 'index.json')
+                if os.path.exists(index_file_path):
+                    data: dict = process_json_data(index_file_path)
+                    save_result(data)
 
     return success_response("Synchronization successful!")
 
 
-def filter_targets(data: Dict[str, Any]) -> Dict[str, Any]:
-    try:
-        tag_names = data.get('tag_names', [])
-        domains = data.get('domains', [])
-        urls = data.get('urls', [])
-        extractors = data.get('extractors', [])
+def get_storage_stats(scope: str, keys: List[str], limit: int) -> Dict[str, Any]:
+    return success_response("Storage usage fetched successfully", **storage_usage(scope, keys, limit))
 
-        targets = Target.objects.all()
 
-        if tag_names:
-            tags = Tag.objects.filter(name__in=tag_names)
-            taggings = Tagging.objects.filter(tag_id__in=tags)
-            targets = targets.filter(id__in=taggings.values('target_id'))
+def get_result_stats(scope: str, keys: List[str], limit: int) -> Dict[str, Any]:
+    return success_response("Result statistics fetched successfully", **result_summary(scope, keys, limit))
 
-        if domains:
-            targets = targets.filter(domain__in=domains)
 
-        if urls:
-            targets = targets.filter(url__in=urls)
+def get_read_model_stats() -> Dict[str, Any]:
+    return success_response("Read model status fetched successfully", **read_model_stats())
 
-        serialized_targets = TargetSerializer(targets, many=True, context={'extractors': extractors}).data
+
+def filter_targets(data: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        fieldset = FieldSet.parse(data.get('fields'))
+        model = get_read_model()
+        if model is not None:
+            return success_response("Targets fetched successfully", targets=model.filter_targets(data, fieldset))
+        targets = filter_target_queryset(data)
+
+        result_rows = []
+        if fieldset.result:
+            result_rows = result_queryset(targets, fieldset, data.get('extractors', []), data.get('latest_only', False))
+        tag_rows = tag_queryset(targets) if 'tags' in fieldset.target else []
+        serialized_targets = build_targets(targets.values_list(*fieldset.target_columns), result_rows, tag_rows,
+                                           fieldset)
         return success_response("Targets fetched successfully", targets=serialized_targets)
     except Exception as e:
         return error_response("An error occurred while fetching targets", error=e)
+
+
+def get_archive_file(timestamp: str, name: str) -> Dict[str, Any]:
+    """读取快照中的单个文件，已打包到冷存储的快照从压缩包中解压该文件"""
+    try:
+        file = open_snapshot_file(timestamp, name)
+    except (OSError, BundleError) as e:
+        return error_response(f"Failed to read archive file: {e}", error=e)
+    if file is None:
+        return error_response("Archive file not found.")
+    return success_response("Archive file found.", file=file)
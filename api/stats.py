@@ -0,0 +1,340 @@
+import bisect
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from api.models import Result, ResultSummary, StorageUsage, Tagging, Target
+
+STORAGE_SCOPES = ('target', 'domain', 'tag', 'extractor')
+SUMMARY_SCOPES = ('domain', 'tag', 'extractor', 'domain_extractor')
+# 耗时直方图各桶的上限（秒），最后一个桶收集超过 3600 秒的结果
+DURATION_BUCKETS = [0.5, 1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 1800, 3600]
+# process_json_data 保存的 output 带有静态文件地址前缀：/static/archive/<timestamp>/<output>
+ARCHIVE_URL_PREFIX = '/static/archive/'
+
+
+def measure_path(path: str) -> Tuple[int, int]:
+    """文件或目录占用的字节数和文件数，硬链接按文件大小计算"""
+    try:
+        if not os.path.isdir(path):
+            return os.stat(path).st_size, 1
+    except OSError:
+        return 0, 0
+    size = 0
+    files = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += st.st_size
+            files += 1
+    return size, files
+
+
+def snapshot_output_path(output: Optional[str]) -> Optional[str]:
+    """去掉 output 的 /static/archive/<timestamp>/ 前缀，返回快照目录下的相对路径"""
+    if not output or not isinstance(output, str) or not output.startswith(ARCHIVE_URL_PREFIX):
+        return output
+    parts = output[len(ARCHIVE_URL_PREFIX):].split('/', 1)
+    return parts[1] if len(parts) == 2 else ''
+
+
+def measure_output(snapshot_dir: str, output: Optional[str]) -> Tuple[int, int]:
+    """提取结果占用的空间：output 是快照目录下的相对路径时，统计其第一级文件或目录"""
+    output = snapshot_output_path(output)
+    if not output or not isinstance(output, str) or '://' in output:
+        return 0, 0
+    path = os.path.normpath(output)
+    if os.path.isabs(path) or path.startswith('..'):
+        return 0, 0
+    top = path.split(os.sep, 1)[0]
+    if top in ('.', 'index.json', 'index.html'):
+        return 0, 0
+    return measure_path(os.path.join(snapshot_dir, top))
+
+
+def domain_extractor_key(domain: str, extractor: str) -> str:
+    """domain_extractor 汇总的键，用于按域名选择提取器"""
+    return f"{domain}|{extractor}"
+
+
+def _add_usage(scope: str, key: str, size: int, files: int) -> None:
+    updated = StorageUsage.objects.filter(scope=scope, key=key).update(
+        size=F('size') + size, file_count=F('file_count') + files)
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            StorageUsage.objects.create(scope=scope, key=key, size=size, file_count=files)
+    except IntegrityError:
+        StorageUsage.objects.filter(scope=scope, key=key).update(
+            size=F('size') + size, file_count=F('file_count') + files)
+
+
+def record_storage_usage(target: Target, extractor: str, size: int, files: int) -> None:
+    """把单个 Result 的空间变化累加到目标、域名、标签和提取器的统计中"""
+    if not size and not files:
+        return
+    _add_usage('target', str(target.id), size, files)
+    _add_usage('domain', target.domain, size, files)
+    _add_usage('extractor', extractor, size, files)
+    for tag_name in Tagging.objects.filter(target_id=target).values_list('tag_id__name', flat=True):
+        _add_usage('tag', tag_name, size, files)
+
+
+def record_tag_storage_usage(target: Target, tag_name: str) -> None:
+    """目标新增标签时，把目标已占用的空间计入该标签"""
+    usage = StorageUsage.objects.filter(scope='target', key=str(target.id)).first()
+    if usage and (usage.size or usage.file_count):
+        _add_usage('tag', tag_name, usage.size, usage.file_count)
+
+
+def release_target_usage(target: Target) -> None:
+    """删除目标前调用，从各项统计中扣除该目标占用的空间"""
+    release_targets_usage([target.id])
+
+
+def _target_tags(target_ids: List[Any]) -> Dict[Any, List[str]]:
+    tags: Dict[Any, List[str]] = {}
+    for target_id, tag_name in Tagging.objects.filter(target_id__in=target_ids).values_list('target_id',
+                                                                                           'tag_id__name'):
+        tags.setdefault(target_id, []).append(tag_name)
+    return tags
+
+
+def release_targets_usage(target_ids: List[Any]) -> None:
+    """批量删除目标前调用，先在内存中合并各个键的差值，每个键只更新一次"""
+    tags = _target_tags(target_ids)
+    deltas: Dict[Tuple[str, str], List[int]] = {}
+    rows = Result.objects.filter(target_id__in=target_ids).values('target_id', 'target_id__domain', 'extractor')
+    for target_id, domain, extractor, size, files in rows.annotate(
+            size=Sum('size'), files=Sum('file_count')).values_list('target_id', 'target_id__domain', 'extractor',
+                                                                   'size', 'files'):
+        keys = [('domain', domain), ('extractor', extractor)] + [('tag', name) for name in tags.get(target_id, [])]
+        for key in keys:
+            delta = deltas.setdefault(key, [0, 0])
+            delta[0] += size
+            delta[1] += files
+    for (scope, key), (size, files) in deltas.items():
+        if size or files:
+            _add_usage(scope, key, -size, -files)
+    StorageUsage.objects.filter(scope='target', key__in=[str(target_id) for target_id in target_ids]).delete()
+
+
+def rebuild_storage_usage() -> int:
+    """根据 Result 中记录的大小重新生成全部统计，用于首次启用或数据不一致时"""
+    rows: List[StorageUsage] = []
+    results = Result.objects.values('target_id')
+    for target_id, size, files in results.annotate(size=Sum('size'), files=Sum('file_count')).values_list(
+            'target_id', 'size', 'files'):
+        rows.append(StorageUsage(scope='target', key=str(target_id), size=size, file_count=files))
+    for scope, field in (('domain', 'target_id__domain'), ('extractor', 'extractor')):
+        for key, size, files in Result.objects.values(field).annotate(
+                size=Sum('size'), files=Sum('file_count')).values_list(field, 'size', 'files'):
+            rows.append(StorageUsage(scope=scope, key=key, size=size, file_count=files))
+    tag_usage = Tagging.objects.values('tag_id__name').annotate(
+        size=Sum('target_id__result__size'), files=Sum('target_id__result__file_count'))
+    for key, size, files in tag_usage.values_list('tag_id__name', 'size', 'files'):
+        rows.append(StorageUsage(scope='tag', key=key, size=size or 0, file_count=files or 0))
+
+    with transaction.atomic():
+        StorageUsage.objects.all().delete()
+        StorageUsage.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def measure_results(snapshot_dir_for, only_missing: bool = True) -> int:
+    """重新统计磁盘上 Result 的大小，snapshot_dir_for 根据快照时间戳返回快照目录"""
+    results = Result.objects.all()
+    if only_missing:
+        results = results.filter(size=0, file_count=0)
+    measured = 0
+    for result in results.only('id', 'timestamp', 'output').iterator(chunk_size=2000):
+        size, files = measure_output(snapshot_dir_for(result.timestamp), result.output)
+        if files:
+            Result.objects.filter(id=result.id).update(size=size, file_count=files)
+            measured += 1
+    return measured
+
+
+def storage_usage(scope: str, keys: List[str] = None, limit: int = 100) -> Dict[str, Any]:
+    usage = StorageUsage.objects.filter(scope=scope)
+    if keys:
+        usage = usage.filter(key__in=keys)
+    rows = list(usage.order_by('-size').values('key', 'size', 'file_count')[:limit])
+    if scope == 'target':
+        urls = {str(target_id): url for target_id, url in
+                Target.objects.filter(id__in=[row['key'] for row in rows]).values_list('id', 'url')}
+        for row in rows:
+            row['url'] = urls.get(row['key'])
+    totals = usage.aggregate(size=Sum('size'), file_count=Sum('file_count'), count=Count('id'))
+    return {
+        'scope': scope,
+        'total_size': totals['size'] or 0,
+        'total_files': totals['file_count'] or 0,
+        'count': totals['count'],
+        'items': rows,
+    }
+
+
+def result_duration(start_ts: Any, end_ts: Any) -> Optional[float]:
+    """提取耗时（秒），时间缺失或无法解析时返回 None"""
+    try:
+        if isinstance(start_ts, str):
+            start_ts = datetime.fromisoformat(start_ts)
+        if isinstance(end_ts, str):
+            end_ts = datetime.fromisoformat(end_ts)
+        duration = (end_ts - start_ts).total_seconds()
+    except (TypeError, ValueError):
+        return None
+    return duration if duration >= 0 else None
+
+
+def duration_bucket(duration: float) -> int:
+    return bisect.bisect_left(DURATION_BUCKETS, duration)
+
+
+def histogram_quantile(histogram: List[int], quantile: float) -> Optional[float]:
+    """根据直方图估算分位数，在所在的桶内线性插值"""
+    count = sum(histogram)
+    if not count:
+        return None
+    rank = quantile * count
+    cumulative = 0
+    for index, bucket_count in enumerate(histogram):
+        if bucket_count and cumulative + bucket_count >= rank:
+            lower = DURATION_BUCKETS[index - 1] if index else 0
+            if index >= len(DURATION_BUCKETS):
+                return float(lower)
+            return lower + (DURATION_BUCKETS[index] - lower) * (rank - cumulative) / bucket_count
+        cumulative += bucket_count
+    return float(DURATION_BUCKETS[-1])
+
+
+def _apply_summary(summary: ResultSummary, status: bool, duration: Optional[float], sign: int) -> None:
+    summary.total += sign
+    if status:
+        summary.succeeded += sign
+    else:
+        summary.failed += sign
+    if duration is not None:
+        histogram = summary.histogram or [0] * (len(DURATION_BUCKETS) + 1)
+        histogram[duration_bucket(duration)] += sign
+        summary.histogram = histogram
+        summary.duration_total += sign * duration
+        summary.duration_count += sign
+
+
+def _update_summary(scope: str, key: str, changes: List[Tuple[bool, Optional[float], int]]) -> None:
+    # 直方图保存在 JSON 字段中，需要先锁住整行再读取修改；
+    # 事务中先执行写操作，SQLite 会在开始时等待写锁，而不是在读之后升级锁失败
+    with transaction.atomic():
+        if not ResultSummary.objects.filter(scope=scope, key=key).update(total=F('total')):
+            try:
+                with transaction.atomic():
+                    ResultSummary.objects.create(scope=scope, key=key)
+            except IntegrityError:
+                ResultSummary.objects.filter(scope=scope, key=key).update(total=F('total'))
+        summary = ResultSummary.objects.get(scope=scope, key=key)
+        for status, duration, sign in changes:
+            _apply_summary(summary, status, duration, sign)
+        summary.save()
+
+
+def record_result_summary(target: Target, extractor: str, old: Optional[Result], new: Optional[Result]) -> None:
+    """Result 新增、覆盖或删除时，按差值更新域名、标签和提取器的汇总"""
+    changes = []
+    if old is not None:
+        changes.append((bool(old.status), result_duration(old.start_ts, old.end_ts), -1))
+    if new is not None:
+        changes.append((bool(new.status), result_duration(new.start_ts, new.end_ts), 1))
+    if not changes:
+        return
+    keys = [('domain', target.domain), ('extractor', extractor),
+            ('domain_extractor', domain_extractor_key(target.domain, extractor))]
+    keys.extend(('tag', name) for name in Tagging.objects.filter(target_id=target).values_list('tag_id__name',
+                                                                                              flat=True))
+    for scope, key in keys:
+        _update_summary(scope, key, changes)
+
+
+def record_tag_summary(target: Target, tag_name: str) -> None:
+    """目标新增标签时，把目标已有的提取结果计入该标签的汇总"""
+    changes = [(status, result_duration(start_ts, end_ts), 1) for status, start_ts, end_ts in
+               Result.objects.filter(target_id=target).values_list('status', 'start_ts', 'end_ts')]
+    if changes:
+        _update_summary('tag', tag_name, changes)
+
+
+def release_target_summary(target: Target) -> None:
+    """删除目标前调用，从汇总中扣除该目标的提取结果"""
+    release_targets_summary([target.id])
+
+
+def release_targets_summary(target_ids: List[Any]) -> None:
+    """批量删除目标前调用，同一个汇总行的变化合并后只更新一次"""
+    tags = _target_tags(target_ids)
+    changes: Dict[Tuple[str, str], List[Tuple[bool, Optional[float], int]]] = {}
+    rows = Result.objects.filter(target_id__in=target_ids).values_list('target_id', 'target_id__domain', 'extractor',
+                                                                       'status', 'start_ts', 'end_ts')
+    for target_id, domain, extractor, status, start_ts, end_ts in rows:
+        change = (bool(status), result_duration(start_ts, end_ts), -1)
+        keys = [('domain', domain), ('extractor', extractor),
+                ('domain_extractor', domain_extractor_key(domain, extractor))]
+        keys += [('tag', name) for name in tags.get(target_id, [])]
+        for key in keys:
+            changes.setdefault(key, []).append(change)
+    for (scope, key), key_changes in changes.items():
+        _update_summary(scope, key, key_changes)
+
+
+def rebuild_result_summary() -> int:
+    """扫描 Result 表重新生成全部汇总"""
+    tags: Dict[str, List[str]] = {}
+    for target_id, tag_name in Tagging.objects.values_list('target_id', 'tag_id__name').iterator(chunk_size=5000):
+        tags.setdefault(target_id, []).append(tag_name)
+
+    summaries: Dict[Tuple[str, str], ResultSummary] = {}
+    rows = Result.objects.values_list('target_id', 'target_id__domain', 'extractor', 'status', 'start_ts', 'end_ts')
+    for target_id, domain, extractor, status, start_ts, end_ts in rows.iterator(chunk_size=5000):
+        duration = result_duration(start_ts, end_ts)
+        keys = [('domain', domain), ('extractor', extractor),
+                ('domain_extractor', domain_extractor_key(domain, extractor))]
+        keys += [('tag', name) for name in tags.get(target_id, [])]
+        for key in keys:
+            summary = summaries.get(key)
+            if summary is None:
+                summary = summaries[key] = ResultSummary(scope=key[0], key=key[1], histogram=[])
+            _apply_summary(summary, status, duration, 1)
+
+    with transaction.atomic():
+        ResultSummary.objects.all().delete()
+        ResultSummary.objects.bulk_create(summaries.values(), batch_size=1000)
+    return len(summaries)
+
+
+def serialize_summary(summary: ResultSummary) -> Dict[str, Any]:
+    return {
+        'key': summary.key,
+        'total': summary.total,
+        'succeeded': summary.succeeded,
+        'failed': summary.failed,
+        'success_rate': summary.succeeded / summary.total if summary.total else None,
+        'mean_duration': summary.duration_total / summary.duration_count if summary.duration_count else None,
+        'p95_duration': histogram_quantile(summary.histogram or [], 0.95),
+    }
+
+
+def result_summary(scope: str, keys: Iterable[str] = None, limit: int = 100) -> Dict[str, Any]:
+    summaries = ResultSummary.objects.filter(scope=scope)
+    if keys:
+        summaries = summaries.filter(key__in=keys)
+    return {
+        'scope': scope,
+        'items': [serialize_summary(summary) for summary in summaries.order_by('-total', 'key')[:limit]],
+    }
@@ -0,0 +1,283 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from dotenv import load_dotenv
+
+from api.models import CacheVersion, Tagging, Target
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TAG_INDEX_VERSION = 'tag_index'
+MAX_QUERY_TERMS = 64
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|(&&?|\|\|?|!)|"((?:[^"\\]|\\.)*)"|([^\s()&|!"]+))')
+_OPERATORS = {'&': 'AND', '&&': 'AND', '|': 'OR', '||': 'OR', '!': 'NOT'}
+
+_index = None
+_index_lock = threading.Lock()
+_building = False
+# 批量入库期间记录是否需要使版本失效，结束时只写一次 CacheVersion
+_invalidation_batch = contextvars.ContextVar('tag_index_invalidation_batch', default=None)
+
+
+class TagQueryError(ValueError):
+    pass
+
+
+def tokenize_tag_query(text: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match:
+            raise TagQueryError(f"Unexpected character at position {position}: {text[position]!r}")
+        position = match.end()
+        if match.group(1):
+            tokens.append(('(', '('))
+        elif match.group(2):
+            tokens.append((')', ')'))
+        elif match.group(3):
+            tokens.append((_OPERATORS[match.group(3)], match.group(3)))
+        elif match.group(4) is not None:
+            tokens.append(('TAG', re.sub(r'\\(.)', r'\1', match.group(4))))
+        elif match.group(5).upper() in ('AND', 'OR', 'NOT'):
+            tokens.append((match.group(5).upper(), match.group(5)))
+        else:
+            tokens.append(('TAG', match.group(5)))
+    return tokens
+
+
+def parse_tag_query(text: str) -> Tuple:
+    """解析 "(news OR tech) AND NOT spam" 形式的标签表达式，优先级 NOT > AND > OR，含空格的标签用双引号"""
+    tokens = tokenize_tag_query(text or '')
+    if not tokens:
+        raise TagQueryError("Empty tag query.")
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position][0] if position < len(tokens) else None
+
+    def take(kind: str) -> str:
+        nonlocal position
+        if peek() != kind:
+            found = tokens[position][1] if position < len(tokens) else 'end of query'
+            raise TagQueryError(f"Expected {kind} but found {found!r}.")
+        position += 1
+        return tokens[position - 1][1]
+
+    def parse_or() -> Tuple:
+        items = [parse_and()]
+        while peek() == 'OR':
+            take('OR')
+            items.append(parse_and())
+        return items[0] if len(items) == 1 else ('or', tuple(items))
+
+    def parse_and() -> Tuple:
+        items = [parse_not()]
+        while peek() == 'AND':
+            take('AND')
+            items.append(parse_not())
+        return items[0] if len(items) == 1 else ('and', tuple(items))
+
+    def parse_not() -> Tuple:
+        if peek() == 'NOT':
+            take('NOT')
+            return 'not', parse_not()
+        if peek() == '(':
+            take('(')
+            node = parse_or()
+            take(')')
+            return node
+        return 'tag', take('TAG')
+
+    node = parse_or()
+    if position != len(tokens):
+        raise TagQueryError(f"Unexpected {tokens[position][1]!r}.")
+    if len(tag_query_tags(node)) > MAX_QUERY_TERMS:
+        raise TagQueryError(f"Tag query can reference at most {MAX_QUERY_TERMS} tags.")
+    return node
+
+
+def tag_query_tags(node: Tuple) -> Set[str]:
+    if node[0] == 'tag':
+        return {node[1]}
+    if node[0] == 'not':
+        return tag_query_tags(node[1])
+    return set().union(*(tag_query_tags(item) for item in node[1]))
+
+
+def tag_query_q(node: Tuple) -> Q:
+    """数据库回退：把表达式转换为基于 Tagging 子查询的条件"""
+    if node[0] == 'tag':
+        return Q(Exists(Tagging.objects.filter(target_id=OuterRef('pk'), tag_id__name=node[1])))
+    if node[0] == 'not':
+        return ~tag_query_q(node[1])
+    q = tag_query_q(node[1][0])
+    for item in node[1][1:]:
+        q = q & tag_query_q(item) if node[0] == 'and' else q | tag_query_q(item)
+    return q
+
+
+class TagIndex:
+    """标签到目标的倒排索引：目标按 ID 排序编号，每个标签保存有序的编号数组，查询时转为位图做集合运算"""
+
+    def __init__(self, version: int, ids: List[Any], postings: Dict[str, array], bitmap_cache_size: int = 256):
+        self.version = version
+        self.ids = ids
+        self.postings = postings
+        self.universe = (1 << len(ids)) - 1
+        self._bitmaps: 'OrderedDict[str, int]' = OrderedDict()
+        self._bitmap_cache_size = bitmap_cache_size
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, version: int) -> 'TagIndex':
+        ids = list(Target.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=10000))
+        ordinals = {target_id: ordinal for ordinal, target_id in enumerate(ids)}
+        postings: Dict[str, array] = {}
+        for name, target_id in Tagging.objects.values_list('tag_id__name', 'target_id').iterator(chunk_size=10000):
+            ordinal = ordinals.get(target_id)
+            if ordinal is not None:
+                postings.setdefault(name, array('I')).append(ordinal)
+        for name, ordinals_array in postings.items():
+            postings[name] = array('I', sorted(set(ordinals_array)))
+        return cls(version, ids, postings)
+
+    def bitmap(self, name: str) -> int:
+        with self._lock:
+            if name in self._bitmaps:
+                self._bitmaps.move_to_end(name)
+                return self._bitmaps[name]
+        bits = bytearray((len(self.ids) + 7) // 8)
+        for ordinal in self.postings.get(name, ()):
+            bits[ordinal >> 3] |= 1 << (ordinal & 7)
+        value = int.from_bytes(bits, 'little')
+        with self._lock:
+            self._bitmaps[name] = value
+            if len(self._bitmaps) > self._bitmap_cache_size:
+                self._bitmaps.popitem(last=False)
+        return value
+
+    def evaluate(self, node: Tuple) -> int:
+        if node[0] == 'tag':
+            return self.bitmap(node[1])
+        if node[0] == 'not':
+            return self.universe & ~self.evaluate(node[1])
+        values = [self.evaluate(item) for item in node[1]]
+        result = values[0]
+        for value in values[1:]:
+            result = result & value if node[0] == 'and' else result | value
+        return result
+
+    def target_ids(self, bitmap: int, limit: int) -> Optional[List[Any]]:
+        """位图对应的目标 ID，超过 limit 时返回 None"""
+        if bin(bitmap).count('1') > limit:
+            return None
+        data = bitmap.to_bytes((len(self.ids) + 7) // 8, 'little')
+        ids = []
+        for match in re.finditer(rb'[^\x00]', data):
+            byte = match.group()[0]
+            base = match.start() << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    ids.append(self.ids[base + bit])
+        return ids
+
+
+def get_tag_index_version() -> int:
+    return CacheVersion.objects.filter(name=TAG_INDEX_VERSION).values_list('version', flat=True).first() or 0
+
+
+def invalidate_tag_index() -> None:
+    """标签或目标发生变化时递增版本号，各进程在下一次查询时发现索引过期；
+    在 batch_tag_index_invalidation 中调用时推迟到批次结束"""
+    batch = _invalidation_batch.get()
+    if batch is not None:
+        batch.append(True)
+        return
+    _increment_version()
+
+
+@contextmanager
+def batch_tag_index_invalidation() -> Iterator[None]:
+    """批量保存目标和标签时使用，整个批次最多递增一次版本号，避免每个 URL 都写 CacheVersion"""
+    if _invalidation_batch.get() is not None:
+        yield
+        return
+    batch = []
+    token = _invalidation_batch.set(batch)
+    try:
+        yield
+    finally:
+        _invalidation_batch.reset(token)
+        if batch:
+            _increment_version()
+
+
+def _increment_version() -> None:
+    if CacheVersion.objects.filter(name=TAG_INDEX_VERSION).update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            CacheVersion.objects.create(name=TAG_INDEX_VERSION, version=1)
+    except IntegrityError:
+        CacheVersion.objects.filter(name=TAG_INDEX_VERSION).update(version=F('version') + 1)
+
+
+def _build_index(version: int) -> None:
+    global _index, _building
+    try:
+        index = TagIndex.build(version)
+        with _index_lock:
+            if _index is None or _index.version < version:
+                _index = index
+    except Exception:
+        logger.exception("Failed to build tag index")
+    finally:
+        with _index_lock:
+            _building = False
+        connections.close_all()
+
+
+def get_tag_index() -> Optional[TagIndex]:
+    """返回与数据库版本一致的索引；索引不存在或已过期时在后台重建，并返回 None 让调用方回退到数据库查询"""
+    global _building
+    if os.getenv('TAG_INDEX_ENABLED', 'true').lower() != 'true':
+        return None
+    version = get_tag_index_version()
+    with _index_lock:
+        if _index is not None and _index.version == version:
+            return _index
+        if _building:
+            return None
+        _building = True
+    threading.Thread(target=_build_index, args=(version,), name='archivebox-tag-index', daemon=True).start()
+    return None
+
+
+def get_tag_index_max_ids() -> int:
+    # 索引结果作为 id IN (...) 的参数绑定，数量过多时语句本身的开销超过子查询
+    return int(os.getenv('TAG_INDEX_MAX_IDS', '500'))
+
+
+def tag_query_filter(query: str) -> Q:
+    """标签表达式对应的筛选条件，优先使用内存索引，结果过多或索引不可用时使用子查询"""
+    node = parse_tag_query(query)
+    index = get_tag_index()
+    if index is not None:
+        ids = index.target_ids(index.evaluate(node), get_tag_index_max_ids())
+        if ids is not None:
+            return Q(id__in=ids)
+    return tag_query_q(node)
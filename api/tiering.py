@@ -0,0 +1,413 @@
+import logging
+import os
+import posixpath
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from django.db import transaction
+from dotenv import load_dotenv
+
+from api.dedup import SKIP_FILE_NAMES, TMP_SUFFIX, _iter_files, get_archive_dir
+from api.locks import acquire_lock, task_lock
+from api.models import ArchiveFile, BundleMember, SnapshotBundle, Target
+from api.utils import format_snapshot_timestamp
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_SUFFIX = '.zip'
+READ_CHUNK_SIZE = 64 * 1024
+# zip 本地文件头的固定长度，文件名和扩展字段长度位于第 26-30 字节
+LOCAL_HEADER_SIZE = 30
+# 本身已经压缩过的格式直接存储，避免重复压缩浪费 CPU
+STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.ico',
+    '.mp4', '.webm', '.mkv', '.mov', '.mp3', '.m4a', '.ogg', '.opus',
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.zip', '.7z', '.woff', '.woff2',
+}
+
+
+class BundleError(Exception):
+    pass
+
+
+def get_cold_storage_dir() -> str:
+    return os.getenv('COLD_STORAGE_DIR') or os.path.join(os.getenv('PROJECT_DIR', ''), 'data', 'cold')
+
+
+def get_tier_min_age() -> float:
+    return float(os.getenv('TIER_MIN_AGE_DAYS', '30')) * 86400
+
+
+def get_tier_compress_level() -> int:
+    return int(os.getenv('TIER_COMPRESS_LEVEL', '6'))
+
+
+def get_tier_lock_seconds() -> float:
+    return float(os.getenv('TIER_LOCK_SECONDS', '600'))
+
+
+def get_bundle_path(name: str) -> str:
+    return os.path.join(get_cold_storage_dir(), name + BUNDLE_SUFFIX)
+
+
+class MemberCache:
+    """按字节数限制大小的 LRU 缓存，保存最近读取的小文件的解压内容"""
+
+    def __init__(self, max_bytes: int, max_member: int):
+        self.max_bytes = max_bytes
+        self.max_member = max_member
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str, member: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get((name, member))
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end((name, member))
+            self.hits += 1
+            return data
+
+    def put(self, name: str, member: str, data: bytes) -> None:
+        if len(data) > self.max_member or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop((name, member), None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[(name, member)] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, name: str) -> None:
+        with self._lock:
+            for key in [key for key in self._items if key[0] == name]:
+                self.size -= len(self._items.pop(key))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'items': len(self._items), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_member_cache() -> MemberCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MemberCache(int(os.getenv('TIER_CACHE_SIZE', str(64 * 1024 * 1024))),
+                                 int(os.getenv('TIER_CACHE_MAX_MEMBER', str(1024 * 1024))))
+        return _cache
+
+
+def _data_offset(f, header_offset: int) -> int:
+    """zip 目录中记录的是本地文件头的位置，压缩数据紧跟在文件头、文件名和扩展字段之后"""
+    f.seek(header_offset)
+    header = f.read(LOCAL_HEADER_SIZE)
+    if len(header) != LOCAL_HEADER_SIZE or header[:4] != b'PK\x03\x04':
+        raise BundleError(f"Invalid local file header at offset {header_offset}.")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return header_offset + LOCAL_HEADER_SIZE + name_length + extra_length
+
+
+def _snapshot_files(snapshot_dir: str) -> List[tuple]:
+    files = []
+    for entry in _iter_files(snapshot_dir):
+        name = os.path.relpath(entry.path, snapshot_dir).replace(os.sep, '/')
+        # 只有快照根目录下的索引文件保持原样，wget 镜像中的 index.html 照常打包
+        if name in SKIP_FILE_NAMES or name.endswith(TMP_SUFFIX):
+            continue
+        try:
+            files.append((name, entry.stat(follow_symlinks=False)))
+        except FileNotFoundError:
+            continue
+    return files
+
+
+def _write_bundle(path: str, snapshot_dir: str, files: List[tuple]) -> List[zipfile.ZipInfo]:
+    level = get_tier_compress_level()
+    with zipfile.ZipFile(path, 'w', allowZip64=True) as bundle:
+        for name, _ in files:
+            extension = os.path.splitext(name)[1].lower()
+            compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            bundle.write(os.path.join(snapshot_dir, name), name, compress_type=compress_type, compresslevel=level)
+    with zipfile.ZipFile(path) as bundle:
+        bad = bundle.testzip()
+        if bad:
+            raise BundleError(f"Bundle verification failed for member {bad}.")
+        return bundle.infolist()
+
+
+def _remove_empty_dirs(snapshot_dir: str) -> None:
+    for root, dirs, _ in os.walk(snapshot_dir, topdown=False):
+        for name in dirs:
+            try:
+                os.rmdir(os.path.join(root, name))
+            except OSError:
+                pass
+
+
+def tier_snapshot(name: str, min_age: float = None, now: float = None, dry_run: bool = False) -> Dict[str, Any]:
+    """把一个快照目录中除索引文件外的文件打包为一个压缩包，并在数据库中记录每个文件的偏移，
+    打包完成且文件没有被改写时删除原文件"""
+    min_age = get_tier_min_age() if min_age is None else min_age
+    now = now or time.time()
+    snapshot_dir = os.path.join(get_archive_dir(), name)
+    if SnapshotBundle.objects.filter(timestamp=name).exists():
+        return {'status': 'skipped', 'reason': 'already tiered'}
+
+    files = _snapshot_files(snapshot_dir)
+    if not files:
+        return {'status': 'skipped', 'reason': 'no files'}
+    # ArchiveBox 每次更新快照都会重写 index.json，因此它的修改时间也计入快照的最近修改时间
+    mtimes = [st.st_mtime for _, st in files]
+    for index_name in SKIP_FILE_NAMES:
+        try:
+            mtimes.append(os.stat(os.path.join(snapshot_dir, index_name)).st_mtime)
+        except FileNotFoundError:
+            pass
+    if now - max(mtimes) < min_age:
+        return {'status': 'skipped', 'reason': 'recently modified'}
+    original_size = sum(st.st_size for _, st in files)
+    if dry_run:
+        return {'status': 'candidate', 'files': len(files), 'original_size': original_size}
+
+    bundle_path = get_bundle_path(name)
+    tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+    try:
+        infos = _write_bundle(tmp_path, snapshot_dir, files)
+        with open(tmp_path, 'rb') as f:
+            offsets = {info.filename: _data_offset(f, info.header_offset) for info in infos}
+            os.fsync(f.fileno())
+        # 打包期间被改写的快照留到下一次处理
+        for member_name, st in files:
+            current = os.stat(os.path.join(snapshot_dir, member_name))
+            if (current.st_size, current.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                os.remove(tmp_path)
+                return {'status': 'skipped', 'reason': 'modified while packing'}
+        os.replace(tmp_path, bundle_path)
+    except (OSError, zipfile.BadZipFile, BundleError) as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        logger.warning("Failed to tier snapshot %s: %s", name, e)
+        return {'status': 'error', 'reason': str(e)}
+
+    file_stats = dict(files)
+    size = os.path.getsize(bundle_path)
+    with transaction.atomic():
+        bundle = SnapshotBundle.objects.create(timestamp=name, path=bundle_path, size=size,
+                                               original_size=original_size, file_count=len(infos))
+        BundleMember.objects.bulk_create([
+            BundleMember(bundle_id=bundle, name=info.filename, offset=offsets[info.filename],
+                         compressed_size=info.compress_size, size=info.file_size, compress_type=info.compress_type,
+                         crc32=info.CRC, mtime=file_stats[info.filename].st_mtime)
+            for info in infos
+        ], batch_size=500)
+
+    for member_name, _ in files:
+        try:
+            os.remove(os.path.join(snapshot_dir, member_name))
+        except FileNotFoundError:
+            pass
+    _remove_empty_dirs(snapshot_dir)
+    # 打包后的文件不再参与硬链接去重
+    ArchiveFile.objects.filter(path__startswith=name + os.sep).delete()
+    return {'status': 'tiered', 'files': len(infos), 'original_size': original_size, 'size': size}
+
+
+def tier_snapshots(min_age: float = None, limit: int = None, dry_run: bool = False) -> Dict[str, Any]:
+    """按时间戳从旧到新打包 data/archive 下超过 TIER_MIN_AGE_DAYS 没有修改的快照；
+    每个服务进程都会启动定期任务，通过数据库锁保证同一时间只有一个进程在打包"""
+    totals = {'scanned': 0, 'tiered': 0, 'skipped': 0, 'errors': 0, 'files': 0, 'original_size': 0, 'size': 0}
+    if dry_run:
+        return _tier_snapshots(totals, min_age, limit, dry_run)
+    lock_seconds = get_tier_lock_seconds()
+    with task_lock('tiering', lock_seconds) as owner:
+        if owner is None:
+            totals['locked'] = True
+            return totals
+        return _tier_snapshots(totals, min_age, limit, dry_run, lambda: acquire_lock('tiering', owner, lock_seconds))
+
+
+def _tier_snapshots(totals: Dict[str, Any], min_age: float, limit: int, dry_run: bool,
+                    renew_lock=None) -> Dict[str, Any]:
+    archive_dir = get_archive_dir()
+    if not os.path.isdir(archive_dir):
+        return totals
+    tiered = set(SnapshotBundle.objects.values_list('timestamp', flat=True))
+    names = sorted((entry.name for entry in os.scandir(archive_dir)
+                    if entry.is_dir(follow_symlinks=False) and entry.name not in tiered), key=_timestamp_key)
+    now = time.time()
+    for name in names:
+        if limit and totals['tiered'] >= limit:
+            break
+        # 每个快照打包前续期，锁已被其他进程接管时停止
+        if renew_lock and not renew_lock():
+            totals['locked'] = True
+            break
+        totals['scanned'] += 1
+        stats = tier_snapshot(name, min_age, now, dry_run)
+        status = stats['status']
+        if status in ('tiered', 'candidate'):
+            totals['tiered'] += 1
+            for key in ('files', 'original_size', 'size'):
+                totals[key] += stats.get(key, 0)
+        elif status == 'error':
+            totals['errors'] += 1
+        else:
+            totals['skipped'] += 1
+    return totals
+
+
+def _timestamp_key(name: str) -> tuple:
+    try:
+        return 0, float(name), name
+    except ValueError:
+        return 1, 0.0, name
+
+
+def iter_member(bundle_path: str, member: BundleMember) -> Iterator[bytes]:
+    """直接定位到压缩数据的偏移解压单个文件，不读取 zip 目录，读取结束后校验 CRC"""
+    if member.compress_type == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    elif member.compress_type == zipfile.ZIP_STORED:
+        decompressor = None
+    else:
+        raise BundleError(f"Unsupported compression type {member.compress_type}.")
+    crc = 0
+    with open(bundle_path, 'rb') as f:
+        f.seek(member.offset)
+        remaining = member.compressed_size
+        while remaining:
+            data = f.read(min(READ_CHUNK_SIZE, remaining))
+            if not data:
+                raise BundleError(f"Bundle {bundle_path} is truncated.")
+            remaining -= len(data)
+            if decompressor:
+                data = decompressor.decompress(data)
+            if data:
+                crc = zlib.crc32(data, crc)
+                yield data
+        if decompressor:
+            data = decompressor.flush()
+            if data:
+                crc = zlib.crc32(data, crc)
+                yield data
+    if crc != member.crc32:
+        raise BundleError(f"CRC mismatch for {member.name} in {bundle_path}.")
+
+
+def find_member(name: str, member_name: str) -> Optional[BundleMember]:
+    return BundleMember.objects.select_related('bundle_id').filter(bundle_id__timestamp=name,
+                                                                   name=member_name).first()
+
+
+def safe_member_name(name: str, member_name: str) -> bool:
+    """请求的路径只能指向快照目录内部"""
+    if not name or name in ('.', '..') or '/' in name or os.sep in name:
+        return False
+    normalized = posixpath.normpath(member_name)
+    return normalized == member_name and not normalized.startswith(('/', '../')) and normalized != '..'
+
+
+def open_snapshot_file(name: str, member_name: str) -> Optional[Dict[str, Any]]:
+    """读取快照中的文件：目录中存在时返回文件路径，否则从压缩包中取出，小文件经过缓存"""
+    if not safe_member_name(name, member_name):
+        return None
+    path = os.path.join(get_archive_dir(), name, member_name)
+    if os.path.isfile(path):
+        return {'path': path}
+    cache = get_member_cache()
+    data = cache.get(name, member_name)
+    if data is not None:
+        return {'content': data, 'size': len(data)}
+    member = find_member(name, member_name)
+    if member is None:
+        return None
+    bundle_path = member.bundle_id.path
+    if member.size <= cache.max_member:
+        data = b''.join(iter_member(bundle_path, member))
+        cache.put(name, member_name, data)
+        return {'content': data, 'size': len(data)}
+    return {'stream': iter_member(bundle_path, member), 'size': member.size}
+
+
+def rehydrate_snapshot(name: str) -> int:
+    """把压缩包中的文件解压回快照目录并删除压缩包，重新存档前调用"""
+    bundle = SnapshotBundle.objects.filter(timestamp=name).first()
+    if bundle is None:
+        return 0
+    snapshot_dir = os.path.join(get_archive_dir(), name)
+    restored = 0
+    for member in BundleMember.objects.filter(bundle_id=bundle):
+        path = os.path.join(snapshot_dir, member.name)
+        if os.path.lexists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写入临时文件再改名，服务中的请求不会读到不完整的文件
+        tmp_path = path + TMP_SUFFIX
+        with open(tmp_path, 'wb') as f:
+            for data in iter_member(bundle.path, member):
+                f.write(data)
+        os.utime(tmp_path, (member.mtime, member.mtime))
+        os.replace(tmp_path, path)
+        restored += 1
+    delete_bundles([name])
+    return restored
+
+
+def rehydrate_urls(urls: List[str]) -> int:
+    """解压这些 URL 已打包的快照，ArchiveBox 重新存档时需要读取和改写原有的文件"""
+    names = {format_snapshot_timestamp(timestamp)
+             for timestamp in Target.objects.filter(url__in=urls).values_list('timestamp', flat=True)}
+    if not names:
+        return 0
+    restored = 0
+    for name in SnapshotBundle.objects.filter(timestamp__in=names).values_list('timestamp', flat=True):
+        restored += rehydrate_snapshot(name)
+    return restored
+
+
+def delete_bundles(names: Iterable[str]) -> int:
+    """删除快照的压缩包文件和成员记录"""
+    bundles = list(SnapshotBundle.objects.filter(timestamp__in=list(names)).values_list('id', 'timestamp', 'path'))
+    if not bundles:
+        return 0
+    ids = [bundle_id for bundle_id, _, _ in bundles]
+    with transaction.atomic():
+        BundleMember.objects.filter(bundle_id__in=ids).delete()
+        SnapshotBundle.objects.filter(id__in=ids).delete()
+    cache = get_member_cache()
+    for _, name, path in bundles:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        cache.discard(name)
+    return len(bundles)
+
+
+def rehydrate_before_add(urls: List[str], update: bool, update_all: bool, overwrite: bool) -> int:
+    """ArchiveBox 根据快照目录中已有的输出判断提取器是否需要重新执行，更新前先把打包的快照解压回来"""
+    if update_all:
+        return sum(rehydrate_snapshot(name) for name in SnapshotBundle.objects.values_list('timestamp', flat=True))
+    if update or overwrite:
+        return rehydrate_urls(urls)
+    return 0
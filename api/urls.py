@@ -1,9 +1,28 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('init', views.init_project, name='init_project'),
     path('sync', views.synchronization, name='synchronization'),
     path('add', views.add_urls, name='add_urls'),
+    path('import', views.import_urls, name='import_urls'),
+    path('retry', views.retry_failed, name='retry_failed'),
+    path('remove', views.remove_targets, name='remove_targets'),
+    path('refresh/policies', views.refresh_policies, name='refresh_policies'),
+    path('refresh/run', views.refresh_run, name='refresh_run'),
+    path('webhooks/subscriptions', views.webhook_subscriptions, name='webhook_subscriptions'),
+    path('webhooks/subscriptions/<uuid:subscription_id>', views.webhook_subscription_detail,
+         name='webhook_subscription_detail'),
+    path('jobs/<uuid:job_id>', views.job_detail, name='job_detail'),
     path('list', views.list_target, name='list_target'),
+    path('export', views.export_data, name='export_data'),
+    path('archive/<str:timestamp>/<path:name>', views.archive_file, name='archive_file'),
+    path('stats', views.result_stats, name='result_stats'),
+    path('stats/storage', views.storage_stats, name='storage_stats'),
+    path('stats/read-model', views.read_model_stats, name='read_model_stats'),
+    path('async/init', async_views.init_project, name='async_init_project'),
+    path('async/sync', async_views.synchronization, name='async_synchronization'),
+    path('async/add', async_views.add_urls, name='async_add_urls'),
+    path('async/add/stream', async_views.add_urls_stream, name='async_add_urls_stream'),
+    path('async/list', async_views.list_target, name='async_list_target'),
 ]
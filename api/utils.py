@@ -1,19 +1,38 @@
+import asyncio
+import copy
 import json
 import os
+import shlex
 import subprocess
+import weakref
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from urllib.parse import urlparse
 import pytz
 
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
 from dotenv import load_dotenv
 import re
 
 from api.models import Result, Target, Tag, Tagging
+from api.processes import archivebox_env, archivebox_service, new_container_name, container_run_options, \
+    register_process, unregister_process, terminate_command
+from api.stats import ARCHIVE_URL_PREFIX, measure_output, record_storage_usage, record_tag_storage_usage, \
+    record_result_summary, record_tag_summary
+from api.read_model import record_changes, result_change, tagging_change, target_change
+from api.tag_index import batch_tag_index_invalidation, invalidate_tag_index, tag_query_filter
 
 # 加载 .env 文件中的配置
 load_dotenv()
 
+# filter_target_queryset 支持的目标筛选条件
+TARGET_FILTER_KEYS = ('tag_names', 'tag_query', 'domains', 'urls')
+
+_command_semaphores = weakref.WeakKeyDictionary()
+
 
 def success_response(message: str, **data: Any) -> Dict[str, Any]:
     return build_simple_response("success", message, **data)
@@ -46,16 +65,107 @@ def get_domain(url: str) -> str:
     return urlparse(url).netloc
 
 
-def execute_docker_compose_archivebox_command(command_args: str) -> Dict[str, Any]:
-    """执行 Docker Compose ArchiveBox 命令并处理异常"""
+def execute_docker_compose_archivebox_command(command_args: str, stdin: str = None,
+                                              timeout: float = None) -> Dict[str, Any]:
+    """执行 Docker Compose ArchiveBox 命令并处理异常，stdin 不为空时通过标准输入传给 ArchiveBox"""
+    project_dir = os.getenv('PROJECT_DIR')
+    container_name = new_container_name()
+    env_options = [option for key, value in archivebox_env().items() for option in ("-e", f"{key}={value}")]
+    run_options = " ".join(shlex.quote(option) for option in env_options + container_run_options(container_name))
+    service = archivebox_service.get()
+    if stdin is None:
+        command = f"docker compose run {run_options} --rm {service} {command_args}"
+    else:
+        command = f"docker compose run -T {run_options} --rm {service} {command_args}"
+    try:
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE if stdin is not None else None,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8',
+                                   cwd=project_dir, start_new_session=True)
+    except OSError as e:
+        return error_response(f"Failed to execute command '{command}': {e}", error=e)
+
+    register_process(process.pid, container_name)
+    try:
+        stdout, stderr = process.communicate(stdin, timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        terminate_command(process.pid, container_name)
+        process.communicate()
+        return error_response(f"Command '{command}' timed out after {timeout} seconds.", error=e)
+    finally:
+        unregister_process(process.pid)
+
+    if process.returncode != 0:
+        e = subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+        return error_response(f"Failed to execute command '{command}': {e}", error=e, stderr=stderr)
+    return success_response(f"Command '{command}' executed successfully.", stdout=stdout)
+
+
+def build_docker_compose_archivebox_argv(command_args: List[str], stdin: bool = False,
+                                        env: Dict[str, str] = None, container_name: str = None) -> List[str]:
+    argv = ["docker", "compose", "run"]
+    if stdin:
+        argv.append("-T")
+    for key, value in dict(archivebox_env(), **(env or {})).items():
+        argv.extend(["-e", f"{key}={value}"])
+    if container_name:
+        argv.extend(container_run_options(container_name))
+    argv.extend(["--rm", archivebox_service.get()])
+    argv.extend(command_args)
+    return argv
+
+
+def get_command_semaphore() -> asyncio.Semaphore:
+    """每个事件循环一个信号量，限制同时运行的 ArchiveBox 命令数量"""
+    loop = asyncio.get_running_loop()
+    semaphore = _command_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(int(os.getenv('ARCHIVEBOX_MAX_CONCURRENT_COMMANDS', '4')))
+        _command_semaphores[loop] = semaphore
+    return semaphore
+
+
+async def run_command_async(argv: List[str], cwd: str = None, stdin: str = None, timeout: float = None,
+                            container_name: str = None) -> (int, str, str):
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        start_new_session=True
+    )
+    register_process(process.pid, container_name)
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            process.communicate(stdin.encode('utf-8') if stdin is not None else None), timeout=timeout)
+    except asyncio.TimeoutError:
+        await asyncio.to_thread(terminate_command, process.pid, container_name)
+        await process.wait()
+        raise subprocess.TimeoutExpired(argv, timeout)
+    finally:
+        unregister_process(process.pid)
+    return process.returncode, stdout.decode('utf-8', errors='replace'), stderr.decode('utf-8', errors='replace')
+
+
+async def execute_docker_compose_archivebox_command_async(command_args: List[str], stdin: str = None,
+                                                          timeout: float = None) -> Dict[str, Any]:
+    """异步执行 Docker Compose ArchiveBox 命令，不经过 shell"""
     project_dir = os.getenv('PROJECT_DIR')
-    command = f"docker compose run --rm archivebox {command_args}"
+    container_name = new_container_name()
+    argv = build_docker_compose_archivebox_argv(command_args, stdin=stdin is not None, container_name=container_name)
+    command = " ".join(argv)
     try:
-        result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                encoding='utf-8', cwd=project_dir)
-        return success_response(f"Command '{command}' executed successfully.", stdout=result.stdout)
-    except subprocess.CalledProcessError as e:
-        return error_response(f"Failed to execute command '{command}': {e}", error=e, stderr=e.stderr)
+        async with get_command_semaphore():
+            returncode, stdout, stderr = await run_command_async(argv, cwd=project_dir, stdin=stdin, timeout=timeout,
+                                                                 container_name=container_name)
+    except subprocess.TimeoutExpired as e:
+        return error_response(f"Command '{command}' timed out after {timeout} seconds.", error=e)
+    except (OSError, ValueError) as e:
+        return error_response(f"Failed to execute command '{command}': {e}", error=e)
+    if returncode != 0:
+        e = subprocess.CalledProcessError(returncode, argv, stdout, stderr)
+        return error_response(f"Failed to execute command '{command}': {e}", error=e, stderr=stderr)
+    return success_response(f"Command '{command}' executed successfully.", stdout=stdout)
 
 
 def check_docker_version() -> Dict[str, Any]:
@@ -116,6 +226,21 @@ def parse_log(log_text: str, total_links: List[str]) -> Dict[str, Any]:
     return success_response("Log parsed successfully.", data=result)
 
 
+def latest_history_entry(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # 重新存档时 ArchiveBox 会追加新的记录，取开始时间最晚的一条
+    return max(entries, key=lambda entry: entry.get('start_ts') or '')
+
+
+def format_snapshot_timestamp(timestamp: float) -> str:
+    text = repr(float(timestamp))
+    return text[:-2] if text.endswith('.0') else text
+
+
+def snapshot_index_file(timestamp: float) -> str:
+    project_dir = os.getenv('PROJECT_DIR')
+    return os.path.join(project_dir, "data", "archive", format_snapshot_timestamp(timestamp), 'index.json')
+
+
 def process_json_data(index_file: str) -> Dict[str, Any]:
     with open(index_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
@@ -130,8 +255,9 @@ def process_json_data(index_file: str) -> Dict[str, Any]:
     for key, value in history.items():
         if len(value) == 0:
             continue
-        start_ts = value[0].get('start_ts')
-        end_ts = value[0].get('end_ts')
+        entry = latest_history_entry(value)
+        start_ts = entry.get('start_ts')
+        end_ts = entry.get('end_ts')
 
         if start_ts:
             utc_start_ts = datetime.fromisoformat(start_ts)
@@ -146,8 +272,8 @@ def process_json_data(index_file: str) -> Dict[str, Any]:
         processed_history[key] = {
             'start_ts': start_ts,
             'end_ts': end_ts,
-            'status': True if value[0].get('status') == "succeeded" else False,
-            'output': f"/static/archive/{timestamp}/{value[0].get('output')}"
+            'status': True if entry.get('status') == "succeeded" else False,
+            'output': f"{ARCHIVE_URL_PREFIX}{timestamp}/{entry.get('output')}"
         }
 
     return {
@@ -157,106 +283,163 @@ def process_json_data(index_file: str) -> Dict[str, Any]:
     }
 
 
-def save_result(data: Dict[str, Any]) -> Any:
-
+def save_result(data: Dict[str, Any], overwrite_extractors: List[str] = None) -> Any:
+    """保存快照的提取结果，overwrite_extractors 中的提取器会用最新结果覆盖已有记录"""
     url = data['url']
     timestamp = data['timestamp']
     history = data['history']
 
-    t, _ = Target.objects.get_or_create(url=url, defaults={
+    # url 和 (target_id, extractor, timestamp) 有唯一约束，并发创建时 get_or_create 捕获 IntegrityError 后
+    # 重新读取已有记录，只有真正创建记录的一方计入统计
+    t, created = Target.objects.get_or_create(url=url, defaults={
         'timestamp': timestamp,
         'domain': get_domain(url)
     })
+    changes = []
+    if created:
+        invalidate_tag_index()
+        changes.append(target_change(t))
+
+    snapshot_dir = os.path.dirname(snapshot_index_file(timestamp)) if os.getenv('PROJECT_DIR') else None
+    # 已有的结果沿用保存的大小，只有新建或输出、状态发生变化时才重新统计磁盘占用
+    existing = {} if created else {
+        row.extractor: row for row in Result.objects.filter(target_id=t, timestamp=timestamp, extractor__in=history)
+    }
 
     for key, value in history.items():
         start_ts = value.get('start_ts')
         end_ts = value.get('end_ts')
 
-        Result.objects.get_or_create(
-            timestamp=timestamp, target_id=t, extractor=key, defaults={
-                'start_ts': start_ts,
-                'end_ts': end_ts,
-                'status': value.get('status'),
-                'output': value.get('output'),
-            }
-        )
-
+        defaults = {
+            'start_ts': start_ts,
+            'end_ts': end_ts,
+            'status': value.get('status'),
+            'output': value.get('output'),
+        }
+        overwrite = bool(overwrite_extractors and key in overwrite_extractors)
+        stored = existing.get(key)
+        if stored is not None and not overwrite:
+            continue
+        changed = stored is None or stored.output != defaults['output'] or stored.status != defaults['status']
+        if snapshot_dir and changed:
+            defaults['size'], defaults['file_count'] = measure_output(snapshot_dir, value.get('output'))
+
+        result, created = Result.objects.get_or_create(timestamp=timestamp, target_id=t, extractor=key,
+                                                       defaults=defaults)
+        if created:
+            record_storage_usage(t, key, result.size, result.file_count)
+            record_result_summary(t, key, None, result)
+            changes.append(result_change(result))
+        elif overwrite:
+            with transaction.atomic():
+                # 先写入再读取旧值，并发覆盖同一结果时统计的差值基于最新的记录，不会重复计算
+                Result.objects.filter(id=result.id).update(updated_at=timezone.now())
+                old = Result.objects.get(id=result.id)
+                result = copy.copy(old)
+                for field, field_value in defaults.items():
+                    setattr(result, field, field_value)
+                result.save()
+                record_storage_usage(t, key, result.size - old.size, result.file_count - old.file_count)
+                record_result_summary(t, key, old, result)
+            changes.append(result_change(result))
+
+    record_changes(changes)
     return t
 
 
 def save_tags(url: str, tags: List[str]) -> bool:
     target = Target.objects.get(url=url)
 
+    changes = []
     for tag_name in tags:
         tag, _ = Tag.objects.get_or_create(name=tag_name)
-        Tagging.objects.get_or_create(tag_id=tag, target_id=target)
+        _, created = Tagging.objects.get_or_create(tag_id=tag, target_id=target)
+        if created:
+            changes.append(tagging_change(target, tag_name))
+            record_tag_storage_usage(target, tag_name)
+            record_tag_summary(target, tag_name)
+    if changes:
+        invalidate_tag_index()
+        record_changes(changes)
 
     return True
 
 
-def build_add_args(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool, overwrite: bool,
-                   extractors: str, parser: str) -> str:
-    command_args = "add "
+def build_add_argv(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool, overwrite: bool,
+                   extractors: str, parser: str) -> List[str]:
+    argv = ["add"]
 
     if urls:
-        command_args += " ".join(urls)
+        argv.extend(urls)
     if tags:
-        command_args += f" --tag={','.join(tags)}"
+        argv.append(f"--tag={','.join(tags)}")
     if depth is not None:
-        command_args += f" --depth={depth}"
+        argv.append(f"--depth={depth}")
     if update:
-        command_args += " --update"
+        argv.append("--update")
     if update_all:
-        command_args += " --update-all"
+        argv.append("--update-all")
     if overwrite:
-        command_args += " --overwrite"
+        argv.append("--overwrite")
     if extractors:
         if "headers" not in extractors:
             extractors += ",headers"
-        command_args += f" --extract={extractors}"
+        argv.append(f"--extract={extractors}")
     if parser:
-        command_args += f" --parser={parser}"
-
-    return command_args
-
+        argv.append(f"--parser={parser}")
 
-def process_archive_paths(archive_paths: List[Dict[str, Any]], data_dir: str, tags: List[str]) -> (
-        Dict[str, Any], Dict[str, str]):
-    url_archive_paths = {}
-    crawl_status = {}
+    return argv
 
-    for item in archive_paths:
-        url = item['url']
-        path = item['archive_path']
-        full_path = os.path.join(data_dir, path)
-        index_file = os.path.join(full_path, 'index.json')
-
-        if not os.path.exists(index_file):
-            crawl_status[url] = 'failed'
-            continue
-        data = process_json_data(index_file)
-        save_result(data)
 
-        if tags:
-            save_tags(url, tags)
-
-        with open(index_file, 'r', encoding='utf-8') as f:
-            index_data = json.load(f)
-        history = index_data.get('history', {})
-        if not history:
-            crawl_status[url] = 'failed'
-            continue
+def build_add_args(urls: List[str], tags: List[str], depth: int, update: bool, update_all: bool, overwrite: bool,
+                   extractors: str, parser: str) -> str:
+    return " ".join(build_add_argv(urls, tags, depth, update, update_all, overwrite, extractors, parser))
 
-        if 'headers' not in history or not history["headers"] or history["headers"][0]["status"] != 'succeeded':
-            crawl_status[url] = 'failed'
-            continue
 
-        url_paths = extract_url_paths(history, path)
-        if url_paths:
-            url_archive_paths[url] = url_paths
-            crawl_status[url] = 'succeeded'
-        else:
-            crawl_status[url] = 'failed'
+def process_archive_paths(archive_paths: List[Dict[str, Any]], data_dir: str, tags: List[str],
+                          overwrite: bool = False) -> (Dict[str, Any], Dict[str, str]):
+    from api.dedup import queue_dedup
+    url_archive_paths = {}
+    crawl_status = {}
+    dedup = os.getenv('DEDUP_ON_INGEST', 'true').lower() == 'true'
+
+    # 整批保存完成后只使标签索引失效一次
+    with batch_tag_index_invalidation():
+        for item in archive_paths:
+            url = item['url']
+            path = item['archive_path']
+            full_path = os.path.join(data_dir, path)
+            index_file = os.path.join(full_path, 'index.json')
+
+            if not os.path.exists(index_file):
+                crawl_status[url] = 'failed'
+                continue
+            data = process_json_data(index_file)
+            # 重新存档时用最新的结果覆盖已有记录
+            save_result(data, overwrite_extractors=list(data['history']) if overwrite else None)
+            if dedup:
+                queue_dedup(full_path)
+
+            if tags:
+                save_tags(url, tags)
+
+            with open(index_file, 'r', encoding='utf-8') as f:
+                index_data = json.load(f)
+            history = index_data.get('history', {})
+            if not history:
+                crawl_status[url] = 'failed'
+                continue
+
+            if not history.get('headers') or latest_history_entry(history['headers']).get('status') != 'succeeded':
+                crawl_status[url] = 'failed'
+                continue
+
+            url_paths = extract_url_paths(history, path)
+            if url_paths:
+                url_archive_paths[url] = url_paths
+                crawl_status[url] = 'succeeded'
+            else:
+                crawl_status[url] = 'failed'
 
     return url_archive_paths, crawl_status
 
@@ -264,8 +447,11 @@ def process_archive_paths(archive_paths: List[Dict[str, Any]], data_dir: str, ta
 def extract_url_paths(history: Dict[str, Any], path: str) -> Dict[str, str]:
     url_paths = {}
     for key, entries in history.items():
-        if entries and entries[0].get('status') == 'succeeded':
-            output = entries[0].get('output')
+        if not entries:
+            continue
+        entry = latest_history_entry(entries)
+        if entry.get('status') == 'succeeded':
+            output = entry.get('output')
             if output:
                 static_url = f"/static/{clean_path(os.path.join(path, output))}"
                 url_paths[key] = static_url
@@ -283,3 +469,44 @@ def build_response(urls: List[str], url_archive_paths: Dict[str, Any], crawl_sta
         return success_response("All URLs processed successfully.", archive_paths=success_urls)
     else:
         return error_response("All URLs failed to process.", failed_urls=failed_urls)
+
+
+def filter_target_queryset(data: Dict[str, Any]) -> QuerySet:
+    return apply_target_filters(data)[0]
+
+
+def apply_target_filters(data: Dict[str, Any]) -> Tuple[QuerySet, bool]:
+    """按 TARGET_FILTER_KEYS 筛选目标，同时返回是否应用了任何筛选条件；
+    结果、标签等按目标筛选的查询在没有条件时不需要关联目标表"""
+    tag_names = data.get('tag_names', [])
+    tag_query = data.get('tag_query')
+    domains = data.get('domains', [])
+    urls = data.get('urls', [])
+
+    targets = Target.objects.all()
+    filtered = False
+
+    if tag_names:
+        tags = Tag.objects.filter(name__in=tag_names)
+        taggings = Tagging.objects.filter(tag_id__in=tags)
+        targets = targets.filter(id__in=taggings.values('target_id'))
+        filtered = True
+
+    if tag_query:
+        targets = targets.filter(tag_query_filter(tag_query))
+        filtered = True
+
+    if domains:
+        targets = targets.filter(domain__in=domains)
+        filtered = True
+
+    if urls:
+        targets = targets.filter(url__in=urls)
+        filtered = True
+
+    return targets, filtered
+
+
+def target_filters(data: Dict[str, Any]) -> Dict[str, Any]:
+    """保存到任务参数中的目标筛选条件，只保留有值的条件"""
+    return {key: data.get(key) for key in TARGET_FILTER_KEYS if data.get(key)}
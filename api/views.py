@@ -1,13 +1,21 @@
-from drf_yasg import openapi
-from rest_framework.decorators import api_view
+import mimetypes
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 
 from rest_framework import status
 
 from . import service
+from .export import astream_export, stream_export, export_filename
+from .schema import swagger_auto_schema
 from .serializers import AddUrlsSerializer, FilterTargetsSerializer, SuccessResponseSerializer, \
-    PartialSuccessResponseSerializer, ErrorResponseSerializer, common_responses
-from drf_yasg.utils import swagger_auto_schema
+    PartialSuccessResponseSerializer, ErrorResponseSerializer, common_responses, ExportSerializer, \
+    ImportUrlsSerializer, RetryFailedSerializer, RefreshPolicySerializer, RefreshRunSerializer, \
+    StorageStatsSerializer, ResultStatsSerializer, WebhookSubscriptionSerializer, RemoveTargetsSerializer
 
 from .service import filter_targets
 
@@ -33,6 +41,18 @@ def add_urls(request):
         serializer = AddUrlsSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
+            if data.get('fan_out'):
+                result = service.crawl_urls(
+                    data.get('urls'),
+                    data.get('tag'),
+                    data.get('update', False),
+                    data.get('overwrite', False),
+                    data.get('extractors'),
+                    data.get('parser', 'auto'),
+                    plan=data.get('plan'),
+                    callback_url=data.get('callback_url')
+                )
+                return handle_response(result)
             result = service.add_url(
                 data.get('urls'),
                 data.get('tag'),
@@ -41,7 +61,36 @@ def add_urls(request):
                 data.get('update_all', False),
                 data.get('overwrite', False),
                 data.get('extractors'),
-                data.get('parser', 'auto')
+                data.get('parser', 'auto'),
+                plan=data.get('plan'),
+                callback_url=data.get('callback_url'),
+                lanes=data.get('lanes')
+            )
+            return handle_response(result)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='post', request_body=ImportUrlsSerializer, responses=common_responses)
+@api_view(['POST'])
+@parser_classes([MultiPartParser])
+def import_urls(request):
+    if request.method == 'POST':
+        serializer = ImportUrlsSerializer(data=request.data)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            result = service.import_urls(
+                data.get('file'),
+                data.get('parser', 'txt'),
+                data.get('tag'),
+                data.get('update', False),
+                data.get('overwrite', False),
+                data.get('extractors'),
+                data.get('chunk_size', 500),
+                callback_url=data.get('callback_url')
             )
             return handle_response(result)
         else:
@@ -51,6 +100,134 @@ def add_urls(request):
                         status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@swagger_auto_schema(method='post', request_body=RetryFailedSerializer, responses=common_responses)
+@api_view(['POST'])
+def retry_failed(request):
+    if request.method == 'POST':
+        serializer = RetryFailedSerializer(data=request.data)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            result = service.retry_failed_extractors(data, data.get('batch_size', 50), data.get('force', False))
+            return handle_response(result)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='post', request_body=RemoveTargetsSerializer, responses=common_responses)
+@api_view(['POST'])
+def remove_targets(request):
+    if request.method == 'POST':
+        serializer = RemoveTargetsSerializer(data=request.data)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            result = service.remove_targets(data, data.get('batch_size', 100), data.get('delete_files', True))
+            return handle_response(result)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='get', responses=common_responses)
+@swagger_auto_schema(method='post', request_body=RefreshPolicySerializer, responses=common_responses)
+@api_view(['GET', 'POST'])
+def refresh_policies(request):
+    if request.method == 'GET':
+        result = service.list_refresh_policies()
+        return handle_response(result)
+    elif request.method == 'POST':
+        serializer = RefreshPolicySerializer(data=request.data)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            result = service.set_refresh_policy(data['tag'], data['interval'], data.get('priority', 0),
+                                                data.get('enabled', True))
+            return handle_response(result)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='post', request_body=RefreshRunSerializer, responses=common_responses)
+@api_view(['POST'])
+def refresh_run(request):
+    if request.method == 'POST':
+        serializer = RefreshRunSerializer(data=request.data)
+        if serializer.is_valid():
+            result = service.run_refresh_tick(serializer.validated_data.get('force', False))
+            return handle_response(result)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='get', responses=common_responses)
+@swagger_auto_schema(method='post', request_body=WebhookSubscriptionSerializer, responses=common_responses)
+@api_view(['GET', 'POST'])
+def webhook_subscriptions(request):
+    if request.method == 'GET':
+        result = service.list_webhook_subscriptions()
+        return handle_response(result)
+    elif request.method == 'POST':
+        serializer = WebhookSubscriptionSerializer(data=request.data)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            result = service.create_webhook_subscription(data['tag'], data['url'], data.get('secret'))
+            return handle_response(result)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='delete', responses=common_responses)
+@api_view(['DELETE'])
+def webhook_subscription_detail(request, subscription_id):
+    if request.method == 'DELETE':
+        result = service.delete_webhook_subscription(subscription_id)
+
+        if result["status"] == "success":
+            return Response(result, status=status.HTTP_200_OK)
+        else:
+            return Response(result, status=status.HTTP_404_NOT_FOUND)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='get', responses=common_responses)
+@swagger_auto_schema(method='delete', responses=common_responses)
+@api_view(['GET', 'DELETE'])
+def job_detail(request, job_id):
+    if request.method == 'GET':
+        result = service.get_job(job_id)
+
+        if result["status"] == "success":
+            return Response(result, status=status.HTTP_200_OK)
+        else:
+            return Response(result, status=status.HTTP_404_NOT_FOUND)
+    elif request.method == 'DELETE':
+        result = service.cancel_job(job_id)
+
+        if result["status"] == "success":
+            return Response(result, status=status.HTTP_200_OK)
+        elif "job" in result:
+            return Response(result, status=status.HTTP_409_CONFLICT)
+        else:
+            return Response(result, status=status.HTTP_404_NOT_FOUND)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
 @api_view(['GET'])
 def synchronization(request):
     if request.method == 'GET':
@@ -81,6 +258,122 @@ def list_target(request):
                         status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@swagger_auto_schema(method='get', query_serializer=ResultStatsSerializer, responses=common_responses)
+@api_view(['GET'])
+def result_stats(request):
+    if request.method == 'GET':
+        serializer = ResultStatsSerializer(data={
+            **request.query_params.dict(),
+            'key': request.query_params.getlist('key'),
+        })
+        if serializer.is_valid():
+            data = serializer.validated_data
+            result = service.get_result_stats(data.get('scope', 'extractor'), data.get('key', []),
+                                              data.get('limit', 100))
+            return handle_response(result)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='get', responses=common_responses)
+@api_view(['GET'])
+def read_model_stats(request):
+    if request.method == 'GET':
+        result = service.get_read_model_stats()
+        return handle_response(result)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='get', query_serializer=StorageStatsSerializer, responses=common_responses)
+@api_view(['GET'])
+def storage_stats(request):
+    if request.method == 'GET':
+        serializer = StorageStatsSerializer(data={
+            **request.query_params.dict(),
+            'key': request.query_params.getlist('key'),
+        })
+        if serializer.is_valid():
+            data = serializer.validated_data
+            result = service.get_storage_stats(data.get('scope', 'tag'), data.get('key', []), data.get('limit', 100))
+            return handle_response(result)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='post', request_body=ExportSerializer)
+@api_view(['POST'])
+def export_data(request):
+    if request.method == 'POST':
+        serializer = ExportSerializer(data=request.data)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            entity = data.get('entity', 'results')
+            export_format = data.get('format', 'ndjson')
+            compress = data.get('compress', True)
+
+            # ASGI 下使用异步迭代器逐块发送，否则 Django 会先把整个导出读入内存
+            stream = astream_export if isinstance(request._request, ASGIRequest) else stream_export
+            response = StreamingHttpResponse(
+                stream(entity, export_format, data, data.get('since'), compress, since_id=data.get('since_id')),
+                content_type='application/gzip' if compress else (
+                    'text/csv' if export_format == 'csv' else 'application/x-ndjson')
+            )
+            response['Content-Disposition'] = \
+                f'attachment; filename="{export_filename(entity, export_format, compress)}"'
+            return response
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@swagger_auto_schema(method='get', responses={200: 'File content', 404: 'Not found'})
+@api_view(['GET'])
+def archive_file(request, timestamp, name):
+    if request.method == 'GET':
+        result = service.get_archive_file(timestamp, name)
+        if result["status"] != "success":
+            return Response(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR if "error" in result
+                            else status.HTTP_404_NOT_FOUND)
+        return archive_file_response(result['file'], name)
+    else:
+        return Response({'status': 'error', 'message': 'Invalid request method'},
+                        status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@require_GET
+def static_archive_file(request, timestamp, name):
+    # 结果中的 output 是 /static/archive/<timestamp>/<file> 形式的地址，快照转入冷存储后文件不在磁盘上，
+    # 因此同样通过 get_archive_file 读取，不使用静态文件目录
+    result = service.get_archive_file(timestamp, name)
+    if result["status"] != "success":
+        if "error" in result:
+            return HttpResponse(result["message"], status=500, content_type='text/plain')
+        raise Http404(result["message"])
+    return archive_file_response(result['file'], name)
+
+
+def archive_file_response(file, name):
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if 'path' in file:
+        return FileResponse(open(file['path'], 'rb'), content_type=content_type)
+    if 'content' in file:
+        return HttpResponse(file['content'], content_type=content_type)
+    # 大文件边解压边返回
+    response = StreamingHttpResponse(file['stream'], content_type=content_type)
+    response['Content-Length'] = str(file['size'])
+    return response
+
+
 def handle_response(result):
     if result["status"] == "success":
         return Response(result, status=status.HTTP_200_OK)
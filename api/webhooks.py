@@ -0,0 +1,299 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.models import Tagging, WebhookEvent, WebhookSubscription
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Archivebox-Signature'
+TIMESTAMP_HEADER = 'X-Archivebox-Timestamp'
+
+_last_prune = None
+_prune_lock = threading.Lock()
+
+
+def get_webhook_secret() -> str:
+    return os.getenv('WEBHOOK_SECRET', '')
+
+
+def new_secret() -> str:
+    return secrets.token_hex(32)
+
+
+def get_webhook_allowed_hosts() -> Set[str]:
+    hosts = os.getenv('WEBHOOK_ALLOWED_HOSTS', '')
+    return {host.strip().lower() for host in hosts.split(',') if host.strip()}
+
+
+def check_webhook_url(url: str) -> Optional[str]:
+    """通知地址只能指向公网，防止通过 callback_url 或订阅访问内网服务：解析域名后拒绝回环、内网、链路本地等地址；
+    WEBHOOK_ALLOWED_HOSTS 中的主机不做检查。返回 None 表示可以投递，否则返回原因"""
+    return resolve_webhook_url(url)[1]
+
+
+def resolve_webhook_url(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """返回 (地址, 错误)：地址是检查通过的解析结果，投递时直接连接该地址；WEBHOOK_ALLOWED_HOSTS 中的主机不解析，地址为 None"""
+    try:
+        parsed = urlparse(url)
+        host = parsed.hostname
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    except ValueError as e:
+        return None, f"Invalid webhook URL: {e}"
+    if parsed.scheme not in ('http', 'https') or not host:
+        return None, "Webhook URL must be an http(s) URL."
+    if host.lower() in get_webhook_allowed_hosts():
+        return None, None
+    try:
+        addresses = sorted({info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)})
+    except (socket.gaierror, UnicodeError) as e:
+        return None, f"Cannot resolve webhook host {host}: {e}"
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            return None, f"Webhook host {host} resolves to a non-public address {ip}."
+    return addresses[0], None
+
+
+def pinned_session(address: str):
+    """连接固定在 address 上的 requests 会话。Host 头和 TLS 的 SNI、证书校验仍使用 URL 中的主机名，
+    投递时不会再次解析域名，检查之后把域名改为指向内网地址（DNS rebinding）也不会生效"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class PinnedAddressAdapter(HTTPAdapter):
+
+        def build_connection_pool_key_attributes(self, request, verify, cert=None):
+            host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+            if host_params['scheme'] == 'https':
+                pool_kwargs['server_hostname'] = host_params['host']
+                pool_kwargs['assert_hostname'] = host_params['host']
+            host_params['host'] = address
+            return host_params, pool_kwargs
+
+        def send(self, request, **kwargs):
+            request.headers['Host'] = urlparse(request.url).netloc
+            return super().send(request, **kwargs)
+
+    session = requests.Session()
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, PinnedAddressAdapter())
+    return session
+
+
+def webhook_backoff(attempts: int) -> timedelta:
+    """第 n 次投递失败后等待 base * 2^(n-1) 秒，最长不超过 WEBHOOK_BACKOFF_MAX"""
+    base = float(os.getenv('WEBHOOK_BACKOFF_BASE', '10'))
+    maximum = float(os.getenv('WEBHOOK_BACKOFF_MAX', '3600'))
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), maximum))
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    """签名内容为 "<timestamp>.<body>"，接收方应同时校验时间戳，防止重放"""
+    digest = hmac.new(secret.encode(), timestamp.encode() + b'.' + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def verify_signature(secret: str, timestamp: str, body: bytes, signature: str, tolerance: float = 300,
+                     now: float = None) -> bool:
+    """供接收方和测试使用的签名校验"""
+    try:
+        if abs((now or time.time()) - float(timestamp)) > tolerance:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(sign_payload(secret, timestamp, body), signature)
+
+
+def enqueue_event(url: str, event: str, payload: Dict[str, Any],
+                  subscription: WebhookSubscription = None) -> WebhookEvent:
+    return WebhookEvent.objects.create(url=url, event=event, payload=payload, subscription_id=subscription,
+                                       next_attempt_at=timezone.now())
+
+
+def batch_payload(urls: List[str], result: Dict[str, Any]) -> Dict[str, Any]:
+    archive_paths = result.get('archive_paths', {})
+    return {
+        'urls': urls,
+        'status': result['status'],
+        'message': result['message'],
+        'archive_paths': archive_paths,
+        'failed_urls': result.get('failed_urls', [url for url in urls if url not in archive_paths]),
+    }
+
+
+def notify_batch_completed(callback_url: Optional[str], urls: List[str], result: Dict[str, Any]) -> int:
+    """只向 callback_url 发送整批的结果，不通知订阅"""
+    if not callback_url:
+        return 0
+    enqueue_event(callback_url, 'batch.completed', batch_payload(urls, result))
+    return 1
+
+
+def notify_add_completed(urls: List[str], result: Dict[str, Any], callback_url: str = None) -> int:
+    """add 完成后入队通知：callback_url 收到整批的结果，订阅了相关标签的地址收到每个 URL 的结果"""
+    queued = notify_batch_completed(callback_url, urls, result)
+    archive_paths = result.get('archive_paths', {})
+
+    subscriptions = list(WebhookSubscription.objects.filter(enabled=True).select_related('tag_id'))
+    if not subscriptions:
+        return queued
+    url_tags: Dict[str, List[str]] = {}
+    tag_ids = {subscription.tag_id_id for subscription in subscriptions}
+    for url, tag_name in Tagging.objects.filter(target_id__url__in=urls, tag_id__in=tag_ids).values_list(
+            'target_id__url', 'tag_id__name'):
+        url_tags.setdefault(url, []).append(tag_name)
+    for url, tags in url_tags.items():
+        payload = {
+            'url': url,
+            'status': 'succeeded' if url in archive_paths else 'failed',
+            'archive_paths': archive_paths.get(url, {}),
+            'tags': sorted(set(tags)),
+        }
+        # 同一地址通过多个标签订阅时只通知一次
+        notified = set()
+        for subscription in subscriptions:
+            if subscription.tag_id.name in tags and (subscription.url, subscription.secret) not in notified:
+                notified.add((subscription.url, subscription.secret))
+                enqueue_event(subscription.url, 'url.completed', payload, subscription)
+                queued += 1
+    return queued
+
+
+def claim_events(limit: int, now: datetime = None) -> Tuple[str, List[WebhookEvent]]:
+    """认领到期的事件，多个服务进程同时投递时同一事件只会被一个进程认领"""
+    now = now or timezone.now()
+    # 投递过程中进程退出的事件，超过 WEBHOOK_CLAIM_TIMEOUT 后重新投递
+    stale = now - timedelta(seconds=float(os.getenv('WEBHOOK_CLAIM_TIMEOUT', '300')))
+    WebhookEvent.objects.filter(status='sending', claimed_at__lt=stale).update(status='pending', claim='')
+
+    claim = uuid.uuid4().hex
+    ids = list(WebhookEvent.objects.filter(status='pending', next_attempt_at__lte=now)
+               .order_by('next_attempt_at', 'created_at').values_list('id', flat=True)[:limit])
+    if not ids:
+        return claim, []
+    WebhookEvent.objects.filter(id__in=ids, status='pending').update(status='sending', claim=claim, claimed_at=now)
+    return claim, list(WebhookEvent.objects.filter(claim=claim, status='sending')
+                       .select_related('subscription_id').order_by('created_at'))
+
+
+def deliver(url: str, secret: str, events: List[WebhookEvent]) -> Optional[str]:
+    """把一批事件合并为一次 POST，返回 None 表示投递成功，否则返回错误信息"""
+    import requests
+
+    body = json.dumps({'events': [{
+        'id': str(event.id),
+        'event': event.event,
+        'created_at': event.created_at.isoformat(),
+        'data': event.payload,
+    } for event in events]}).encode()
+    # 域名解析结果可能在创建后改变，投递前重新检查并连接检查通过的地址；不跟随重定向，避免被转到内网地址
+    address, error = resolve_webhook_url(url)
+    if error:
+        return error
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'archivebox-api-server',
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: sign_payload(secret, timestamp, body),
+    }
+    session = pinned_session(address) if address else requests.Session()
+    # 固定地址时不使用环境变量中的代理，否则域名会由代理重新解析
+    proxies = {'http': None, 'https': None} if address else None
+    try:
+        with session:
+            response = session.post(url, data=body, headers=headers, allow_redirects=False, proxies=proxies,
+                                    timeout=float(os.getenv('WEBHOOK_TIMEOUT', '10')))
+    except requests.RequestException as e:
+        return str(e)
+    if 200 <= response.status_code < 300:
+        return None
+    return f"HTTP {response.status_code}: {response.text[:200]}"
+
+
+def dispatch_webhooks(limit: int = None) -> Dict[str, int]:
+    """投递到期的事件：同一地址的事件按 WEBHOOK_BATCH_SIZE 合并，失败后按指数退避重试"""
+    limit = limit or int(os.getenv('WEBHOOK_DISPATCH_LIMIT', '500'))
+    batch_size = int(os.getenv('WEBHOOK_BATCH_SIZE', '50'))
+    max_attempts = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '8'))
+    claim, events = claim_events(limit)
+    stats = {'delivered': 0, 'retrying': 0, 'failed': 0, 'requests': 0}
+
+    batches: Dict[Tuple[str, str], List[WebhookEvent]] = {}
+    for event in events:
+        secret = event.subscription_id.secret if event.subscription_id else get_webhook_secret()
+        batches.setdefault((event.url, secret), []).append(event)
+
+    for (url, secret), url_events in batches.items():
+        for start in range(0, len(url_events), batch_size):
+            batch = url_events[start:start + batch_size]
+            if secret:
+                error = deliver(url, secret, batch)
+                stats['requests'] += 1
+            else:
+                # 不发送未签名的通知，配置 WEBHOOK_SECRET 前 callback_url 的事件一直等待重试
+                error = "WEBHOOK_SECRET is not configured."
+            now = timezone.now()
+            if error is None:
+                WebhookEvent.objects.filter(id__in=[event.id for event in batch], claim=claim).update(
+                    status='delivered', delivered_at=now, claim='', last_error='', updated_at=now)
+                stats['delivered'] += len(batch)
+                continue
+            logger.warning("Webhook delivery to %s failed: %s", url, error)
+            for event in batch:
+                attempts = event.attempts + 1
+                if attempts >= max_attempts:
+                    status, next_attempt_at = 'failed', now
+                    stats['failed'] += 1
+                else:
+                    status, next_attempt_at = 'pending', now + webhook_backoff(attempts)
+                    stats['retrying'] += 1
+                WebhookEvent.objects.filter(id=event.id, claim=claim).update(
+                    status=status, attempts=attempts, next_attempt_at=next_attempt_at, claim='', last_error=error,
+                    updated_at=now)
+    stats['pruned'] = prune_delivered_events()
+    return stats
+
+
+def prune_delivered_events(now: datetime = None, force: bool = False) -> int:
+    """删除投递成功超过 WEBHOOK_RETENTION 秒的事件，每隔 WEBHOOK_PRUNE_INTERVAL 秒最多执行一次"""
+    global _last_prune
+    with _prune_lock:
+        interval = float(os.getenv('WEBHOOK_PRUNE_INTERVAL', '3600'))
+        if not force and _last_prune is not None and time.monotonic() - _last_prune < interval:
+            return 0
+        _last_prune = time.monotonic()
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=float(os.getenv('WEBHOOK_RETENTION', '604800')))
+    deleted, _ = WebhookEvent.objects.filter(status='delivered', delivered_at__lt=cutoff).delete()
+    return deleted
+
+
+def serialize_subscription(subscription: WebhookSubscription, include_secret: bool = False) -> Dict[str, Any]:
+    data = {
+        'id': str(subscription.id),
+        'tag': subscription.tag_id.name,
+        'url': subscription.url,
+        'enabled': subscription.enabled,
+        'created_at': subscription.created_at,
+    }
+    if include_secret:
+        data['secret'] = subscription.secret
+    return data
@@ -0,0 +1,241 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from api.models import Job, JobChunk
+from api.processes import current_chunk_id, current_job_id, kill_job_processes
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 可以由 worker 认领的任务类型，它们的 URL 都保存在 JobChunk 中
+CHUNK_JOB_KINDS = ('import', 'refresh', 'deferred', 'crawl_links', 'heavy')
+# 按通道划分认领的任务类型，慢速通道的节点可以单独部署并限制并发
+LANE_JOB_KINDS = {
+    'all': CHUNK_JOB_KINDS,
+    'fast': tuple(kind for kind in CHUNK_JOB_KINDS if kind != 'heavy'),
+    'heavy': ('heavy',),
+}
+
+
+def get_lease_seconds() -> float:
+    return float(os.getenv('WORKER_LEASE_SECONDS', '120'))
+
+
+def get_max_attempts() -> int:
+    return int(os.getenv('WORKER_MAX_ATTEMPTS', '3'))
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def _claimable_chunks(kinds=CHUNK_JOB_KINDS):
+    return JobChunk.objects.filter(status='pending', job_id__kind__in=kinds,
+                                   job_id__status__in=['pending', 'running']).order_by('job_id__created_at', 'index')
+
+
+def claim_chunk(worker_id: str, lease_seconds: float = None, kinds=CHUNK_JOB_KINDS) -> Optional[JobChunk]:
+    """认领一个待执行的批次：PostgreSQL 使用 SKIP LOCKED，SQLite 使用带条件的原子更新"""
+    lease_seconds = lease_seconds or get_lease_seconds()
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            chunk = _claimable_chunks(kinds).select_for_update(skip_locked=True, of=('self',)).first()
+            if chunk is None:
+                return None
+            now = timezone.now()
+            JobChunk.objects.filter(id=chunk.id).update(
+                status='running', lease_owner=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=F('attempts') + 1, updated_at=now)
+    else:
+        # 其他节点可能同时选中同一批次，只有条件更新成功的一方认领成功，失败时换下一个候选
+        for _ in range(5):
+            chunk_id = _claimable_chunks(kinds).values_list('id', flat=True).first()
+            if chunk_id is None:
+                return None
+            now = timezone.now()
+            if JobChunk.objects.filter(id=chunk_id, status='pending').update(
+                    status='running', lease_owner=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds),
+                    attempts=F('attempts') + 1, updated_at=now):
+                chunk = JobChunk(id=chunk_id)
+                break
+        else:
+            return None
+
+    chunk = JobChunk.objects.select_related('job_id').get(id=chunk.id)
+    Job.objects.filter(id=chunk.job_id_id, status='pending').update(status='running', updated_at=timezone.now())
+    return chunk
+
+
+def renew_lease(chunk_id: Any, worker_id: str, lease_seconds: float = None) -> bool:
+    """心跳：延长租约，返回 False 表示租约已经过期并被重新分配"""
+    lease_seconds = lease_seconds or get_lease_seconds()
+    now = timezone.now()
+    return bool(JobChunk.objects.filter(id=chunk_id, lease_owner=worker_id, status='running').update(
+        lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now))
+
+
+def complete_chunk(chunk: JobChunk, worker_id: str, fields: Dict[str, Any]) -> bool:
+    """写回批次结果，只有仍持有租约时才会生效"""
+    now = timezone.now()
+    with transaction.atomic():
+        if not JobChunk.objects.filter(id=chunk.id, lease_owner=worker_id, status='running').update(
+                lease_owner='', lease_expires_at=None, updated_at=now, **fields):
+            return False
+        Job.objects.filter(id=chunk.job_id_id).update(processed=F('processed') + chunk.size,
+                                                      failed=F('failed') + fields.get('failed', 0), updated_at=now)
+    finalize_job(chunk.job_id_id)
+    return True
+
+
+def requeue_expired_chunks(now=None) -> Dict[str, int]:
+    """租约过期的批次重新排队，超过最大尝试次数的标记为失败"""
+    now = now or timezone.now()
+    expired = JobChunk.objects.filter(status='running', lease_expires_at__lt=now)
+    failed_jobs = set(expired.filter(attempts__gte=get_max_attempts()).values_list('job_id', flat=True))
+    failed = expired.filter(attempts__gte=get_max_attempts()).update(
+        status='failed', lease_owner='', lease_expires_at=None, failed=F('size'),
+        result={'message': "Lease expired too many times."}, updated_at=now)
+    requeued = expired.filter(attempts__lt=get_max_attempts()).update(
+        status='pending', lease_owner='', lease_expires_at=None, updated_at=now)
+    for job_id in failed_jobs:
+        finalize_job(job_id)
+    return {'requeued': requeued, 'failed': failed}
+
+
+def finalize_job(job_id: Any) -> Optional[str]:
+    """所有批次都结束后，根据批次状态设置任务状态"""
+    chunks = JobChunk.objects.filter(job_id=job_id)
+    if chunks.filter(status__in=['pending', 'running']).exists():
+        return None
+    succeeded = chunks.filter(status__in=['succeeded', 'partial_success']).count()
+    failed = chunks.filter(status='failed').count()
+    if succeeded and failed:
+        status, message = 'partial_success', "Job finished with some failed chunks."
+    elif succeeded:
+        status, message = 'succeeded', "Job finished successfully."
+    else:
+        status, message = 'failed', "All chunks failed."
+    now = timezone.now()
+    if Job.objects.filter(id=job_id, status__in=['pending', 'running']).update(status=status, updated_at=now):
+        Job.objects.filter(id=job_id).update(
+            result={'message': message, 'succeeded_chunks': succeeded, 'failed_chunks': failed}, updated_at=now)
+        from api.service import notify_heavy_lane_completed
+        notify_heavy_lane_completed(job_id, status)
+        return status
+    return None
+
+
+class Worker:
+    """在本机执行从数据库认领的批次，多个节点共享同一个数据库和存储即可横向扩展"""
+
+    def __init__(self, worker_id: str = None, concurrency: int = None, poll_interval: float = None,
+                 heartbeat_interval: float = None, lease_seconds: float = None, lane: str = 'all'):
+        self.worker_id = worker_id or new_worker_id()
+        self.kinds = LANE_JOB_KINDS[lane]
+        if lane == 'heavy' and not concurrency:
+            from api.lanes import get_heavy_lane_workers
+            concurrency = get_heavy_lane_workers()
+        self.concurrency = concurrency or int(os.getenv('WORKER_CONCURRENCY', '1'))
+        self.poll_interval = poll_interval or float(os.getenv('WORKER_POLL_INTERVAL', '5'))
+        self.lease_seconds = lease_seconds or get_lease_seconds()
+        self.heartbeat_interval = heartbeat_interval or float(os.getenv('WORKER_HEARTBEAT_INTERVAL', '30'))
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='archivebox-worker')
+        self.active: Dict[Any, Future] = {}
+        self.chunks: Dict[Any, JobChunk] = {}
+        self.stopping = threading.Event()
+        self.last_heartbeat = time.monotonic()
+
+    def run_chunk(self, chunk: JobChunk) -> None:
+        from api.service import execute_add_chunk
+
+        token = current_job_id.set(str(chunk.job_id_id))
+        chunk_token = current_chunk_id.set(str(chunk.id))
+        try:
+            try:
+                fields = execute_add_chunk(chunk.job_id.params, chunk.urls.split("\n"))
+            except Exception as e:
+                logger.exception("Chunk %s failed", chunk.id)
+                fields = {'succeeded': 0, 'failed': chunk.size, 'status': 'failed',
+                          'result': {'message': f"Chunk failed: {e}"}}
+            if Job.objects.filter(id=chunk.job_id_id, status='cancelled').exists():
+                fields['status'] = 'cancelled'
+            if not complete_chunk(chunk, self.worker_id, fields):
+                logger.warning("Lease on chunk %s was lost, result discarded", chunk.id)
+        finally:
+            current_chunk_id.reset(chunk_token)
+            current_job_id.reset(token)
+            connections.close_all()
+
+    def heartbeat(self) -> None:
+        for chunk_id, chunk in list(self.chunks.items()):
+            if Job.objects.filter(id=chunk.job_id_id, status='cancelled').exists():
+                kill_job_processes(chunk.job_id_id)
+            elif not renew_lease(chunk_id, self.worker_id, self.lease_seconds):
+                # 租约已被其他节点接管，只结束本地执行该批次的命令，同一任务的其他批次继续执行
+                logger.warning("Lost lease on chunk %s", chunk_id)
+                kill_job_processes(chunk.job_id_id, chunk_id)
+
+    def reap(self) -> None:
+        for chunk_id, future in list(self.active.items()):
+            if future.done():
+                del self.active[chunk_id]
+                del self.chunks[chunk_id]
+
+    def fill(self) -> int:
+        claimed = 0
+        while len(self.active) < self.concurrency and not self.stopping.is_set():
+            chunk = claim_chunk(self.worker_id, self.lease_seconds, self.kinds)
+            if chunk is None:
+                break
+            self.chunks[chunk.id] = chunk
+            self.active[chunk.id] = self.executor.submit(self.run_chunk, chunk)
+            claimed += 1
+        return claimed
+
+    def wait(self, timeout: float) -> None:
+        """等待到下一次轮询，期间有批次完成时提前返回，并按间隔发送心跳"""
+        if self.active:
+            wait(list(self.active.values()), timeout=min(timeout, self.heartbeat_interval),
+                 return_when=FIRST_COMPLETED)
+        else:
+            self.stopping.wait(timeout)
+        if time.monotonic() - self.last_heartbeat >= self.heartbeat_interval:
+            self.heartbeat()
+            self.last_heartbeat = time.monotonic()
+        self.reap()
+
+    def run(self, once: bool = False) -> None:
+        """持续认领并执行批次；once 为 True 时只认领一轮，执行完后退出"""
+        self.last_heartbeat = time.monotonic()
+        try:
+            while not self.stopping.is_set():
+                requeue_expired_chunks()
+                self.reap()
+                self.fill()
+                if once:
+                    while self.active:
+                        self.wait(self.heartbeat_interval)
+                    break
+                self.wait(self.poll_interval)
+        finally:
+            connections.close_all()
+            self.shutdown()
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
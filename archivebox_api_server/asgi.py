@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
 
 application = get_asgi_application()
+
+from api.jobs import start_background_tasks  # noqa: E402
+
+start_background_tasks()
@@ -0,0 +1,67 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.templatetags.static import static
+
+SWAGGER_UI_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>ArchiveBox API</title>
+  <link rel="stylesheet" href="{css}">
+</head>
+<body>
+  <div id="swagger-ui"></div>
+  <script src="{bundle}"></script>
+  <script src="{preset}"></script>
+  <script>
+    window.ui = SwaggerUIBundle({{
+      url: "{schema_url}",
+      dom_id: "#swagger-ui",
+      presets: [SwaggerUIBundle.presets.apis, SwaggerUIStandalonePreset],
+      layout: "StandaloneLayout"
+    }});
+  </script>
+</body>
+</html>
+"""
+
+REDOC_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>ArchiveBox API</title>
+</head>
+<body>
+  <redoc spec-url="{schema_url}"></redoc>
+  <script src="{redoc}"></script>
+</body>
+</html>
+"""
+
+
+@lru_cache(maxsize=1)
+def _schema_bytes() -> bytes:
+    with open(settings.OPENAPI_SCHEMA_FILE, 'rb') as f:
+        return f.read()
+
+
+def openapi_schema(request):
+    return HttpResponse(_schema_bytes(), content_type='application/json')
+
+
+def swagger_ui(request):
+    return HttpResponse(SWAGGER_UI_PAGE.format(
+        css=static('drf-yasg/swagger-ui-dist/swagger-ui.css'),
+        bundle=static('drf-yasg/swagger-ui-dist/swagger-ui-bundle.js'),
+        preset=static('drf-yasg/swagger-ui-dist/swagger-ui-standalone-preset.js'),
+        schema_url=request.build_absolute_uri('/swagger.json'),
+    ))
+
+
+def redoc_ui(request):
+    return HttpResponse(REDOC_PAGE.format(
+        redoc=static('drf-yasg/redoc/redoc.min.js'),
+        schema_url=request.build_absolute_uri('/swagger.json'),
+    ))
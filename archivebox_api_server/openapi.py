@@ -0,0 +1,10 @@
+from drf_yasg import openapi
+
+api_info = openapi.Info(
+    title="ArchiveBox API",
+    default_version='v1',
+    description="API documentation for ArchiveBox",
+    terms_of_service="https://www.google.com/policies/terms/",
+    contact=openapi.Contact(email="contact@yourproject.local"),
+    license=openapi.License(name="BSD License"),
+)
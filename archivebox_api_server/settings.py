@@ -9,12 +9,18 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
+import importlib.util
 import os
 from pathlib import Path
 
+import django
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+load_dotenv(BASE_DIR / '.env')
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
@@ -36,12 +42,19 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'drf_yasg',
     'api',
 ]
 
+# 预生成的 OpenAPI 文档（python manage.py generate_openapi_schema），存在时直接读取文件，服务进程不再加载 drf_yasg
+OPENAPI_SCHEMA_FILE = Path(os.getenv('OPENAPI_SCHEMA_FILE', BASE_DIR / 'openapi.json'))
+OPENAPI_PREBUILT = OPENAPI_SCHEMA_FILE.exists()
+
+if not OPENAPI_PREBUILT:
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('api'), 'drf_yasg')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -72,12 +85,55 @@ WSGI_APPLICATION = 'archivebox_api_server.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
-
-DATABASES = {
-    'default': {
+# 数据库配置从 .env 读取，DB_ENGINE 可选 sqlite 或 postgresql
+
+
+def build_database_config():
+    engine = os.getenv('DB_ENGINE', 'sqlite').lower()
+    conn_max_age = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
+    if engine in ('postgres', 'postgresql'):
+        config = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'archivebox_api_server'),
+            'USER': os.getenv('DB_USER', ''),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': conn_max_age,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+        # Django 5.1 起支持 psycopg 3 的连接池，此时由连接池管理连接，不能再设置 CONN_MAX_AGE
+        if os.getenv('DB_POOL', 'false').lower() == 'true' and django.VERSION >= (5, 1):
+            config['CONN_MAX_AGE'] = 0
+            config['OPTIONS']['pool'] = {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+            }
+        return config
+
+    busy_timeout = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))
+    return {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('DB_NAME') or BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # sqlite3.connect 的 timeout 单位为秒
+            'timeout': busy_timeout / 1000,
+        },
+        # 在 api.db.configure_sqlite 中执行
+        'SQLITE_PRAGMAS': {
+            'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+            'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+            'busy_timeout': busy_timeout,
+        },
     }
+
+
+DATABASES = {
+    'default': build_database_config()
 }
 
 # Password validation
@@ -122,11 +178,17 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True
 
 SWAGGER_SETTINGS = {
-    'DEFAULT_INFO': 'archivebox_api_server.urls.api_info',
+    'DEFAULT_INFO': 'archivebox_api_server.openapi.api_info',
 }
 
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'archivebox_data/data')
 ]
 
+if OPENAPI_PREBUILT:
+    # 文档页面仍使用 drf_yasg 自带的 swagger-ui 和 redoc 静态文件，find_spec 不会执行 drf_yasg 的导入
+    _drf_yasg_spec = importlib.util.find_spec('drf_yasg')
+    if _drf_yasg_spec and _drf_yasg_spec.submodule_search_locations:
+        STATICFILES_DIRS.append(os.path.join(list(_drf_yasg_spec.submodule_search_locations)[0], 'static'))
+
 STATIC_ROOT = os.path.join(BASE_DIR, "archivebox_data")
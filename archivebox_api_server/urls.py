@@ -2,30 +2,44 @@ import os
 
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 from django.conf import settings
 from django.conf.urls.static import static
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title="ArchiveBox API",
-      default_version='v1',
-      description="API documentation for ArchiveBox",
-      terms_of_service="https://www.google.com/policies/terms/",
-      contact=openapi.Contact(email="contact@yourproject.local"),
-      license=openapi.License(name="BSD License"),
-   ),
-   public=True,
-   permission_classes=[permissions.AllowAny],
-)
+from api.views import static_archive_file
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    # 快照文件可能已打包到冷存储，不能直接由静态文件目录提供
+    path('static/archive/<str:timestamp>/<path:name>', static_archive_file, name='static-archive-file'),
 ]
 
+if settings.OPENAPI_PREBUILT:
+    from archivebox_api_server.docs import openapi_schema, swagger_ui, redoc_ui
+
+    urlpatterns += [
+        path('swagger.json', openapi_schema, name='schema-json'),
+        path('swagger/', swagger_ui, name='schema-swagger-ui'),
+        path('redoc/', redoc_ui, name='schema-redoc'),
+    ]
+else:
+    from rest_framework import permissions
+    from drf_yasg.views import get_schema_view
+
+    from api.schema import apply_schema_annotations
+    from archivebox_api_server.openapi import api_info
+
+    apply_schema_annotations()
+
+    schema_view = get_schema_view(
+       api_info,
+       public=True,
+       permission_classes=[permissions.AllowAny],
+    )
+
+    urlpatterns += [
+        path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+        path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    ]
+
 urlpatterns += static(settings.STATIC_URL, document_root=os.path.join(settings.BASE_DIR, 'archivebox_data/data/archive'))
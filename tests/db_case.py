@@ -0,0 +1,31 @@
+import os
+import tempfile
+import unittest
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """在临时目录中为每个测试类创建独立的 SQLite 测试数据库。
+    使用文件数据库，内存数据库不支持 WAL，也无法在多个线程之间共享"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.old_name = connection.settings_dict['NAME']
+        cls.old_test = dict(connection.settings_dict.get('TEST') or {})
+        connection.settings_dict['TEST']['NAME'] = os.path.join(cls.tmp_dir.name, f"{cls.__name__}.sqlite3")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        connection.creation.destroy_test_db(cls.old_name, verbosity=0)
+        connection.settings_dict['TEST'] = cls.old_test
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
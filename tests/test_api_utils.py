@@ -6,7 +6,8 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
 django.setup()
 
-from api.utils import parse_log
+from api.progress import ArchiveLogParser
+from api.utils import extract_url_paths, parse_log
 
 
 class FormatOutputTest(unittest.TestCase):
@@ -167,3 +168,38 @@ class FormatOutputTest(unittest.TestCase):
         targets = ["https://docs.xray.cool", "https://asedfawecdwsac.caedws"]
         self.assertEqual(parse_log(self.already_exists_targets, targets)['message'],
                          "The requested target already exists. If you want to update it, please add the update parameter.")
+
+    def feed_lines(self, log_text, targets):
+        parser = ArchiveLogParser(targets)
+        events = []
+        for line in log_text.splitlines(keepends=True):
+            events.extend(parser.feed(line))
+        events.extend(parser.close())
+        return events
+
+    def test_stream_parser_mixed_targets(self):
+        targets = ["https://docs.xray.cool", "https://asedfawecdwsac.caedws"]
+        events = self.feed_lines(self.mixed_targets, targets)
+        finished = [event for event in events if event['event'] == 'snapshot_finished']
+        self.assertListEqual(finished, [
+            {'event': 'snapshot_finished', 'url': 'https://docs.xray.cool',
+             'archive_path': './archive/1720075521.41685'},
+            {'event': 'snapshot_finished', 'url': 'https://asedfawecdwsac.caedws',
+             'archive_path': './archive/1720075521.417146'},
+        ])
+        extractors = [(event['url'], event['extractor'], event['status'])
+                      for event in events if event['event'] == 'extractor_finished']
+        self.assertListEqual(extractors, [
+            ('https://docs.xray.cool', 'screenshot', 'succeeded'),
+            ('https://docs.xray.cool', 'title', 'succeeded'),
+            ('https://asedfawecdwsac.caedws', 'screenshot', 'succeeded'),
+            ('https://asedfawecdwsac.caedws', 'title', 'failed'),
+        ])
+
+    def test_stream_parser_already_exists(self):
+        targets = ["https://docs.xray.cool", "https://asedfawecdwsac.caedws"]
+        self.assertListEqual(self.feed_lines(self.already_exists_targets, targets), [])
+
+
+class HistoryEntryTest(unittest.TestCase):
+    pass
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from api.service import initialize_archivebox
+from api.utils import build_add_argv, build_add_args, build_docker_compose_archivebox_argv, \
+    execute_docker_compose_archivebox_command, run_command_async, success_response
+
+
+class BuildCommandTest(unittest.TestCase):
+
+    def test_build_add_argv(self):
+        argv = build_add_argv(["https://example.com"], ["a", "b"], 0, True, False, False, "title", "auto")
+        self.assertListEqual(argv, ["add", "https://example.com", "--tag=a,b", "--depth=0", "--update",
+                                    "--extract=title,headers", "--parser=auto"])
+
+    def test_build_add_args_is_joined_argv(self):
+        self.assertEqual(build_add_args([], None, 1, False, False, True, "", ""), "add --depth=1 --overwrite")
+
+    def test_docker_compose_argv_with_stdin(self):
+        self.assertListEqual(build_docker_compose_archivebox_argv(["add"], stdin=True),
+                             ["docker", "compose", "run", "-T", "--rm", "archivebox", "add"])
+
+    def test_per_url_timeout_is_passed_to_archivebox(self):
+        with mock.patch.dict(os.environ, {'ARCHIVEBOX_PER_URL_TIMEOUT': '90'}):
+            self.assertListEqual(build_docker_compose_archivebox_argv(["add"], env={'PYTHONUNBUFFERED': '1'}),
+                                 ["docker", "compose", "run", "-e", "TIMEOUT=90", "-e", "PYTHONUNBUFFERED=1", "--rm",
+                                  "archivebox", "add"])
+
+            process = mock.Mock(returncode=0, pid=1)
+            process.communicate.return_value = ("", "")
+            with mock.patch('api.utils.subprocess.Popen', return_value=process) as popen:
+                execute_docker_compose_archivebox_command("add", stdin="https://example.com\n")
+            self.assertTrue(popen.call_args.args[0].startswith("docker compose run -T -e TIMEOUT=90 --name "))
+
+        with mock.patch.dict(os.environ, {'ARCHIVEBOX_PER_URL_TIMEOUT': '0'}):
+            self.assertNotIn("-e", build_docker_compose_archivebox_argv(["add"]))
+
+
+class InitializeTest(unittest.TestCase):
+
+    def test_server_is_not_started_when_disabled(self):
+        ok = success_response("ok")
+        with mock.patch.dict(os.environ, {'ARCHIVEBOX_START_SERVER': 'false'}), \
+                mock.patch('api.service.check_docker_version', return_value=ok), \
+                mock.patch('api.service.check_docker_compose', return_value=ok), \
+                mock.patch('api.service.prepare_docker_compose', return_value=ok), \
+                mock.patch('api.service.execute_docker_compose_archivebox_command', return_value=ok), \
+                mock.patch('api.service.subprocess.run') as run:
+            result = initialize_archivebox()
+        self.assertEqual(result['status'], 'success')
+        run.assert_not_called()
+
+
+class RunCommandAsyncTest(unittest.TestCase):
+
+    def test_stdin_is_passed_without_shell(self):
+        returncode, stdout, _ = asyncio.run(run_command_async(["cat"], stdin="https://example.com; echo injected\n"))
+        self.assertEqual(returncode, 0)
+        self.assertEqual(stdout, "https://example.com; echo injected\n")
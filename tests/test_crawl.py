@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+
+from api.crawl import extract_outlinks
+from api.models import Job, JobChunk, Tag, Target
+from api.serializers import AddUrlsSerializer
+from api.service import cancel_job, get_job, schedule_crawl
+from api.utils import process_json_data, save_result, save_tags
+from db_case import DatabaseTestCase
+
+SEED = "https://news.example.com/front"
+PAGE = """
+<html><head><base href="https://news.example.com/articles/"></head><body>
+<a href="one">One</a> <a href="one#comments">One again</a>
+<a href="/two">Two</a> <a href="https://other.example.org/three">Three</a>
+<a href="https://old.example.com/">Archived</a> <a href="mailto:editor@example.com">Mail</a>
+<a href="javascript:void(0)">JS</a> <a href="https://news.example.com/front">Self</a>
+<area href="https://maps.example.com/map"> <a>No href</a>
+</body></html>
+"""
+
+
+class ExtractOutlinksTest(unittest.TestCase):
+
+    def test_links_are_resolved_and_deduplicated(self):
+        self.assertEqual(extract_outlinks(PAGE, SEED), [
+            "https://news.example.com/articles/one",
+            "https://news.example.com/two",
+            "https://other.example.org/three",
+            "https://old.example.com/",
+            "https://maps.example.com/map",
+        ])
+
+    def test_fan_out_requires_depth_one(self):
+        self.assertFalse(AddUrlsSerializer(data={'urls': [SEED], 'fan_out': True}).is_valid())
+        self.assertTrue(AddUrlsSerializer(data={'urls': [SEED], 'fan_out': True, 'depth': 1}).is_valid())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite crawl test")
+class ScheduleCrawlTest(DatabaseTestCase):
+
+    def setUp(self):
+        for model in (Job, Target, Tag):
+            model.objects.all().delete()
+        project = tempfile.TemporaryDirectory()
+        self.addCleanup(project.cleanup)
+        # worker 模式下子任务只写入数据库，不在本进程执行
+        env = mock.patch.dict(os.environ, {'PROJECT_DIR': project.name, 'DEDUP_ON_INGEST': 'false',
+                                           'JOB_EXECUTION_MODE': 'worker', 'CRAWL_LINKS_PER_JOB': '2'})
+        env.start()
+        self.addCleanup(env.stop)
+
+        snapshot_dir = os.path.join(project.name, 'data', 'archive', '1700000000')
+        os.makedirs(snapshot_dir)
+        with open(os.path.join(snapshot_dir, 'output.html'), 'w') as f:
+            f.write(PAGE)
+        index_file = os.path.join(snapshot_dir, 'index.json')
+        with open(index_file, 'w', encoding='utf-8') as f:
+            json.dump({'url': SEED, 'timestamp': '1700000000', 'history': {
+                'dom': [{'start_ts': '2024-07-01T10:00:00+00:00', 'end_ts': '2024-07-01T10:00:03+00:00',
+                         'status': 'succeeded', 'output': 'output.html'}],
+            }}, f)
+        save_result(process_json_data(index_file))
+        save_tags(SEED, ['news', 'daily'])
+        save_result({'url': "https://old.example.com/", 'timestamp': '1600000000', 'history': {}})
+
+    def test_links_are_scheduled_as_child_jobs(self):
+        crawl = schedule_crawl([SEED], 'title,dom')
+
+        self.assertEqual(crawl['links'], 4)
+        self.assertEqual(crawl['jobs'], 2)
+        self.assertEqual(crawl['seeds'][0]['existing'], 1)
+        parent = Job.objects.get(kind='crawl')
+        self.assertEqual((parent.total, parent.status), (4, 'running'))
+        children = list(Job.objects.filter(parent_id=parent).order_by('created_at'))
+        self.assertEqual({child.kind for child in children}, {'crawl_links'})
+        self.assertEqual(children[0].params['tags'], ['daily', 'news'])
+        self.assertEqual(children[0].params['extractors'], 'title,dom')
+        urls = [url for chunk in JobChunk.objects.filter(job_id__parent_id=parent) for url in chunk.urls.split("\n")]
+        self.assertEqual(sorted(urls), sorted(["https://news.example.com/articles/one", "https://news.example.com/two",
+                                               "https://other.example.org/three", "https://maps.example.com/map"]))
+
+    def test_progress_is_aggregated_from_child_jobs(self):
+        schedule_crawl([SEED], '')
+        parent = Job.objects.get(kind='crawl')
+        first, second = Job.objects.filter(parent_id=parent).order_by('created_at')
+
+        Job.objects.filter(id=first.id).update(status='succeeded', processed=2)
+        job = get_job(parent.id)['job']
+        self.assertEqual((job['status'], job['processed']), ('running', 2))
+
+        JobChunk.objects.filter(job_id=second).update(status='failed', failed=2)
+        Job.objects.filter(id=second.id).update(status='failed', processed=2, failed=2)
+        job = get_job(parent.id)['job']
+        self.assertEqual((job['status'], job['processed'], job['failed']), ('partial_success', 4, 2))
+        self.assertEqual(job['result']['succeeded'], 2)
+        self.assertEqual(len(job['result']['failed_urls']), 2)
+
+    def test_cancel_cascades_to_child_jobs(self):
+        schedule_crawl([SEED], '')
+        parent = Job.objects.get(kind='crawl')
+        with mock.patch('api.service.kill_job_processes', return_value=0), \
+                mock.patch('api.service.remove_job_containers', return_value=0):
+            self.assertEqual(cancel_job(parent.id)['status'], 'success')
+        self.assertEqual(set(Job.objects.filter(parent_id=parent).values_list('status', flat=True)), {'cancelled'})
+        self.assertFalse(JobChunk.objects.filter(job_id__parent_id=parent, status='pending').exists())
+
+    def test_seed_without_html_schedules_nothing(self):
+        crawl = schedule_crawl(["https://old.example.com/"], '')
+        self.assertEqual((crawl['links'], crawl['jobs']), (0, 0))
+        self.assertEqual(crawl['seeds'][0]['status'], 'no_html')
+        self.assertEqual(Job.objects.get(kind='crawl').status, 'succeeded')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection, connections, OperationalError
+from django.utils import timezone
+
+from api.models import Result, ResultSummary, Tagging, Target
+from api.service import filter_targets
+from api.utils import save_result, save_tags
+from db_case import DatabaseTestCase
+
+WORKERS = int(os.getenv('CONCURRENCY_TEST_WORKERS', '8'))
+OPERATIONS_PER_WORKER = int(os.getenv('CONCURRENCY_TEST_OPERATIONS', '25'))
+MIN_THROUGHPUT = float(os.getenv('CONCURRENCY_TEST_MIN_THROUGHPUT', '20'))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite concurrency test")
+class SqliteConcurrencyTest(DatabaseTestCase):
+
+    def test_wal_enabled(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode;")
+            self.assertEqual(cursor.fetchone()[0].lower(), 'wal')
+
+    def test_parallel_ingest_and_list(self):
+        errors = []
+        lock = threading.Lock()
+
+        def ingest(worker: int):
+            try:
+                for i in range(OPERATIONS_PER_WORKER):
+                    url = f"https://example{worker}.com/{i}"
+                    now = timezone.now()
+                    save_result({
+                        'url': url,
+                        'timestamp': time.time(),
+                        'history': {
+                            'title': {'start_ts': now, 'end_ts': now, 'status': True, 'output': 'title.txt'},
+                            'headers': {'start_ts': now, 'end_ts': now, 'status': True, 'output': 'headers.json'},
+                        }
+                    })
+                    save_tags(url, [f"worker-{worker}"])
+            except OperationalError as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                connections.close_all()
+
+        def list_targets(worker: int):
+            try:
+                for _ in range(OPERATIONS_PER_WORKER):
+                    result = filter_targets({'domains': [f"example{worker}.com"]})
+                    if result["status"] != "success":
+                        with lock:
+                            errors.append(result.get("error"))
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=WORKERS * 2) as executor:
+            futures = [executor.submit(ingest, worker) for worker in range(WORKERS)]
+            futures += [executor.submit(list_targets, worker) for worker in range(WORKERS)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        self.assertListEqual(errors, [])
+        throughput = WORKERS * OPERATIONS_PER_WORKER * 2 / elapsed
+        self.assertGreaterEqual(throughput, MIN_THROUGHPUT)
+
+    def test_concurrent_saves_of_same_url_create_one_target(self):
+        url = "https://same.example.com/"
+        now = timezone.now()
+        data = {'url': url, 'timestamp': 1700000000.0, 'history': {
+            'title': {'start_ts': now, 'end_ts': now, 'status': True, 'output': 'title.txt'},
+            'headers': {'start_ts': now, 'end_ts': now, 'status': True, 'output': 'headers.json'},
+        }}
+        barrier = threading.Barrier(WORKERS)
+
+        def ingest(_):
+            try:
+                barrier.wait()
+                save_result(data)
+                save_tags(url, ['same'])
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            list(executor.map(ingest, range(WORKERS)))
+
+        target = Target.objects.get(url=url)
+        self.assertEqual(Result.objects.filter(target_id=target).count(), 2)
+        self.assertEqual(Tagging.objects.filter(target_id=target).count(), 1)
+        # 汇总只由创建记录的一方计入一次
+        self.assertEqual(ResultSummary.objects.get(scope='extractor', key='title').total, 1)
+        self.assertEqual(filter_targets({'domains': ['same.example.com']})['status'], 'success')
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+from django.utils import timezone
+
+from api.dedup import dedup_pending, detach_before_add, detach_file, file_sha256, queue_dedup, replace_with_link
+from api.models import ArchiveFile, Result, Target
+from api.service import add_url
+from api.utils import save_result, success_response
+from db_case import DatabaseTestCase
+
+OLD = time.time() - 86400
+
+
+class HardlinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, 'source.ico')
+        self.target = os.path.join(self.tmp_dir.name, 'target.ico')
+        for path in (self.source, self.target):
+            with open(path, 'wb') as f:
+                f.write(b'favicon' * 100)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_file_sha256(self):
+        self.assertEqual(file_sha256(self.source), hashlib.sha256(b'favicon' * 100).hexdigest())
+
+    def test_replace_with_link(self):
+        self.assertTrue(replace_with_link(self.source, self.target, os.stat(self.target)))
+        self.assertEqual(os.stat(self.source).st_ino, os.stat(self.target).st_ino)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['source.ico', 'target.ico'])
+
+    def test_skip_file_changed_after_hashing(self):
+        expected = os.stat(self.target)
+        with open(self.target, 'ab') as f:
+            f.write(b'more')
+        self.assertFalse(replace_with_link(self.source, self.target, expected))
+        self.assertNotEqual(os.stat(self.source).st_ino, os.stat(self.target).st_ino)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['source.ico', 'target.ico'])
+
+    def test_detach_file(self):
+        replace_with_link(self.source, self.target, os.stat(self.target))
+        detach_file(self.target)
+        self.assertNotEqual(os.stat(self.source).st_ino, os.stat(self.target).st_ino)
+        self.assertEqual(os.stat(self.source).st_nlink, 1)
+        self.assertEqual(file_sha256(self.source), file_sha256(self.target))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite dedup test")
+class IngestDedupTest(DatabaseTestCase):
+
+    def setUp(self):
+        for model in (Target, ArchiveFile):
+            model.objects.all().delete()
+        project = tempfile.TemporaryDirectory()
+        self.addCleanup(project.cleanup)
+        for patcher in (mock.patch.dict(os.environ, {'PROJECT_DIR': project.name, 'DEDUP_MIN_AGE': '300',
+                                                     'EXTRACTOR_PLANNER_ENABLED': 'false',
+                                                     'EXTRACTOR_LANES_ENABLED': 'false'}),
+                        mock.patch.dict('api.dedup._pending', clear=True),
+                        mock.patch('api.jobs.start_periodic_task')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.snapshot_dirs = []
+        for timestamp in ('1700000000', '1700000001'):
+            snapshot_dir = os.path.join(project.name, 'data', 'archive', timestamp)
+            os.makedirs(snapshot_dir)
+            path = os.path.join(snapshot_dir, 'favicon.ico')
+            with open(path, 'wb') as f:
+                f.write(b'favicon' * 100)
+            os.utime(path, (OLD, OLD))
+            self.snapshot_dirs.append(snapshot_dir)
+            save_result({'url': f"https://example.com/{timestamp}", 'timestamp': timestamp, 'history': {}})
+
+    def inodes(self):
+        return [os.stat(os.path.join(snapshot_dir, 'favicon.ico')).st_ino for snapshot_dir in self.snapshot_dirs]
+
+    def test_ingested_snapshots_are_deduplicated_after_min_age(self):
+        for snapshot_dir in self.snapshot_dirs:
+            queue_dedup(snapshot_dir)
+        self.assertEqual(dedup_pending()['snapshots'], 0)
+
+        stats = dedup_pending(now=time.time() + 301)
+        self.assertEqual((stats['snapshots'], stats['linked']), (2, 1))
+        self.assertEqual(len(set(self.inodes())), 1)
+        self.assertEqual(dedup_pending(now=time.time() + 600)['snapshots'], 0)
+
+    def test_update_detaches_links_before_archiving(self):
+        for snapshot_dir in self.snapshot_dirs:
+            queue_dedup(snapshot_dir)
+        dedup_pending(now=time.time() + 301)
+        inodes = []
+
+        def run_add_command(urls, *args, **kwargs):
+            inodes.append(self.inodes())
+            return success_response("ok", archive_paths={})
+
+        with mock.patch('api.service.run_add_command', run_add_command):
+            add_url(["https://example.com/1700000001"], [], 0, True, False, False, 'favicon', 'auto')
+        self.assertEqual(len(set(inodes[0])), 2)
+
+    def test_update_all_detaches_only_snapshots_with_failed_results(self):
+        for snapshot_dir in self.snapshot_dirs:
+            queue_dedup(snapshot_dir)
+        dedup_pending(now=time.time() + 301)
+
+        self.assertEqual(detach_before_add(["https://example.com/new"], False, True, False), 0)
+        self.assertEqual(len(set(self.inodes())), 1)
+
+        now = timezone.now()
+        Result.objects.create(target_id=Target.objects.get(url="https://example.com/1700000001"), extractor='pdf',
+                              timestamp=1700000001, start_ts=now, end_ts=now, status=False, output='error')
+        self.assertEqual(detach_before_add(["https://example.com/new"], False, True, False), 1)
+        self.assertEqual(len(set(self.inodes())), 2)
+
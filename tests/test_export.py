@@ -0,0 +1,136 @@
+import asyncio
+import gzip
+import json
+import os
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+
+from api.export import build_export_queryset, iter_csv, iter_gzip, iter_ndjson, iter_plain
+from api.models import Result, Tag, Tagging, Target
+from api.serializers import ExportSerializer
+from db_case import DatabaseTestCase
+
+T0 = datetime(2024, 7, 1, 8, 0, 0, 123456, tzinfo=timezone.utc)
+
+
+class ExportFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [
+            (uuid.UUID(int=1), 'https://example.com/', 'example.com', 1720073769.137125,
+             datetime(2024, 7, 4, 6, 16, 9, 123456, tzinfo=timezone.utc),
+             datetime(2024, 7, 4, 6, 16, 9, 123456, tzinfo=timezone.utc)),
+        ]
+
+    def test_ndjson_keeps_microseconds(self):
+        lines = list(iter_ndjson('targets', iter(self.rows)))
+        self.assertEqual(len(lines), 1)
+        self.assertIn('"updated_at": "2024-07-04T06:16:09.123456+00:00"', lines[0])
+        self.assertIn('"id": "00000000-0000-0000-0000-000000000001"', lines[0])
+
+    def test_csv_has_header(self):
+        lines = list(iter_csv('targets', iter(self.rows)))
+        self.assertEqual(lines[0], "id,url,domain,timestamp,created_at,updated_at\r\n")
+        self.assertTrue(lines[1].startswith("00000000-0000-0000-0000-000000000001,https://example.com/"))
+
+    def test_gzip_round_trip(self):
+        lines = ["line %d\n" % i for i in range(10000)]
+        compressed = b"".join(iter_gzip(iter(lines), flush_size=1024))
+        self.assertEqual(gzip.decompress(compressed).decode('utf-8'), "".join(lines))
+        self.assertEqual(b"".join(iter_plain(iter(lines), flush_size=1024)).decode('utf-8'), "".join(lines))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite export test")
+class ExportQuerysetTest(DatabaseTestCase):
+
+    def setUp(self):
+        Target.objects.all().delete()
+        Tag.objects.all().delete()
+        news = Tag.objects.create(name='news')
+        for index, domain in enumerate(['a.example.com', 'a.example.com', 'b.example.com']):
+            target = Target.objects.create(url=f"https://{domain}/{index}", domain=domain, timestamp=index)
+            if domain == 'a.example.com':
+                Tagging.objects.create(tag_id=news, target_id=target)
+            for extractor in ('title', 'pdf'):
+                Result.objects.create(target_id=target, extractor=extractor, timestamp=index, start_ts=T0,
+                                      end_ts=T0, status=True, output=f"/static/archive/{index}/{extractor}")
+        # 前两个目标的结果在同一时刻更新，用于检查边界
+        Result.objects.filter(target_id__timestamp__lt=2).update(updated_at=T0)
+        Result.objects.filter(target_id__timestamp=2).update(updated_at=T0 + timedelta(seconds=1))
+
+    def rows(self, entity, data, since=None, since_id=None):
+        return list(build_export_queryset(entity, data, since, since_id))
+
+    def test_filters(self):
+        rows = self.rows('results', {'domains': ['a.example.com'], 'extractors': ['pdf']})
+        self.assertEqual(sorted((row[2], row[3]) for row in rows),
+                         [("https://a.example.com/0", 'pdf'), ("https://a.example.com/1", 'pdf')])
+        tags = self.rows('tags', {'tag_names': ['news']})
+        self.assertEqual(sorted(row[2] for row in tags), ["https://a.example.com/0", "https://a.example.com/1"])
+        targets = self.rows('targets', {'urls': ["https://b.example.com/2"]})
+        self.assertEqual([row[1] for row in targets], ["https://b.example.com/2"])
+        self.assertEqual(len(self.rows('results', {})), 6)
+
+    def test_tag_query_alone_filters_every_entity(self):
+        data = {'tag_query': 'news'}
+        self.assertEqual(len(self.rows('targets', data)), 2)
+        self.assertEqual({row[2] for row in self.rows('results', data)},
+                         {"https://a.example.com/0", "https://a.example.com/1"})
+        self.assertEqual(len(self.rows('results', data)), 4)
+        self.assertEqual(len(self.rows('tags', {'tag_query': 'NOT news'})), 0)
+
+    def test_since_excludes_boundary(self):
+        rows = self.rows('results', {}, since=T0)
+        self.assertEqual({row[2] for row in rows}, {"https://b.example.com/2"})
+
+    def test_cursor_pages_without_duplicates(self):
+        exported = []
+        since = since_id = None
+        # 每次只取两条，模拟下游按最后一条记录的 (updated_at, id) 继续导出
+        while True:
+            page = self.rows('results', {}, since, since_id)[:2]
+            if not page:
+                break
+            exported.extend(row[0] for row in page)
+            since, since_id = page[-1][-1], page[-1][0]
+        self.assertEqual(len(exported), 6)
+        self.assertEqual(set(exported), set(Result.objects.values_list('id', flat=True)))
+
+    def test_since_id_requires_since(self):
+        self.assertFalse(ExportSerializer(data={'since_id': str(uuid.uuid4())}).is_valid())
+
+    def test_export_view(self):
+        first = self.rows('results', {})[1]
+        response = Client(HTTP_HOST='localhost').post('/api/export', {
+            'entity': 'results', 'compress': False, 'since': first[-1].isoformat(), 'since_id': str(first[0]),
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertNotIn(str(first[0]), [json.loads(line)['id'] for line in lines])
+
+    def test_export_view_streams_asynchronously_under_asgi(self):
+        async def export():
+            response = await AsyncClient().post(
+                '/api/export', {'entity': 'results', 'compress': False}, content_type='application/json')
+            return response, [chunk async for chunk in response.streaming_content]
+
+        # AsyncClient 固定使用 testserver 作为 Host
+        with override_settings(ALLOWED_HOSTS=['testserver']), \
+                mock.patch('api.export.iter_plain', lambda lines: (line.encode('utf-8') for line in lines)):
+            response, chunks = asyncio.run(export())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        # 每行单独成块，说明响应是逐块读取的
+        self.assertEqual(len(chunks), 6)
+        self.assertEqual(len(b"".join(chunks).decode('utf-8').splitlines()), 6)
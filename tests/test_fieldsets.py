@@ -0,0 +1,63 @@
+import os
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from api import compression
+from api.fieldsets import FieldSet, build_targets
+
+
+class FieldSetTest(unittest.TestCase):
+
+    def test_default_fields(self):
+        fieldset = FieldSet.parse(None)
+        self.assertEqual(fieldset.target, ['url', 'domain', 'tags'])
+        self.assertEqual(fieldset.result, ['timestamp', 'status', 'output', 'extractor'])
+
+    def test_sparse_fields(self):
+        fieldset = FieldSet.parse('url, results.extractor,results.status')
+        self.assertEqual(fieldset.target_columns, ['id', 'url'])
+        self.assertEqual(fieldset.result_columns, ['target_id', 'status', 'timestamp', 'extractor'])
+
+    def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            FieldSet.parse('url,results.size')
+        with self.assertRaises(ValueError):
+            FieldSet.parse(',')
+
+    def test_build_targets(self):
+        fieldset = FieldSet.parse('url,tags,results.extractor,results.output')
+        items = build_targets(
+            [(1, 'https://example.com')],
+            [(1, False, 3.0, 'pdf', 'output.pdf'), (1, True, 1.0, 'wget', 'example.com/'),
+             (1, True, 2.0, 'title', 'Example')],
+            [(1, 'news')],
+            fieldset)
+        self.assertEqual(items, [{
+            'url': 'https://example.com',
+            'results': [{'output': 'Example', 'extractor': 'title'},
+                        {'output': 'example.com/', 'extractor': 'wget'},
+                        {'extractor': 'pdf'}],
+            'tags': ['news'],
+        }])
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_choose_encoding(self):
+        with mock.patch.object(compression, 'brotli', object()):
+            self.assertEqual(compression.choose_encoding('gzip, deflate, br'), 'br')
+            self.assertEqual(compression.choose_encoding('gzip;q=1.0, br;q=0.5'), 'gzip')
+            self.assertEqual(compression.choose_encoding('*'), 'br')
+        with mock.patch.object(compression, 'brotli', None):
+            self.assertEqual(compression.choose_encoding('br, gzip'), 'gzip')
+            self.assertIsNone(compression.choose_encoding('br'))
+        self.assertIsNone(compression.choose_encoding('gzip;q=0, identity'))
+
+
+if __name__ == '__main__':
+    unittest.main()
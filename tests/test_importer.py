@@ -0,0 +1,36 @@
+import os
+import unittest
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from api.importer import iter_upload_urls, normalize_url
+
+
+class ImportParserTest(unittest.TestCase):
+
+    def test_normalize_url(self):
+        self.assertEqual(normalize_url("  HTTPS://Example.COM/Path?q=1 \n"), "https://example.com/Path?q=1")
+        self.assertIsNone(normalize_url("not a url"))
+        self.assertIsNone(normalize_url("ftp://example.com/file"))
+        self.assertIsNone(normalize_url(""))
+
+    def test_txt_skips_comments_and_blank_lines(self):
+        lines = [b"# exported links\n", b"\n", b"https://example.com\n", b"https://example.org\r\n"]
+        self.assertListEqual(list(iter_upload_urls(lines, 'txt')), ["https://example.com", "https://example.org"])
+
+    def test_jsonl(self):
+        lines = [b'{"url": "https://example.com"}\n', b'"https://example.org"\n', b'{broken\n']
+        self.assertListEqual(list(iter_upload_urls(lines, 'jsonl')), ["https://example.com", "https://example.org", ""])
+
+    def test_netscape_html(self):
+        lines = [
+            b'<!DOCTYPE NETSCAPE-Bookmark-file-1>\n',
+            b'<DT><A HREF="https://example.com/" ADD_DATE="1720073769">Example</A>\n',
+            b'<DT><a href="https://example.org/">Other</a>\n',
+            b'<DT><A HREF="https://example.net/a.php?x=1&amp;y=2">Escaped</A>\n',
+        ]
+        self.assertListEqual(list(iter_upload_urls(lines, 'netscape_html')),
+                             ["https://example.com/", "https://example.org/", "https://example.net/a.php?x=1&y=2"])
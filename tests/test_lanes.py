@@ -0,0 +1,202 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import django
+import yaml
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+
+from api.async_service import add_url_async
+from api.jobs import create_job, create_job_chunks
+from api.lanes import get_heavy_lane_workers, get_heavy_service, heavy_service_config, parse_memory, split_lanes
+from api.models import Job, JobChunk, WebhookEvent
+from api.processes import archivebox_service
+from api.service import add_url, cancel_job, execute_add_chunk
+from api.utils import build_docker_compose_archivebox_argv, error_response, success_response
+from api.workers import LANE_JOB_KINDS, claim_chunk, finalize_job
+from db_case import DatabaseTestCase
+
+GiB = 1024 ** 3
+
+
+class LaneSettingsTest(unittest.TestCase):
+
+    def test_split_lanes(self):
+        with mock.patch.dict(os.environ, {'LANE_FAST_EXTRACTORS': 'title,favicon,headers'}):
+            self.assertEqual(split_lanes('title,pdf,screenshot'), ('title,headers', 'pdf,screenshot'))
+            self.assertEqual(split_lanes('headers,media'), ('headers', 'media'))
+            # 只有一个通道时不拆分
+            self.assertEqual(split_lanes('pdf'), ('', ''))
+            self.assertEqual(split_lanes('title,favicon'), ('', ''))
+            fast, heavy = split_lanes('')
+            self.assertEqual(fast, 'title,favicon,headers')
+            self.assertIn('singlefile', heavy.split(','))
+
+    def test_heavy_workers_are_bounded_by_memory(self):
+        with mock.patch.dict(os.environ, {'HEAVY_LANE_WORKERS': '0', 'HEAVY_LANE_MEMORY_LIMIT': '2g'}), \
+                mock.patch('os.cpu_count', return_value=16):
+            with mock.patch('api.lanes.total_memory', return_value=8 * GiB):
+                self.assertEqual(get_heavy_lane_workers(), 2)
+            with mock.patch('api.lanes.total_memory', return_value=64 * GiB):
+                self.assertEqual(get_heavy_lane_workers(), 8)
+            with mock.patch('api.lanes.total_memory', return_value=GiB):
+                self.assertEqual(get_heavy_lane_workers(), 1)
+        with mock.patch.dict(os.environ, {'HEAVY_LANE_WORKERS': '3'}):
+            self.assertEqual(get_heavy_lane_workers(), 3)
+
+    def test_memory_limited_service(self):
+        self.assertEqual(parse_memory('512m'), 512 * 1024 ** 2)
+        self.assertEqual(parse_memory('1.5g'), int(1.5 * GiB))
+        self.assertIsNone(parse_memory('lots'))
+        service = {'image': 'archivebox/archivebox', 'ports': ['8000:8000'], 'volumes': ['./data:/data']}
+        heavy = heavy_service_config(service, '2g')
+        self.assertEqual((heavy['mem_limit'], heavy['memswap_limit']), ('2g', '2g'))
+        self.assertNotIn('ports', heavy)
+        self.assertEqual(service['ports'], ['8000:8000'])
+
+    def test_commands_use_lane_service(self):
+        self.assertEqual(build_docker_compose_archivebox_argv(['add'])[-2], 'archivebox')
+        token = archivebox_service.set('archivebox_heavy')
+        try:
+            self.assertEqual(build_docker_compose_archivebox_argv(['add'])[-2], 'archivebox_heavy')
+        finally:
+            archivebox_service.reset(token)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite lanes test")
+class LaneDispatchTest(DatabaseTestCase):
+
+    def setUp(self):
+        Job.objects.all().delete()
+        WebhookEvent.objects.all().delete()
+        env = mock.patch.dict(os.environ, {'JOB_EXECUTION_MODE': 'worker', 'EXTRACTOR_LANES_ENABLED': 'true',
+                                           'EXTRACTOR_PLANNER_ENABLED': 'false', 'HEAVY_LANE_CHUNK_SIZE': '2',
+                                           'HEAVY_LANE_MEMORY_LIMIT': '2g', 'PROJECT_DIR': ''})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def test_fast_lane_returns_before_heavy_extractors(self):
+        urls = [f"https://example.com/{i}" for i in range(4)]
+        calls = []
+
+        def run_add_command(urls, tags, depth, update, update_all, overwrite, extractors, parser, stdin_urls=False):
+            calls.append(extractors)
+            return success_response("ok", archive_paths={url: {} for url in urls[:3]}, failed_urls=urls[3:])
+
+        with mock.patch('api.service.run_add_command', run_add_command):
+            result = add_url(urls, ['news'], 0, False, False, False, 'title,headers,pdf,screenshot', 'auto')
+
+        self.assertEqual(calls, ['title,headers'])
+        self.assertEqual(result['lanes']['heavy'], 'pdf,screenshot')
+        job = Job.objects.get(id=result['lanes']['heavy_job'])
+        self.assertEqual((job.kind, job.total, job.status), ('heavy', 3, 'pending'))
+        self.assertEqual(job.params['lane'], 'heavy')
+        self.assertTrue(job.params['update'])
+        chunks = list(JobChunk.objects.filter(job_id=job).order_by('index').values_list('urls', flat=True))
+        self.assertEqual(chunks, ["\n".join(urls[:2]), urls[2]])
+
+    def write_compose(self, services):
+        project = tempfile.TemporaryDirectory()
+        self.addCleanup(project.cleanup)
+        with open(os.path.join(project.name, 'docker-compose.yml'), 'w') as f:
+            yaml.safe_dump({'services': {name: {'image': 'archivebox/archivebox'} for name in services}}, f)
+        return project.name
+
+    def test_heavy_chunks_run_in_memory_limited_service(self):
+        os.environ['PROJECT_DIR'] = self.write_compose(['archivebox', 'archivebox_heavy'])
+        services = []
+
+        def fake_add_url(*args, **kwargs):
+            services.append((archivebox_service.get(), kwargs['lanes']))
+            return success_response("ok", archive_paths={})
+
+        params = {'tags': [], 'update': True, 'overwrite': False, 'extractors': 'pdf', 'lane': 'heavy'}
+        with mock.patch('api.service.add_url', fake_add_url):
+            execute_add_chunk(params, ["https://example.com/"])
+            execute_add_chunk(dict(params, lane=None), ["https://example.com/"])
+        self.assertEqual(services, [('archivebox_heavy', False), ('archivebox', False)])
+        self.assertEqual(archivebox_service.get(), 'archivebox')
+
+    def test_missing_heavy_service_falls_back(self):
+        # 初始化之后才设置 HEAVY_LANE_MEMORY_LIMIT，docker-compose.yml 中没有 archivebox_heavy
+        os.environ['PROJECT_DIR'] = self.write_compose(['archivebox'])
+        with mock.patch('api.lanes._missing_service_warned', False), self.assertLogs('api.lanes', 'WARNING'):
+            self.assertEqual(get_heavy_service(), 'archivebox')
+        os.environ['HEAVY_LANE_MEMORY_LIMIT'] = ''
+        self.assertEqual(get_heavy_service(), 'archivebox')
+
+    def test_callback_is_notified_once_after_heavy_lane(self):
+        urls = [f"https://example.com/{i}" for i in range(3)]
+        callback = "https://93.184.216.34/hook"
+
+        def run_add_command(urls, *args, **kwargs):
+            return success_response("ok", archive_paths={url: {} for url in urls[:-1]}, failed_urls=urls[-1:])
+
+        with mock.patch('api.service.run_add_command', run_add_command):
+            result = add_url(urls, [], 0, False, False, False, 'title,headers,pdf', 'auto', callback_url=callback)
+            # 快速通道结束时不发送通知
+            self.assertFalse(WebhookEvent.objects.exists())
+            job = Job.objects.get(id=result['lanes']['heavy_job'])
+            for chunk in JobChunk.objects.filter(job_id=job):
+                fields = execute_add_chunk(job.params, chunk.urls.split("\n"))
+                JobChunk.objects.filter(id=chunk.id).update(**fields)
+                self.assertFalse(WebhookEvent.objects.exists())
+        self.assertEqual(finalize_job(job.id), 'succeeded')
+        self.assertIsNone(finalize_job(job.id))
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.url, event.event), (callback, 'batch.completed'))
+        self.assertEqual(event.payload['urls'], urls)
+        self.assertEqual(event.payload['failed_urls'], urls[2:])
+        self.assertEqual(event.payload['lanes']['heavy_status'], 'succeeded')
+        self.assertEqual(event.payload['lanes']['heavy_failed_urls'], [urls[1]])
+
+    def test_callback_is_notified_when_heavy_lane_is_cancelled(self):
+        def run_add_command(urls, *args, **kwargs):
+            return success_response("ok", archive_paths={url: {} for url in urls})
+
+        with mock.patch('api.service.run_add_command', run_add_command):
+            result = add_url(["https://example.com/"], [], 0, False, False, False, 'title,pdf', 'auto',
+                             callback_url="https://93.184.216.34/hook")
+        with mock.patch('api.service.kill_job_processes', return_value=0), \
+                mock.patch('api.service.remove_job_containers', return_value=0):
+            cancel_job(result['lanes']['heavy_job'])
+            cancel_job(result['lanes']['heavy_job'])
+        self.assertEqual(WebhookEvent.objects.get().payload['lanes']['heavy_status'], 'cancelled')
+
+    def test_async_fast_lane_uses_worker_slots(self):
+        slots = mock.Mock()
+
+        async def execute(*args, **kwargs):
+            # 命令在持有快速通道的名额时执行
+            slots.acquire.assert_called_once_with()
+            slots.release.assert_not_called()
+            return error_response("Command failed.")
+
+        with mock.patch('api.async_service.fast_lane_slots', return_value=slots), \
+                mock.patch('api.async_service.execute_docker_compose_archivebox_command_async', execute), \
+                mock.patch('api.async_service.rehydrate_before_add'), \
+                mock.patch('api.async_service.detach_before_add'):
+            result = asyncio.run(add_url_async(["https://example.com/"], [], 0, False, False, False, 'title,pdf',
+                                               'auto'))
+        self.assertEqual(result['status'], 'error')
+        slots.release.assert_called_once_with()
+
+    def test_workers_claim_only_their_lane(self):
+        for kind in ('import', 'heavy'):
+            job = create_job(kind, params={}, total=1)
+            create_job_chunks(job, [f"https://example.com/{kind}"], 1)
+        chunk = claim_chunk('heavy-node', kinds=LANE_JOB_KINDS['heavy'])
+        self.assertEqual(chunk.job_id.kind, 'heavy')
+        self.assertIsNone(claim_chunk('heavy-node', kinds=LANE_JOB_KINDS['heavy']))
+        self.assertEqual(claim_chunk('fast-node', kinds=LANE_JOB_KINDS['fast']).job_id.kind, 'import')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import unittest
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from api.loadtest import SimulatedArchiveBox, parse_mix, percentile, summarize_samples
+from api.utils import parse_log
+
+
+class LoadTestHelpersTest(unittest.TestCase):
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('add=1, list=8,sync'), {'add': 1, 'list': 8, 'sync': 1})
+        for text in ('export=1', 'add=x', 'add=0,list=0'):
+            with self.assertRaises(ValueError):
+                parse_mix(text)
+
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+        self.assertAlmostEqual(percentile(values, 0.5), 50.5)
+        self.assertAlmostEqual(percentile(values, 0.99), 99.01)
+        self.assertEqual(percentile([7.0], 0.95), 7.0)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_summarize_samples(self):
+        samples = [{'ms': 10.0, 'status': 200, 'queries': 3}, {'ms': 30.0, 'status': 500, 'queries': 5}]
+        summary = summarize_samples(samples, 2.0)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['throughput_rps'], 1.0)
+        self.assertEqual(summary['latency_ms']['p50'], 20.0)
+        self.assertEqual(summary['status_codes'], {'200': 1, '500': 1})
+
+
+class SimulatedArchiveBoxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.simulator = SimulatedArchiveBox(self.tmp_dir.name, latency=0, per_url_latency=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_log_matches_archivebox_format(self):
+        urls = ['https://example.com/a', 'https://example.com/b']
+        result = self.simulator.execute('add --depth=0 --tag=news', stdin="\n".join(urls) + "\n")
+        parsed = parse_log(result['stdout'], urls)
+        self.assertEqual(parsed['status'], 'success')
+        for item in parsed['data']:
+            index_file = os.path.join(self.tmp_dir.name, item['archive_path'], 'index.json')
+            with open(index_file, encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['url'], item['url'])
+
+    def test_existing_url_is_skipped_without_update(self):
+        self.simulator.execute('add https://example.com/a')
+        result = self.simulator.execute('add https://example.com/a')
+        self.assertEqual(parse_log(result['stdout'], ['https://example.com/a'])['status'], 'error')
+        result = self.simulator.execute('add --update https://example.com/a')
+        self.assertEqual(parse_log(result['stdout'], ['https://example.com/a'])['status'], 'success')
+
+
+if __name__ == '__main__':
+    unittest.main()
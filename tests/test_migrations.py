@@ -0,0 +1,78 @@
+import os
+import unittest
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.utils import timezone
+
+from db_case import DatabaseTestCase
+
+BEFORE_MERGE = [('api', '0013_job_parent')]
+AFTER_MERGE = [('api', '0015_unique_targets')]
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite migration test")
+class MergeDuplicateTargetsTest(DatabaseTestCase):
+    """0014 合并重复记录后 0015 才能添加唯一约束"""
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes('api')
+        self.addCleanup(self.migrate, latest)
+        self.migrate(BEFORE_MERGE)
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_duplicates_are_merged_before_unique_constraints(self):
+        apps = MigrationExecutor(connection).loader.project_state(BEFORE_MERGE).apps
+        Tag = apps.get_model('api', 'Tag')
+        Target = apps.get_model('api', 'Target')
+        Result = apps.get_model('api', 'Result')
+        Tagging = apps.get_model('api', 'Tagging')
+        for model in (Tagging, Result, Target, Tag):
+            model.objects.all().delete()
+
+        now = timezone.now()
+        url = "https://example.com/"
+        first = Target.objects.create(url=url, domain='example.com', timestamp=1.0)
+        second = Target.objects.create(url=url, domain='example.com', timestamp=2.0)
+        Target.objects.filter(id=second.id).update(created_at=now + timedelta(seconds=1))
+        news, news_copy = Tag.objects.create(name='news'), Tag.objects.create(name='news')
+        Tag.objects.filter(id=news_copy.id).update(created_at=now + timedelta(seconds=1))
+        Tagging.objects.create(tag_id=news, target_id=first)
+        Tagging.objects.create(tag_id=news_copy, target_id=second)
+        for target, output in ((first, 'old'), (second, 'new')):
+            Result.objects.create(target_id=target, extractor='title', timestamp=1.0, start_ts=now, end_ts=now,
+                                  status=True, output=output)
+        Result.objects.filter(output='new').update(updated_at=now + timedelta(seconds=1))
+        Result.objects.create(target_id=second, extractor='pdf', timestamp=2.0, start_ts=now, end_ts=now,
+                              status=True, output='output.pdf')
+
+        apps = self.migrate(AFTER_MERGE)
+        Tag = apps.get_model('api', 'Tag')
+        Target = apps.get_model('api', 'Target')
+        Result = apps.get_model('api', 'Result')
+        Tagging = apps.get_model('api', 'Tagging')
+
+        # 保留最早创建的目标和标签，时间戳取最新的快照
+        target = Target.objects.get(url=url)
+        self.assertEqual((target.id, target.timestamp), (first.id, 2.0))
+        self.assertEqual(list(Tag.objects.values_list('id', flat=True)), [news.id])
+        self.assertEqual(list(Tagging.objects.values_list('tag_id', 'target_id')), [(news.id, first.id)])
+        # 同一快照的同一提取器保留最后更新的结果
+        self.assertEqual(sorted(Result.objects.filter(target_id=target).values_list('extractor', 'output')),
+                         [('pdf', 'output.pdf'), ('title', 'new')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from api.async_service import add_url_async
+
+from api.models import Job, JobChunk, ResultSummary
+from api.planner import decide, plan_extractors
+from api.service import add_url
+from api.stats import DURATION_BUCKETS, domain_extractor_key, duration_bucket
+from api.utils import success_response
+from db_case import DatabaseTestCase
+
+SETTINGS = {'min_samples': 10, 'drop_success_rate': 0.05, 'defer_success_rate': 0.3, 'defer_duration': 300,
+            'reprobe_interval': 86400}
+
+
+def summary(total: int, succeeded: int, duration: float = 1.0) -> ResultSummary:
+    histogram = [0] * (len(DURATION_BUCKETS) + 1)
+    histogram[duration_bucket(duration)] = total
+    return ResultSummary(scope='domain_extractor', key='example.com|media', total=total, succeeded=succeeded,
+                         failed=total - succeeded, histogram=histogram)
+
+
+class DecideTest(unittest.TestCase):
+
+    def test_not_enough_history(self):
+        self.assertEqual(decide(None, SETTINGS), ('run', None))
+        self.assertEqual(decide(summary(5, 0), SETTINGS), ('run', None))
+
+    def test_drop_almost_always_failing(self):
+        action, reason = decide(summary(40, 1), SETTINGS)
+        self.assertEqual(action, 'drop')
+        self.assertEqual(reason, "1 of 40 previous runs succeeded")
+
+    def test_defer_unreliable_or_slow(self):
+        self.assertEqual(decide(summary(20, 5), SETTINGS)[0], 'defer')
+        self.assertEqual(decide(summary(20, 20, duration=900), SETTINGS)[0], 'defer')
+        self.assertEqual(decide(summary(20, 20, duration=900), {**SETTINGS, 'defer_duration': 0})[0], 'run')
+
+    def test_run_reliable(self):
+        self.assertEqual(decide(summary(20, 18, duration=20), SETTINGS), ('run', None))
+
+    def test_dropped_extractor_is_reprobed(self):
+        stale = summary(40, 1)
+        stale.updated_at = timezone.now() - timedelta(days=2)
+        action, reason = decide(stale, SETTINGS)
+        self.assertEqual(action, 'defer')
+        self.assertTrue(reason.startswith('re-probing'))
+        self.assertEqual(decide(stale, {**SETTINGS, 'reprobe_interval': 0})[0], 'drop')
+        stale.updated_at = timezone.now()
+        self.assertEqual(decide(stale, SETTINGS)[0], 'drop')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite planner test")
+class PlanExtractorsTest(DatabaseTestCase):
+
+    def setUp(self):
+        ResultSummary.objects.all().delete()
+        Job.objects.all().delete()
+        env = mock.patch.dict(os.environ, {'PLANNER_MIN_SAMPLES': '10', 'PLANNER_DROP_SUCCESS_RATE': '0.05',
+                                           'PLANNER_DEFER_SUCCESS_RATE': '0.3', 'PLANNER_DEFER_DURATION': '300',
+                                           'PLANNER_DEFERRED_CHUNK_SIZE': '50', 'JOB_EXECUTION_MODE': 'worker'})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def add_summary(self, domain, extractor, total, succeeded):
+        row = summary(total, succeeded)
+        row.key = domain_extractor_key(domain, extractor)
+        row.save()
+
+    def test_urls_are_grouped_by_extractors(self):
+        self.add_summary('bad.example.com', 'media', 40, 0)
+        self.add_summary('slow.example.com', 'pdf', 20, 4)
+        urls = ["https://good.example.com/a", "https://bad.example.com/a", "https://slow.example.com/a",
+                "https://good.example.com/b"]
+
+        plan = plan_extractors(urls, 'title,pdf,media')
+
+        groups = {group['extractors']: (group['urls'], group['deferred']) for group in plan['groups']}
+        self.assertEqual(groups, {
+            'title,pdf,media': (["https://good.example.com/a", "https://good.example.com/b"], []),
+            'title,pdf': (["https://bad.example.com/a"], []),
+            'title,media': (["https://slow.example.com/a"], ['pdf']),
+        })
+        self.assertEqual({(d['domain'], d['extractor'], d['action']) for d in plan['decisions']},
+                         {('bad.example.com', 'media', 'drop'), ('slow.example.com', 'pdf', 'defer')})
+
+    def test_all_dropped_falls_back_to_headers(self):
+        self.add_summary('bad.example.com', 'media', 40, 0)
+        plan = plan_extractors(["https://bad.example.com/a"], 'media')
+        self.assertEqual(plan['groups'], [{'urls': ["https://bad.example.com/a"], 'extractors': 'headers',
+                                           'deferred': []}])
+        # 未指定提取器且没有需要调整的域名时保持空参数
+        self.assertEqual(plan_extractors(["https://good.example.com/"], '')['groups'][0]['extractors'], '')
+
+    def test_deferred_extractors_are_queued_for_archived_urls(self):
+        self.add_summary('slow.example.com', 'pdf', 20, 4)
+        urls = ["https://slow.example.com/a", "https://slow.example.com/b", "https://good.example.com/a"]
+        calls = []
+
+        def run_add_command(urls, tags, depth, update, update_all, overwrite, extractors, parser, stdin_urls=False):
+            calls.append((urls, extractors))
+            # slow.example.com/b 存档失败，不会补跑
+            return success_response("ok", archive_paths={url: {} for url in urls if not url.endswith('/b')})
+
+        with mock.patch('api.service.run_add_command', run_add_command), \
+                mock.patch('api.service.detach_before_add'), mock.patch('api.service.rehydrate_before_add'):
+            result = add_url(urls, ['news'], 0, False, False, False, 'title,pdf', 'auto', plan=True, lanes=False)
+
+        self.assertEqual(sorted(calls), [(["https://good.example.com/a"], 'title,pdf'),
+                                         (["https://slow.example.com/a", "https://slow.example.com/b"], 'title')])
+        self.assertEqual(result['failed_urls'], ["https://slow.example.com/b"])
+        job_id, = result['plan']['deferred_jobs']
+        job = Job.objects.get(id=job_id)
+        self.assertEqual((job.kind, job.total), ('deferred', 1))
+        self.assertEqual((job.params['extractors'], job.params['update'], job.params['plan']), ('pdf', True, False))
+        self.assertEqual(job.params['tags'], ['news'])
+        self.assertEqual(JobChunk.objects.get(job_id=job).urls, "https://slow.example.com/a")
+
+    def test_async_add_follows_the_plan(self):
+        self.add_summary('slow.example.com', 'pdf', 20, 4)
+        urls = ["https://slow.example.com/a", "https://good.example.com/a"]
+        calls = []
+
+        async def run_add_command_async(urls, tags, depth, update, update_all, overwrite, extractors, parser):
+            calls.append((urls, extractors))
+            return success_response("ok", archive_paths={url: {} for url in urls})
+
+        with mock.patch('api.async_service.run_add_command_async', run_add_command_async), \
+                mock.patch('api.async_service.detach_before_add'), \
+                mock.patch('api.async_service.rehydrate_before_add'):
+            result = asyncio.run(add_url_async(urls, [], 0, False, False, False, 'title,pdf', 'auto', plan=True,
+                                               lanes=False))
+
+        self.assertEqual(sorted(calls), [(["https://good.example.com/a"], 'title,pdf'),
+                                         (["https://slow.example.com/a"], 'title')])
+        job_id, = result['plan']['deferred_jobs']
+        self.assertEqual(Job.objects.get(id=job_id).params['extractors'], 'pdf')
+
+    def test_stream_rejects_plan(self):
+        payload = {'urls': ["https://example.com/"], 'depth': 1, 'plan': True, 'fan_out': True}
+        response = Client(HTTP_HOST='localhost').post('/api/async/add/stream', json.dumps(payload),
+                                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('plan, fan_out', response.json()['message'])
+
+
+if __name__ == '__main__':
+    unittest.main()
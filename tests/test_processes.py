@@ -0,0 +1,77 @@
+import os
+import socket
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from api.processes import current_chunk_id, current_job_id, find_orphan_containers, get_command_timeout, \
+    kill_job_processes, register_process, unregister_process
+
+
+class CommandTimeoutTest(unittest.TestCase):
+
+    def test_no_timeout_by_default(self):
+        with mock.patch.dict(os.environ, {'ARCHIVEBOX_COMMAND_TIMEOUT': '0', 'ARCHIVEBOX_BATCH_SECONDS_PER_URL': '0'}):
+            self.assertIsNone(get_command_timeout(10))
+
+    def test_smallest_timeout_wins(self):
+        with mock.patch.dict(os.environ, {'ARCHIVEBOX_COMMAND_TIMEOUT': '600',
+                                          'ARCHIVEBOX_BATCH_SECONDS_PER_URL': '120'}):
+            self.assertEqual(get_command_timeout(2), 240)
+            self.assertEqual(get_command_timeout(10), 600)
+            self.assertEqual(get_command_timeout(), 600)
+
+    def test_legacy_url_timeout_is_a_batch_budget(self):
+        env = {'ARCHIVEBOX_COMMAND_TIMEOUT': '0', 'ARCHIVEBOX_URL_TIMEOUT': '30'}
+        with mock.patch.dict(os.environ, env):
+            os.environ.pop('ARCHIVEBOX_BATCH_SECONDS_PER_URL', None)
+            self.assertEqual(get_command_timeout(4), 120)
+
+
+class OrphanContainerTest(unittest.TestCase):
+
+    def container(self, name, job='', host=None, pid=None, started='1000'):
+        return {'id': name, 'name': name, 'job': job, 'host': host or socket.gethostname(),
+                'pid': str(pid or os.getpid()), 'started': started}
+
+    def test_find_orphans(self):
+        containers = [
+            self.container('running'),
+            self.container('finished-job', job='job-1'),
+            self.container('dead-owner', pid=2 ** 22 + 1),
+            self.container('other-host', host='another-node', pid=2 ** 22 + 1),
+            self.container('too-old', host='another-node', started='1'),
+        ]
+        orphans = find_orphan_containers(containers, {'job-1'}, max_age=3600, now=1100)
+        self.assertListEqual([(container['name'], reason) for container, reason in orphans], [
+            ('finished-job', 'job finished'),
+            ('dead-owner', 'owner process exited'),
+        ])
+        orphans = find_orphan_containers(containers, set(), max_age=500, now=1100)
+        self.assertIn(('too-old', 'exceeded max lifetime'), [(c['name'], reason) for c, reason in orphans])
+
+
+class KillProcessesTest(unittest.TestCase):
+
+    def register(self, pid, chunk_id):
+        job_token = current_job_id.set('job-1')
+        chunk_token = current_chunk_id.set(chunk_id)
+        try:
+            register_process(pid, f"container-{pid}")
+        finally:
+            current_chunk_id.reset(chunk_token)
+            current_job_id.reset(job_token)
+        self.addCleanup(unregister_process, pid)
+
+    def test_only_the_lost_chunk_is_killed(self):
+        self.register(101, 'chunk-a')
+        self.register(102, 'chunk-b')
+        with mock.patch('api.processes.terminate_command') as terminate:
+            self.assertEqual(kill_job_processes('job-1', 'chunk-a'), 1)
+            terminate.assert_called_once_with(101, 'container-101')
+            terminate.reset_mock()
+            self.assertEqual(kill_job_processes('job-1'), 2)
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import threading
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+
+from api.async_service import filter_targets_async
+from api.fieldsets import FieldSet
+from api.models import ChangeLog, Result, Tag, Target
+from api.read_model import ReadModel
+from api.service import filter_targets
+from api.utils import save_result, save_tags
+from db_case import DatabaseTestCase
+
+EXTRACTORS = ('headers', 'title', 'wget', 'pdf')
+
+
+def snapshot(url: str, timestamp: float, failed=()):
+    return {
+        'url': url,
+        'timestamp': str(timestamp),
+        'history': {name: {
+            'start_ts': '2024-07-01T10:00:00+00:00',
+            'end_ts': '2024-07-01T10:00:05+00:00',
+            'status': name not in failed,
+            'output': f"/static/archive/{timestamp}/{name}.out",
+        } for name in EXTRACTORS},
+    }
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite read model test")
+class ReadModelTest(DatabaseTestCase):
+
+    def setUp(self):
+        Target.objects.all().delete()
+        Tag.objects.all().delete()
+        ChangeLog.objects.all().delete()
+        env = mock.patch.dict(os.environ, {'READ_MODEL_ENABLED': 'true', 'PROJECT_DIR': '',
+                                           'DEDUP_ON_INGEST': 'false'})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def seed(self, start: int, count: int):
+        for index in range(start, start + count):
+            url = f"https://site{index % 3}.example.com/{index}"
+            save_result(snapshot(url, 1700000000.0 + index, failed=('pdf',) if index % 2 else ()))
+            save_tags(url, ['all', 'odd' if index % 2 else 'even'] + (['spam'] if index % 5 == 0 else []))
+
+    def query_sql(self, data):
+        with mock.patch('api.service.get_read_model', return_value=None):
+            return filter_targets(data)['targets']
+
+    def assertSameAsDatabase(self, model: ReadModel):
+        queries = [
+            {},
+            {'domains': ['site1.example.com']},
+            {'tag_names': ['odd', 'missing']},
+            {'tag_query': '(odd OR even) AND NOT spam', 'domains': ['site0.example.com', 'site2.example.com']},
+            {'urls': ['https://site1.example.com/4', 'https://site2.example.com/5', 'https://nowhere.example.com/']},
+            {'extractors': ['pdf', 'title'], 'fields': 'url,results.extractor,results.status'},
+            {'latest_only': True, 'fields': 'url,tags,results'},
+            {'extractors': ['missing'], 'fields': 'domain,results.output'},
+        ]
+        for data in queries:
+            # list 接口不保证目标的顺序
+            expected = sorted(self.query_sql(data), key=str)
+            actual = sorted(model.filter_targets(data, FieldSet.parse(data.get('fields'))), key=str)
+            self.assertEqual(actual, expected, msg=data)
+
+    def test_snapshot_matches_database(self):
+        self.seed(0, 20)
+        model = ReadModel.build()
+        self.assertEqual(model.stats()['targets'], 20)
+        self.assertEqual(model.stats()['results'], 80)
+        self.assertSameAsDatabase(model)
+
+    def test_catch_up_from_change_log(self):
+        self.seed(0, 10)
+        model = ReadModel.build()
+        self.seed(10, 10)
+        # 重新存档：新快照和覆盖已有结果
+        save_result(snapshot("https://site1.example.com/1", 1800000000.0, failed=('wget',)))
+        save_result(snapshot("https://site2.example.com/2", 1700000002.0, failed=('title',)),
+                    overwrite_extractors=['title'])
+        save_tags("https://site1.example.com/1", ['spam'])
+
+        self.assertGreater(model.catch_up(), 0)
+        self.assertEqual(model.stats()['targets'], Target.objects.count())
+        self.assertEqual(model.stats()['results'], Result.objects.count())
+        self.assertSameAsDatabase(model)
+        # 已应用的日志不会再次读取
+        self.assertEqual(model.catch_up(), 0)
+        self.assertEqual(model.stats()['results'], Result.objects.count())
+
+    def test_late_committed_changes_are_applied(self):
+        self.seed(0, 2)
+        model = ReadModel.build()
+        last = model.last_log_id
+        # 先分配 ID 的事务后提交：last + 1 在 last + 2 之后才写入
+        ChangeLog.objects.create(id=last + 2, kind='target', data={
+            'id': '00000000-0000-0000-0000-000000000002', 'url': "https://late.example.com/2", 'domain': 'late'})
+        self.assertEqual(model.catch_up(), 1)
+        self.assertEqual(model.log_gaps.keys(), {last + 1})
+        ChangeLog.objects.create(id=last + 1, kind='target', data={
+            'id': '00000000-0000-0000-0000-000000000001', 'url': "https://late.example.com/1", 'domain': 'late'})
+        self.assertEqual(model.catch_up(), 1)
+        self.assertEqual(model.log_gaps, {})
+        self.assertIn("https://late.example.com/1", model.urls)
+
+    def test_rolled_back_gaps_expire(self):
+        model = ReadModel.build()
+        ChangeLog.objects.create(id=model.last_log_id + 3, kind='tagging', data={
+            'target_id': '00000000-0000-0000-0000-000000000001', 'tag': 'none'})
+        model.catch_up()
+        self.assertEqual(len(model.log_gaps), 2)
+        with mock.patch.dict(os.environ, {'READ_MODEL_GAP_TIMEOUT': '0'}), \
+                mock.patch('time.monotonic', return_value=1e12):
+            model.catch_up()
+        self.assertEqual(model.log_gaps, {})
+
+    def test_build_waits_for_recent_gaps(self):
+        ChangeLog.objects.create(id=10, kind='tagging', data={'target_id': '00000000-0000-0000-0000-000000000001',
+                                                              'tag': 'none'})
+        ChangeLog.objects.create(id=12, kind='tagging', data={'target_id': '00000000-0000-0000-0000-000000000001',
+                                                              'tag': 'none'})
+        model = ReadModel.build()
+        self.assertEqual((model.last_log_id, list(model.log_gaps)), (12, [11]))
+
+    def test_async_list_filters_off_the_event_loop(self):
+        self.seed(0, 4)
+        model = ReadModel.build()
+        threads = []
+        filter_targets_sync = model.filter_targets
+
+        def record_thread(*args):
+            threads.append(threading.get_ident())
+            return filter_targets_sync(*args)
+
+        with mock.patch('api.async_service.get_read_model', return_value=model), \
+                mock.patch.object(model, 'filter_targets', record_thread):
+            result = asyncio.run(filter_targets_async({'domains': ['site1.example.com']}))
+        self.assertEqual(len(result['targets']), 1)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_change_log_is_not_written_when_disabled(self):
+        with mock.patch.dict(os.environ, {'READ_MODEL_ENABLED': 'false'}):
+            self.seed(0, 2)
+        self.assertFalse(ChangeLog.objects.exists())
+
+    def test_memory_footprint(self):
+        self.seed(0, 10)
+        stats = ReadModel.build().stats()
+        memory = stats['memory_bytes']
+        self.assertEqual(memory['total'], sum(value for key, value in memory.items() if key != 'total'))
+        # 提取器名称、域名、标签和输出文件名只保存一份
+        self.assertLess(stats['strings'], 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import unittest
+from datetime import datetime, time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from api.refresh import parse_windows, seconds_left_in_window, refresh_budget
+
+
+class RefreshWindowTest(unittest.TestCase):
+
+    def test_parse_windows(self):
+        self.assertEqual(parse_windows("01:00-06:00, 22:00-02:30"),
+                         [(time(1, 0), time(6, 0)), (time(22, 0), time(2, 30))])
+        self.assertEqual(parse_windows(""), [])
+
+    def test_seconds_left_in_window(self):
+        windows = parse_windows("01:00-06:00,22:00-02:00")
+        self.assertEqual(seconds_left_in_window(datetime(2024, 7, 1, 5, 30), windows), 1800)
+        self.assertEqual(seconds_left_in_window(datetime(2024, 7, 1, 23, 0), windows), 3 * 3600)
+        self.assertEqual(seconds_left_in_window(datetime(2024, 7, 1, 0, 30), windows), 1800 + 3600)
+        self.assertIsNone(seconds_left_in_window(datetime(2024, 7, 1, 12, 0), windows))
+        self.assertEqual(seconds_left_in_window(datetime(2024, 7, 1, 12, 0), []), 24 * 3600)
+
+
+class RefreshBudgetTest(unittest.TestCase):
+
+    def test_spreads_due_targets_over_remaining_ticks(self):
+        self.assertEqual(refresh_budget(100, 4, 50, 10), 10)
+        self.assertEqual(refresh_budget(5, 4, 50, 10), 1)
+
+    def test_limited_by_free_slots(self):
+        self.assertEqual(refresh_budget(1000, 1, 20, 1), 20)
+        self.assertEqual(refresh_budget(1000, 0, 20, 1), 0)
+        self.assertEqual(refresh_budget(0, 4, 20, 1), 0)
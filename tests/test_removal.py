@@ -0,0 +1,165 @@
+import os
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import DatabaseError, connection
+from django.db.models import F, QuerySet
+
+from api.fieldsets import FieldSet
+from api.jobs import run_job
+from api.models import ArchiveFile, ChangeLog, Job, JobChunk, Result, ResultSummary, StorageUsage, Tag, Tagging, \
+    Target
+from api.read_model import ReadModel
+from api.removal import delete_targets
+from api.serializers import RemoveTargetsSerializer
+from api.service import create_remove_job, run_remove_job
+from api.stats import rebuild_result_summary, rebuild_storage_usage
+from api.utils import error_response, save_result, save_tags, success_response
+from db_case import DatabaseTestCase
+
+
+def snapshot(url: str, timestamp: float):
+    return {
+        'url': url,
+        'timestamp': str(timestamp),
+        'history': {name: {
+            'start_ts': '2024-07-01T10:00:00+00:00',
+            'end_ts': '2024-07-01T10:00:03+00:00',
+            'status': name != 'pdf',
+            'output': f"/static/archive/{timestamp}/{name}.out",
+        } for name in ('headers', 'title', 'pdf')},
+    }
+
+
+class FakeArchiveBox:
+    """记录 archivebox remove 的调用，fail_on 中的 URL 所在批次返回错误"""
+
+    def __init__(self, fail_on=()):
+        self.calls = []
+        self.fail_on = set(fail_on)
+
+    def execute(self, command_args: str, stdin: str = None, timeout: float = None):
+        urls = stdin.split()
+        self.calls.append((command_args, urls))
+        if self.fail_on & set(urls):
+            return error_response("Failed to execute command", stderr="boom")
+        return success_response("ok", stdout="")
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite removal test")
+class RemoveTargetsTest(DatabaseTestCase):
+
+    def setUp(self):
+        for model in (Job, Target, Tag, ChangeLog, ArchiveFile):
+            model.objects.all().delete()
+        env = mock.patch.dict(os.environ, {'PROJECT_DIR': '', 'DEDUP_ON_INGEST': 'false', 'READ_MODEL_ENABLED': 'true',
+                                           'REMOVE_TRANSACTION_SIZE': '3'})
+        env.start()
+        self.addCleanup(env.stop)
+        for index in range(12):
+            url = f"https://site{index % 2}.example.com/{index}"
+            save_result(snapshot(url, 1700000000.0 + index))
+            save_tags(url, ['stale' if index < 8 else 'keep', f'group{index % 3}'])
+            ArchiveFile.objects.create(path=f"{1700000000 + index}/title.out", size=1, mtime_ns=0, inode=index,
+                                       sha256='0' * 64)
+        Result.objects.update(size=F('timestamp') - 1700000000 + 10, file_count=1)
+        rebuild_storage_usage()
+        rebuild_result_summary()
+
+    def remove(self, data, archivebox, batch_size=3):
+        job = create_remove_job(data, batch_size)
+        with mock.patch('api.removal.execute_docker_compose_archivebox_command', archivebox.execute):
+            run_job(job.id, run_remove_job)
+        return Job.objects.get(id=job.id)
+
+    def snapshot_stats(self):
+        summaries = {(row.scope, row.key): (row.total, row.succeeded, row.failed, row.duration_count,
+                                            [count for count in row.histogram if count])
+                     for row in ResultSummary.objects.all() if row.total}
+        usage = {(row.scope, row.key): (row.size, row.file_count)
+                 for row in StorageUsage.objects.all() if row.size or row.file_count}
+        return summaries, usage
+
+    def test_batched_removal(self):
+        model = ReadModel.build()
+        archivebox = FakeArchiveBox()
+        job = self.remove({'tag_names': ['stale'], 'domains': ['site0.example.com']}, archivebox)
+
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual((job.total, job.processed, job.failed), (4, 4, 0))
+        self.assertEqual(job.result['removed'], 4)
+        self.assertEqual([len(urls) for _, urls in archivebox.calls], [3, 1])
+        self.assertIn('--delete', archivebox.calls[0][0])
+        self.assertEqual(sorted(Target.objects.values_list('url', flat=True)),
+                         sorted(f"https://site{i % 2}.example.com/{i}" for i in range(12) if i % 2 or i >= 8))
+        self.assertEqual(Result.objects.count(), 8 * 3)
+        self.assertEqual(Tagging.objects.count(), 8 * 2)
+        self.assertEqual(ArchiveFile.objects.count(), 8)
+
+        # 增量扣除后的统计与重新生成的一致
+        released = self.snapshot_stats()
+        rebuild_result_summary()
+        rebuild_storage_usage()
+        self.assertEqual(released, self.snapshot_stats())
+
+        # 读模型通过变更日志删除目标
+        model.catch_up()
+        items = model.filter_targets({'tag_names': ['stale']}, FieldSet.parse('url'))
+        self.assertEqual(sorted(item['url'] for item in items),
+                         sorted(f"https://site1.example.com/{i}" for i in (1, 3, 5, 7)))
+
+    def test_failed_batch_keeps_rows(self):
+        archivebox = FakeArchiveBox(fail_on={"https://site0.example.com/0"})
+        job = self.remove({'domains': ['site0.example.com']}, archivebox)
+
+        self.assertEqual(job.status, 'partial_success')
+        self.assertEqual(job.failed, 3)
+        chunks = list(JobChunk.objects.filter(job_id=job).order_by('index').values_list('status', flat=True))
+        self.assertEqual(chunks, ['failed', 'succeeded'])
+        self.assertEqual(Target.objects.filter(domain='site0.example.com').count(), 3)
+
+    def test_failed_delete_keeps_stats(self):
+        before = self.snapshot_stats()
+        delete = QuerySet.delete
+
+        def fail_target_delete(queryset):
+            if queryset.model is Target:
+                raise DatabaseError("locked")
+            return delete(queryset)
+
+        with mock.patch.object(QuerySet, 'delete', fail_target_delete), self.assertRaises(DatabaseError):
+            delete_targets(["https://site0.example.com/0"])
+        # 扣除统计与删除在同一事务中，删除失败时一起回滚
+        self.assertEqual(self.snapshot_stats(), before)
+        self.assertTrue(Target.objects.filter(url="https://site0.example.com/0").exists())
+
+    def test_tag_query_alone_scopes_removal(self):
+        job = self.remove({'tag_query': 'keep AND NOT group0'}, FakeArchiveBox())
+        self.assertEqual(job.params['filters'], {'tag_query': 'keep AND NOT group0'})
+        self.assertEqual(job.total, 3)
+        self.assertEqual(Target.objects.count(), 9)
+        self.assertFalse(Target.objects.filter(url__in=[f"https://site{i % 2}.example.com/{i}"
+                                                       for i in (8, 10, 11)]).exists())
+
+    def test_missing_snapshots_are_removed_from_database(self):
+        archivebox = FakeArchiveBox()
+        archivebox.execute = lambda *args, **kwargs: error_response(
+            "Failed", stderr="[X] No matching Snapshots found.")
+        job = self.remove({'urls': ["https://site0.example.com/0"]}, archivebox)
+        self.assertEqual(job.status, 'succeeded')
+        self.assertFalse(Target.objects.filter(url="https://site0.example.com/0").exists())
+
+    def test_filter_is_required(self):
+        self.assertFalse(RemoveTargetsSerializer(data={'batch_size': 10}).is_valid())
+        serializer = RemoveTargetsSerializer(data={'tag_query': 'stale AND NOT keep', 'extractors': ['pdf']})
+        self.assertTrue(serializer.is_valid())
+        self.assertNotIn('extractors', serializer.validated_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+from django.utils import timezone
+
+from api.models import Job, Result, Tag, Target
+from api.retry import group_failed_targets, retry_backoff
+from api.service import retry_failed_extractors
+from api.utils import format_snapshot_timestamp, latest_history_entry, save_tags
+from db_case import DatabaseTestCase
+
+
+class RetryBackoffTest(unittest.TestCase):
+
+    def test_exponential_backoff_with_cap(self):
+        with mock.patch.dict(os.environ, {'RETRY_BACKOFF_BASE': '60', 'RETRY_BACKOFF_MAX': '300'}):
+            self.assertEqual(retry_backoff(1), timedelta(seconds=60))
+            self.assertEqual(retry_backoff(2), timedelta(seconds=120))
+            self.assertEqual(retry_backoff(3), timedelta(seconds=240))
+            self.assertEqual(retry_backoff(4), timedelta(seconds=300))
+
+
+class SnapshotHistoryTest(unittest.TestCase):
+
+    def test_latest_history_entry(self):
+        entries = [
+            {'status': 'failed', 'start_ts': '2024-07-04T06:45:21.000000+00:00'},
+            {'status': 'succeeded', 'start_ts': '2024-07-05T06:45:21.000000+00:00'},
+        ]
+        self.assertEqual(latest_history_entry(entries)['status'], 'succeeded')
+
+    def test_format_snapshot_timestamp(self):
+        self.assertEqual(format_snapshot_timestamp(1720075521.41685), '1720075521.41685')
+        self.assertEqual(format_snapshot_timestamp(1720075521.0), '1720075521')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite retry test")
+class RetryFilterTest(DatabaseTestCase):
+
+    def setUp(self):
+        for model in (Job, Target, Tag):
+            model.objects.all().delete()
+        env = mock.patch.dict(os.environ, {'PROJECT_DIR': '', 'READ_MODEL_ENABLED': 'false'})
+        env.start()
+        self.addCleanup(env.stop)
+        now = timezone.now()
+        for index, (url, tag) in enumerate([("https://a.com/", 'keep'), ("https://b.com/", 'other')]):
+            target = Target.objects.create(url=url, domain=url[8:-1], timestamp=index)
+            Result.objects.create(target_id=target, extractor='pdf', timestamp=index, start_ts=now, end_ts=now,
+                                  status=False, output='error')
+            save_tags(url, [tag])
+
+    def test_tag_query_alone_scopes_retry(self):
+        groups = group_failed_targets({'tag_query': 'keep'})
+        self.assertEqual([url for targets in groups.values() for _, url, _ in targets], ["https://a.com/"])
+
+        with mock.patch('api.service.submit_job'):
+            retry_failed_extractors({'tag_query': 'keep'}, 10)
+        job = Job.objects.get()
+        self.assertEqual(job.params['filters'], {'tag_query': 'keep', 'extractors': []})
+        self.assertEqual(job.total, 1)
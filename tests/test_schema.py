@@ -0,0 +1,30 @@
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.core.management import call_command
+
+
+class GenerateOpenApiSchemaTest(unittest.TestCase):
+
+    def test_schema_includes_annotated_views(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'openapi.json')
+            call_command('generate_openapi_schema', output=output, stdout=StringIO())
+            with open(output, encoding='utf-8') as f:
+                schema = json.load(f)
+
+        self.assertEqual(schema['basePath'], '/api')
+        self.assertIn('/list', schema['paths'])
+        list_operation = schema['paths']['/list']['post']
+        self.assertEqual(list_operation['parameters'][0]['schema']['$ref'], '#/definitions/FilterTargets')
+        self.assertEqual(list_operation['responses']['207']['description'], "部分成功返回的响应结构")
+        self.assertIn('get', schema['paths']['/jobs/{job_id}'])
+        self.assertIn('delete', schema['paths']['/jobs/{job_id}'])
@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+
+from api.models import Result, StorageUsage, Target
+from api.stats import DURATION_BUCKETS, duration_bucket, histogram_quantile, measure_output, measure_results, \
+    result_duration
+from api.utils import process_json_data, save_result
+from db_case import DatabaseTestCase
+
+
+class MeasureOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_dir = self.tmp_dir.name
+        os.makedirs(os.path.join(self.snapshot_dir, 'media', 'thumbs'))
+        for name, size in (('favicon.ico', 100), ('media/video.mp4', 1000), ('media/thumbs/0.jpg', 50),
+                           ('index.json', 10)):
+            with open(os.path.join(self.snapshot_dir, name), 'wb') as f:
+                f.write(b'x' * size)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_file_output(self):
+        self.assertEqual(measure_output(self.snapshot_dir, 'favicon.ico'), (100, 1))
+
+    def test_directory_output_counts_whole_folder(self):
+        self.assertEqual(measure_output(self.snapshot_dir, 'media/video.mp4'), (1050, 2))
+        self.assertEqual(measure_output(self.snapshot_dir, 'media'), (1050, 2))
+
+    def test_non_path_output(self):
+        self.assertEqual(measure_output(self.snapshot_dir, 'Example Domain'), (0, 0))
+        self.assertEqual(measure_output(self.snapshot_dir, 'https://web.archive.org/web/example.com'), (0, 0))
+        self.assertEqual(measure_output(self.snapshot_dir, '../other/favicon.ico'), (0, 0))
+        self.assertEqual(measure_output(self.snapshot_dir, 'index.json'), (0, 0))
+        self.assertEqual(measure_output(self.snapshot_dir, None), (0, 0))
+
+    def test_static_url_output(self):
+        self.assertEqual(measure_output(self.snapshot_dir, '/static/archive/1700000000.5/favicon.ico'), (100, 1))
+        self.assertEqual(measure_output(self.snapshot_dir, '/static/archive/1700000000/media/video.mp4'), (1050, 2))
+        self.assertEqual(measure_output(self.snapshot_dir, '/static/archive/1700000000/index.json'), (0, 0))
+        self.assertEqual(measure_output(self.snapshot_dir, '/static/archive/1700000000'), (0, 0))
+        self.assertEqual(measure_output(self.snapshot_dir, '/etc/passwd'), (0, 0))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite storage stats test")
+class SavedResultSizeTest(DatabaseTestCase):
+
+    def setUp(self):
+        for model in (Target, StorageUsage):
+            model.objects.all().delete()
+        project = tempfile.TemporaryDirectory()
+        self.addCleanup(project.cleanup)
+        env = mock.patch.dict(os.environ, {'PROJECT_DIR': project.name, 'DEDUP_ON_INGEST': 'false'})
+        env.start()
+        self.addCleanup(env.stop)
+
+        self.snapshot_dir = os.path.join(project.name, 'data', 'archive', '1700000000')
+        os.makedirs(os.path.join(self.snapshot_dir, 'media'))
+        for name, size in (('favicon.ico', 100), ('media/video.mp4', 1000)):
+            with open(os.path.join(self.snapshot_dir, name), 'wb') as f:
+                f.write(b'x' * size)
+        entry = {'start_ts': '2024-07-01T10:00:00+00:00', 'end_ts': '2024-07-01T10:00:02+00:00',
+                 'status': 'succeeded'}
+        self.index_file = os.path.join(self.snapshot_dir, 'index.json')
+        with open(self.index_file, 'w', encoding='utf-8') as f:
+            json.dump({'url': 'https://example.com/', 'timestamp': '1700000000', 'history': {
+                'favicon': [dict(entry, output='favicon.ico')],
+                'media': [dict(entry, output='media')],
+                'title': [dict(entry, output='Example Domain')],
+            }}, f)
+
+    def test_sizes_are_measured_from_index(self):
+        save_result(process_json_data(self.index_file))
+
+        sizes = dict((extractor, (size, files)) for extractor, size, files in
+                     Result.objects.values_list('extractor', 'size', 'file_count'))
+        self.assertEqual(sizes, {'favicon': (100, 1), 'media': (1000, 1), 'title': (0, 0)})
+        target = StorageUsage.objects.get(scope='target')
+        self.assertEqual((target.size, target.file_count), (1100, 2))
+        self.assertEqual(StorageUsage.objects.get(scope='extractor', key='media').size, 1000)
+
+    def test_unchanged_results_are_not_measured_again(self):
+        data = process_json_data(self.index_file)
+        save_result(data)
+        with mock.patch('api.utils.measure_output', wraps=measure_output) as measure:
+            save_result(data)
+            save_result(data, overwrite_extractors=['favicon', 'media', 'title'])
+            self.assertEqual(measure.call_count, 0)
+
+            with open(os.path.join(self.snapshot_dir, 'favicon.png'), 'wb') as f:
+                f.write(b'x' * 40)
+            data['history']['favicon']['output'] = 'favicon.png'
+            save_result(data, overwrite_extractors=['favicon', 'media'])
+            self.assertEqual(measure.call_count, 1)
+
+        self.assertEqual(Result.objects.get(extractor='favicon').size, 40)
+        self.assertEqual(Result.objects.get(extractor='media').size, 1000)
+        target = StorageUsage.objects.get(scope='target')
+        self.assertEqual((target.size, target.file_count), (1040, 2))
+
+    def test_rebuild_measures_saved_results(self):
+        save_result(process_json_data(self.index_file))
+        Result.objects.update(size=0, file_count=0)
+
+        self.assertEqual(measure_results(lambda timestamp: self.snapshot_dir), 2)
+        self.assertEqual(Result.objects.get(extractor='favicon').size, 100)
+
+
+class DurationSummaryTest(unittest.TestCase):
+
+    def test_result_duration(self):
+        self.assertEqual(result_duration('2024-07-01 10:00:00.000000', '2024-07-01 10:00:02.500000'), 2.5)
+        self.assertEqual(result_duration(datetime(2024, 7, 1, 10), datetime(2024, 7, 1, 10, 1)), 60)
+        self.assertIsNone(result_duration(None, '2024-07-01 10:00:00.000000'))
+        self.assertIsNone(result_duration('2024-07-01 10:00:01', '2024-07-01 10:00:00'))
+
+    def test_duration_bucket(self):
+        self.assertEqual(duration_bucket(0.1), 0)
+        self.assertEqual(duration_bucket(1), 1)
+        self.assertEqual(duration_bucket(7200), len(DURATION_BUCKETS))
+
+    def test_histogram_quantile(self):
+        histogram = [0] * (len(DURATION_BUCKETS) + 1)
+        histogram[duration_bucket(3)] = 90
+        histogram[duration_bucket(45)] = 10
+        self.assertAlmostEqual(histogram_quantile(histogram, 0.5), 2 + 3 * 50 / 90)
+        self.assertAlmostEqual(histogram_quantile(histogram, 0.95), 30 + 30 * 5 / 10)
+        self.assertIsNone(histogram_quantile([], 0.95))
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from array import array
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+
+from api.async_service import synchronize_local_data_async
+from api.models import CacheVersion, Tag, Target
+from api.serializers import AddUrlsSerializer, FilterTargetsSerializer, ImportUrlsSerializer, \
+    RefreshPolicySerializer, WebhookSubscriptionSerializer
+from api.tag_index import TagIndex, TagQueryError, batch_tag_index_invalidation, get_tag_index_version, \
+    parse_tag_query, tag_query_filter
+from api.utils import save_result, save_tags
+from db_case import DatabaseTestCase
+
+
+class TagQueryParserTest(unittest.TestCase):
+
+    def test_precedence(self):
+        self.assertEqual(parse_tag_query("a OR b AND NOT c"),
+                         ('or', (('tag', 'a'), ('and', (('tag', 'b'), ('not', ('tag', 'c')))))))
+
+    def test_parentheses_symbols_and_quotes(self):
+        self.assertEqual(parse_tag_query('(a | "two words") && !"or"'),
+                         ('and', (('or', (('tag', 'a'), ('tag', 'two words'))), ('not', ('tag', 'or')))))
+
+    def test_invalid_queries(self):
+        for query in ("", "a AND", "(a OR b", "a b", "AND a", "a )"):
+            with self.assertRaises(TagQueryError, msg=query):
+                parse_tag_query(query)
+
+
+class TagNameLengthTest(unittest.TestCase):
+
+    def test_serializers_accept_what_the_model_stores(self):
+        max_length = Tag._meta.get_field('name').max_length
+        fields = [AddUrlsSerializer().fields['tag'].child, ImportUrlsSerializer().fields['tag'].child,
+                  FilterTargetsSerializer().fields['tag_names'].child, RefreshPolicySerializer().fields['tag'],
+                  WebhookSubscriptionSerializer().fields['tag']]
+        self.assertEqual({field.max_length for field in fields}, {max_length})
+
+
+class TagIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        ids = [f"target-{i}" for i in range(20)]
+        self.index = TagIndex(1, ids, {
+            'news': array('I', [0, 1, 2, 3, 10, 19]),
+            'tech': array('I', [2, 3, 4, 19]),
+            'spam': array('I', [3]),
+        })
+
+    def query(self, text):
+        return self.index.target_ids(self.index.evaluate(parse_tag_query(text)), 100)
+
+    def test_boolean_operations(self):
+        self.assertEqual(self.query("news AND tech"), ['target-2', 'target-3', 'target-19'])
+        self.assertEqual(self.query("(news OR tech) AND NOT spam"),
+                         ['target-0', 'target-1', 'target-2', 'target-4', 'target-10', 'target-19'])
+        self.assertEqual(len(self.query("NOT news")), 14)
+        self.assertEqual(self.query("missing"), [])
+
+    def test_limit(self):
+        self.assertIsNone(self.index.target_ids(self.index.evaluate(parse_tag_query("NOT spam")), 10))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite tag index test")
+class TagQueryFilterTest(DatabaseTestCase):
+
+    def setUp(self):
+        for model in (Target, Tag, CacheVersion):
+            model.objects.all().delete()
+        env = mock.patch.dict(os.environ, {'PROJECT_DIR': '', 'TAG_INDEX_ENABLED': 'true', 'TAG_INDEX_MAX_IDS': '3'})
+        env.start()
+        self.addCleanup(env.stop)
+        with batch_tag_index_invalidation():
+            for index in range(8):
+                url = f"https://example.com/{index}"
+                save_result({'url': url, 'timestamp': 1700000000.0 + index, 'history': {}})
+                save_tags(url, ['news'] + (['tech'] if index % 2 else []) + (['spam'] if index == 3 else []))
+        # 整批入库只递增一次版本号
+        self.assertEqual(get_tag_index_version(), 1)
+        index = mock.patch('api.tag_index._index', TagIndex.build(get_tag_index_version()))
+        index.start()
+        self.addCleanup(index.stop)
+
+    def urls(self, query):
+        condition = tag_query_filter(query)
+        return condition, sorted(Target.objects.filter(condition).values_list('url', flat=True))
+
+    def test_small_results_use_index_ids(self):
+        condition, urls = self.urls("tech AND NOT spam")
+        self.assertEqual(condition.children[0][0], 'id__in')
+        self.assertEqual(urls, ["https://example.com/1", "https://example.com/5", "https://example.com/7"])
+
+    def test_large_results_use_subquery(self):
+        condition, urls = self.urls("news AND NOT spam")
+        self.assertNotIn('id__in', str(condition))
+        self.assertEqual(len(urls), 7)
+        self.assertNotIn("https://example.com/3", urls)
+
+    def test_async_synchronization_increments_version_once(self):
+        with tempfile.TemporaryDirectory() as project_dir:
+            for index in range(3):
+                folder = os.path.join(project_dir, 'data', 'archive', str(1800000000 + index))
+                os.makedirs(folder)
+                with open(os.path.join(folder, 'index.json'), 'w', encoding='utf-8') as f:
+                    json.dump({'url': f"https://example.org/{index}", 'timestamp': str(1800000000 + index),
+                               'history': {}}, f)
+            with mock.patch.dict(os.environ, {'PROJECT_DIR': project_dir}):
+                result = asyncio.run(synchronize_local_data_async())
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(Target.objects.filter(url__startswith="https://example.org/").count(), 3)
+        self.assertEqual(get_tag_index_version(), 2)
+
+    def test_stale_index_falls_back_to_database(self):
+        save_tags("https://example.com/0", ['tech'])
+        with mock.patch('api.tag_index.threading.Thread'):
+            condition, urls = self.urls("tech AND NOT spam")
+        self.assertNotIn('id__in', str(condition))
+        self.assertIn("https://example.com/0", urls)
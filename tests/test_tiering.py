@@ -0,0 +1,178 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from api.locks import acquire_lock
+from api.models import ArchiveFile, BundleMember, SnapshotBundle, Target, TaskLock
+from api.tiering import MemberCache, open_snapshot_file, rehydrate_before_add, tier_snapshots
+from api.utils import save_result
+from db_case import DatabaseTestCase
+
+OLD = time.time() - 90 * 86400
+FILES = {
+    'title.out': b'Example title\n' * 20,
+    'media/cover.png': os.urandom(4096),
+    # 超过 TIER_CACHE_MAX_MEMBER 的文件以流的方式返回
+    'wget/example.com/index.html': b'<p>archived page</p>\n' * 20000,
+    'empty.txt': b'',
+}
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite tiering test")
+class TieringTest(DatabaseTestCase):
+
+    def setUp(self):
+        for model in (SnapshotBundle, Target, ArchiveFile, TaskLock):
+            model.objects.all().delete()
+        project = tempfile.TemporaryDirectory()
+        self.addCleanup(project.cleanup)
+        self.project_dir = project.name
+        env = mock.patch.dict(os.environ, {'PROJECT_DIR': self.project_dir, 'DEDUP_ON_INGEST': 'false',
+                                           'TIER_CACHE_MAX_MEMBER': '65536'})
+        env.start()
+        self.addCleanup(env.stop)
+        cache = mock.patch('api.tiering._cache', None)
+        cache.start()
+        self.addCleanup(cache.stop)
+
+    def make_snapshot(self, timestamp: str, mtime: float = OLD) -> str:
+        snapshot_dir = os.path.join(self.project_dir, 'data', 'archive', timestamp)
+        for name, content in {**FILES, 'index.json': b'{}', 'index.html': b'<html></html>'}.items():
+            path = os.path.join(snapshot_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            os.utime(path, (mtime, mtime))
+        save_result({'url': f"https://example.com/{timestamp}", 'timestamp': timestamp, 'history': {}})
+        return snapshot_dir
+
+    def test_old_snapshots_are_packed(self):
+        snapshot_dir = self.make_snapshot('1700000000')
+        self.make_snapshot('1700000001', mtime=time.time())
+        ArchiveFile.objects.create(path=os.path.join('1700000000', 'title.out'), size=1, mtime_ns=0, inode=1,
+                                   sha256='0' * 64)
+
+        stats = tier_snapshots()
+        self.assertEqual((stats['scanned'], stats['tiered'], stats['skipped']), (2, 1, 1))
+        self.assertEqual(stats['files'], len(FILES))
+        self.assertLess(stats['size'], stats['original_size'])
+
+        bundle = SnapshotBundle.objects.get()
+        self.assertEqual(bundle.timestamp, '1700000000')
+        self.assertTrue(os.path.isfile(bundle.path))
+        self.assertEqual(sorted(os.listdir(snapshot_dir)), ['index.html', 'index.json'])
+        self.assertFalse(ArchiveFile.objects.exists())
+        # 已经打包的快照不会再次处理
+        self.assertEqual(tier_snapshots()['tiered'], 0)
+
+    def test_members_are_served_from_bundle(self):
+        self.make_snapshot('1700000000')
+        tier_snapshots()
+
+        for name, content in FILES.items():
+            file = open_snapshot_file('1700000000', name)
+            data = b''.join(file['stream']) if 'stream' in file else file['content']
+            self.assertEqual(data, content, msg=name)
+        self.assertIn('stream', open_snapshot_file('1700000000', 'wget/example.com/index.html'))
+
+        # 小文件第二次读取命中缓存，不再查询成员记录
+        BundleMember.objects.filter(name='title.out').update(offset=0)
+        self.assertEqual(open_snapshot_file('1700000000', 'title.out')['content'], FILES['title.out'])
+
+        client = Client(HTTP_HOST='localhost')
+        response = client.get('/api/archive/1700000000/media/cover.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, FILES['media/cover.png'])
+        response = client.get('/api/archive/1700000000/wget/example.com/index.html')
+        self.assertEqual(b''.join(response.streaming_content), FILES['wget/example.com/index.html'])
+        response = client.get('/api/archive/1700000000/index.json')
+        self.assertEqual(b''.join(response.streaming_content), b'{}')
+        response.close()
+        self.assertEqual(client.get('/api/archive/1700000000/missing.txt').status_code, 404)
+        self.assertIsNone(open_snapshot_file('1700000000', '../1700000000/title.out'))
+
+    def test_result_output_urls_are_served_after_tiering(self):
+        self.make_snapshot('1700000000')
+        tier_snapshots()
+
+        client = Client(HTTP_HOST='localhost')
+        # Result.output 中保存的地址
+        response = client.get('/static/archive/1700000000/media/cover.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, FILES['media/cover.png'])
+        self.assertEqual(client.get('/static/archive/1700000000/missing.txt').status_code, 404)
+        self.assertEqual(client.get('/static/archive/1700000000/../secret').status_code, 404)
+
+    def test_only_one_process_tiers_at_a_time(self):
+        snapshot_dir = self.make_snapshot('1700000000')
+        self.assertTrue(acquire_lock('tiering', 'other-process', 60))
+
+        stats = tier_snapshots()
+        self.assertTrue(stats['locked'])
+        self.assertEqual(stats['tiered'], 0)
+        self.assertTrue(os.path.exists(os.path.join(snapshot_dir, 'title.out')))
+
+        # 持有者没有续期，锁过期后由其他进程接管
+        TaskLock.objects.filter(name='tiering').update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(tier_snapshots()['tiered'], 1)
+        self.assertFalse(TaskLock.objects.exists())
+
+    def test_re_archiving_rehydrates_snapshot(self):
+        snapshot_dir = self.make_snapshot('1700000000')
+        tier_snapshots()
+        bundle_path = SnapshotBundle.objects.get().path
+
+        self.assertEqual(rehydrate_before_add(["https://example.com/1700000000"], False, False, False), 0)
+        restored = rehydrate_before_add(["https://example.com/1700000000"], True, False, False)
+
+        self.assertEqual(restored, len(FILES))
+        for name, content in FILES.items():
+            path = os.path.join(snapshot_dir, name)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+            self.assertAlmostEqual(os.stat(path).st_mtime, OLD, places=3)
+        self.assertFalse(SnapshotBundle.objects.exists())
+        self.assertFalse(BundleMember.objects.exists())
+        self.assertFalse(os.path.exists(bundle_path))
+
+    def test_dry_run_keeps_files(self):
+        snapshot_dir = self.make_snapshot('1700000000')
+        stats = tier_snapshots(dry_run=True)
+        self.assertEqual(stats['tiered'], 1)
+        self.assertFalse(SnapshotBundle.objects.exists())
+        self.assertTrue(os.path.exists(os.path.join(snapshot_dir, 'title.out')))
+
+
+class MemberCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_members_are_evicted(self):
+        cache = MemberCache(max_bytes=10, max_member=6)
+        cache.put('a', '1', b'1234')
+        cache.put('a', '2', b'1234')
+        cache.get('a', '1')
+        cache.put('b', '3', b'1234')
+        self.assertIsNone(cache.get('a', '2'))
+        self.assertEqual(cache.get('a', '1'), b'1234')
+        # 超过单个文件上限的内容不缓存
+        cache.put('b', '4', b'1234567')
+        self.assertIsNone(cache.get('b', '4'))
+        cache.discard('a')
+        self.assertEqual(cache.stats()['items'], 1)
+        self.assertEqual(cache.stats()['bytes'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
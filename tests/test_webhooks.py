@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import unittest
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from api.models import Tag, Tagging, Target, WebhookEvent, WebhookSubscription
+from api.serializers import AddUrlsSerializer, WebhookSubscriptionSerializer
+from api.webhooks import SIGNATURE_HEADER, TIMESTAMP_HEADER, check_webhook_url, dispatch_webhooks, enqueue_event, \
+    notify_add_completed, prune_delivered_events, sign_payload, verify_signature, webhook_backoff
+from db_case import DatabaseTestCase
+
+
+class SignatureTest(unittest.TestCase):
+
+    def test_verify_signature(self):
+        body = b'{"events": []}'
+        signature = sign_payload('secret', '1000', body)
+        self.assertTrue(signature.startswith('sha256='))
+        self.assertTrue(verify_signature('secret', '1000', body, signature, now=1010))
+        self.assertFalse(verify_signature('other', '1000', body, signature, now=1010))
+        self.assertFalse(verify_signature('secret', '1000', body + b' ', signature, now=1010))
+        # 超过容忍时间的时间戳视为重放
+        self.assertFalse(verify_signature('secret', '1000', body, signature, now=2000))
+
+    def test_backoff_is_capped(self):
+        with mock.patch.dict(os.environ, {'WEBHOOK_BACKOFF_BASE': '10', 'WEBHOOK_BACKOFF_MAX': '60'}):
+            self.assertEqual([webhook_backoff(n).total_seconds() for n in range(1, 6)], [10, 20, 40, 60, 60])
+
+
+class WebhookUrlTest(unittest.TestCase):
+
+    def test_private_addresses_are_rejected(self):
+        with mock.patch.dict(os.environ, {'WEBHOOK_ALLOWED_HOSTS': ''}):
+            for url in ("http://127.0.0.1:8000/hook", "http://10.0.0.5/hook", "http://169.254.169.254/latest",
+                        "http://[::1]/hook", "ftp://example.com/hook"):
+                self.assertIsNotNone(check_webhook_url(url), url)
+            self.assertIsNone(check_webhook_url("https://93.184.216.34/hook"))
+        with mock.patch.dict(os.environ, {'WEBHOOK_ALLOWED_HOSTS': 'hooks.internal, 127.0.0.1'}):
+            self.assertIsNone(check_webhook_url("http://127.0.0.1:8000/hook"))
+            self.assertIsNone(check_webhook_url("http://hooks.internal/hook"))
+
+    def test_serializers_validate_webhook_urls(self):
+        data = {'urls': ["https://example.com/"], 'callback_url': "https://93.184.216.34/hook"}
+        with mock.patch.dict(os.environ, {'WEBHOOK_SECRET': '', 'WEBHOOK_ALLOWED_HOSTS': ''}):
+            serializer = AddUrlsSerializer(data=data)
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('WEBHOOK_SECRET', str(serializer.errors['callback_url']))
+        with mock.patch.dict(os.environ, {'WEBHOOK_SECRET': 'secret', 'WEBHOOK_ALLOWED_HOSTS': ''}):
+            self.assertTrue(AddUrlsSerializer(data=data).is_valid())
+            self.assertFalse(AddUrlsSerializer(data=dict(data, callback_url="http://10.0.0.5/hook")).is_valid())
+            self.assertFalse(WebhookSubscriptionSerializer(
+                data={'tag': 'news', 'url': "http://192.168.1.1/hook"}).is_valid())
+
+    def test_async_views_resolve_callback_url_off_the_event_loop(self):
+        loops = []
+
+        def getaddrinfo(*args, **kwargs):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            raise socket.gaierror("not resolvable")
+
+        payload = {'urls': ["https://example.com/"], 'callback_url': "https://hooks.example.com/hook"}
+        with mock.patch.dict(os.environ, {'WEBHOOK_SECRET': 'secret', 'WEBHOOK_ALLOWED_HOSTS': ''}), \
+                mock.patch('api.webhooks.socket.getaddrinfo', getaddrinfo):
+            response = Client(HTTP_HOST='localhost').post('/api/async/add', json.dumps(payload),
+                                                          content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(loops, [None])
+
+
+class Receiver(HTTPServer):
+    """记录收到的请求，status_codes 依次作为响应状态码，用完后返回 200"""
+
+    def __init__(self, status_codes=None):
+        super().__init__(('127.0.0.1', 0), ReceiverHandler)
+        self.requests = []
+        self.status_codes = list(status_codes or [])
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/hook"
+
+
+class ReceiverHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((dict(self.headers), body))
+        code = self.server.status_codes.pop(0) if self.server.status_codes else 200
+        self.send_response(code)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite webhook test")
+class WebhookDeliveryTest(DatabaseTestCase):
+
+    def setUp(self):
+        WebhookEvent.objects.all().delete()
+        WebhookSubscription.objects.all().delete()
+        Target.objects.all().delete()
+        Tag.objects.all().delete()
+        # 测试的接收方监听在回环地址上
+        env = mock.patch.dict(os.environ, {'WEBHOOK_SECRET': 'global-secret', 'WEBHOOK_BACKOFF_BASE': '10',
+                                           'WEBHOOK_MAX_ATTEMPTS': '3', 'WEBHOOK_BATCH_SIZE': '50',
+                                           'WEBHOOK_ALLOWED_HOSTS': '127.0.0.1'})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def start_receiver(self, status_codes=None) -> Receiver:
+        receiver = Receiver(status_codes)
+        thread = threading.Thread(target=receiver.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(receiver.server_close)
+        self.addCleanup(receiver.shutdown)
+        return receiver
+
+    def add_result(self, urls):
+        archive_paths = {url: {'index.html': f'archive/{i}/index.html'} for i, url in enumerate(urls[:-1])}
+        return {'status': 'partial_success', 'message': "Some URLs failed.", 'archive_paths': archive_paths,
+                'failed_urls': urls[-1:]}
+
+    def test_subscription_events_are_batched_and_signed(self):
+        receiver = self.start_receiver()
+        tag = Tag.objects.create(name='news')
+        WebhookSubscription.objects.create(tag_id=tag, url=receiver.url, secret='sub-secret')
+        urls = [f"https://example.com/{i}" for i in range(5)]
+        for url in urls:
+            target = Target.objects.create(url=url, domain='example.com', timestamp=0)
+            Tagging.objects.create(tag_id=tag, target_id=target)
+
+        self.assertEqual(notify_add_completed(urls, self.add_result(urls)), 5)
+        stats = dispatch_webhooks()
+
+        self.assertEqual(stats, {'delivered': 5, 'retrying': 0, 'failed': 0, 'requests': 1, 'pruned': 0})
+        headers, body = receiver.requests[0]
+        self.assertTrue(verify_signature('sub-secret', headers[TIMESTAMP_HEADER], body, headers[SIGNATURE_HEADER]))
+        events = json.loads(body)['events']
+        self.assertEqual([event['data']['url'] for event in events], urls)
+        self.assertEqual({event['event'] for event in events}, {'url.completed'})
+        self.assertEqual(events[-1]['data']['status'], 'failed')
+        self.assertEqual(events[0]['data']['tags'], ['news'])
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        receiver = self.start_receiver([500, 500])
+        urls = ["https://example.com/a", "https://example.com/b"]
+        notify_add_completed(urls, self.add_result(urls), callback_url=receiver.url)
+
+        self.assertEqual(dispatch_webhooks()['retrying'], 1)
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertIn('HTTP 500', event.last_error)
+        self.assertGreater(event.next_attempt_at, timezone.now() + timedelta(seconds=5))
+
+        # 退避时间未到时不会再次投递
+        self.assertEqual(dispatch_webhooks()['requests'], 0)
+
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        dispatch_webhooks()
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatch_webhooks()['delivered'], 1)
+
+        self.assertEqual(len(receiver.requests), 3)
+        headers, body = receiver.requests[-1]
+        self.assertTrue(verify_signature('global-secret', headers[TIMESTAMP_HEADER], body,
+                                         headers[SIGNATURE_HEADER]))
+        data = json.loads(body)['events'][0]['data']
+        self.assertEqual(data['failed_urls'], ["https://example.com/b"])
+        self.assertEqual(WebhookEvent.objects.get().status, 'delivered')
+
+    def test_event_fails_after_max_attempts(self):
+        receiver = self.start_receiver([500, 500, 500])
+        notify_add_completed(["https://example.com/a"], {'status': 'error', 'message': "Failed."},
+                             callback_url=receiver.url)
+        for _ in range(3):
+            WebhookEvent.objects.update(next_attempt_at=timezone.now())
+            stats = dispatch_webhooks()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(WebhookEvent.objects.get().status, 'failed')
+
+    def test_callback_events_are_not_sent_unsigned(self):
+        receiver = self.start_receiver()
+        notify_add_completed(["https://example.com/a"], {'status': 'success', 'message': "Done."},
+                             callback_url=receiver.url)
+        with mock.patch.dict(os.environ, {'WEBHOOK_SECRET': ''}):
+            stats = dispatch_webhooks()
+        self.assertEqual((stats['requests'], stats['retrying']), (0, 1))
+        self.assertEqual(receiver.requests, [])
+        self.assertIn('WEBHOOK_SECRET', WebhookEvent.objects.get().last_error)
+
+    def test_delivery_connects_to_the_checked_address(self):
+        receiver = self.start_receiver()
+        port = receiver.server_address[1]
+        url = f"http://hooks.invalid:{port}/hook"
+        enqueue_event(url, 'batch.completed', {'urls': []})
+        # 检查时解析到的地址会被固定下来，投递时不再解析 hooks.invalid
+        with mock.patch('api.webhooks.resolve_webhook_url', return_value=('127.0.0.1', None)) as resolve, \
+                mock.patch.dict(os.environ, {'HTTP_PROXY': 'http://127.0.0.1:9', 'WEBHOOK_ALLOWED_HOSTS': ''}):
+            stats = dispatch_webhooks()
+        resolve.assert_called_once_with(url)
+        self.assertEqual(stats['delivered'], 1)
+        headers, _ = receiver.requests[0]
+        self.assertEqual(headers['Host'], f"hooks.invalid:{port}")
+
+    def test_delivered_events_are_pruned(self):
+        now = timezone.now()
+        for days in (1, 10):
+            WebhookEvent.objects.create(url="https://example.com/hook", event='batch.completed', payload={},
+                                        status='delivered', next_attempt_at=now,
+                                        delivered_at=now - timedelta(days=days))
+        WebhookEvent.objects.create(url="https://example.com/hook", event='batch.completed', payload={},
+                                    status='failed', next_attempt_at=now - timedelta(days=10))
+        with mock.patch.dict(os.environ, {'WEBHOOK_RETENTION': str(7 * 86400)}):
+            self.assertEqual(prune_delivered_events(force=True), 1)
+            # 未到 WEBHOOK_PRUNE_INTERVAL 时不会再次清理
+            self.assertEqual(prune_delivered_events(now=now + timedelta(days=30)), 0)
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
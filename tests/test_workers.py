@@ -0,0 +1,115 @@
+import os
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archivebox_api_server.settings')
+django.setup()
+
+from django.db import connection, connections
+from django.utils import timezone
+
+from api.jobs import create_job, create_job_chunks, run_periodic_once, start_background_tasks
+from api.models import Job, JobChunk, TaskLock
+from api.workers import claim_chunk, complete_chunk, renew_lease, requeue_expired_chunks
+from db_case import DatabaseTestCase
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite lease test")
+class ChunkLeaseTest(DatabaseTestCase):
+
+    def setUp(self):
+        Job.objects.all().delete()
+
+    def create_import_job(self, url_count: int, chunk_size: int) -> Job:
+        urls = [f"https://example.com/{i}" for i in range(url_count)]
+        job = create_job('import', params={}, total=len(urls))
+        create_job_chunks(job, urls, chunk_size)
+        return job
+
+    def test_concurrent_claims_are_unique(self):
+        job = self.create_import_job(40, 2)
+
+        def claim_all(worker: int):
+            claimed = []
+            try:
+                while True:
+                    chunk = claim_chunk(f"worker-{worker}", 60)
+                    if chunk is None:
+                        return claimed
+                    claimed.append(chunk.id)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            claimed = [chunk_id for ids in executor.map(claim_all, range(4)) for chunk_id in ids]
+
+        self.assertEqual(len(claimed), 20)
+        self.assertEqual(len(set(claimed)), 20)
+        self.assertEqual(Job.objects.get(id=job.id).status, 'running')
+
+    def test_complete_finalizes_job(self):
+        job = self.create_import_job(3, 2)
+        for succeeded, failed, status in ((2, 0, 'succeeded'), (0, 1, 'failed')):
+            chunk = claim_chunk('worker', 60)
+            self.assertTrue(complete_chunk(chunk, 'worker', {
+                'succeeded': succeeded, 'failed': failed, 'status': status, 'result': {}}))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'partial_success')
+        self.assertEqual((job.processed, job.failed), (3, 1))
+
+    def test_expired_lease_is_requeued(self):
+        job = self.create_import_job(1, 1)
+        chunk = claim_chunk('worker-a', 60)
+        JobChunk.objects.filter(id=chunk.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(requeue_expired_chunks(), {'requeued': 1, 'failed': 0})
+        self.assertFalse(renew_lease(chunk.id, 'worker-a', 60))
+        reclaimed = claim_chunk('worker-b', 60)
+        self.assertEqual(reclaimed.id, chunk.id)
+        self.assertEqual(reclaimed.attempts, 2)
+        # 原节点的结果被丢弃
+        self.assertFalse(complete_chunk(chunk, 'worker-a', {'status': 'succeeded'}))
+
+        with mock.patch.dict(os.environ, {'WORKER_MAX_ATTEMPTS': '2'}):
+            JobChunk.objects.filter(id=chunk.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+            self.assertEqual(requeue_expired_chunks(), {'requeued': 0, 'failed': 1})
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite periodic task test")
+class PeriodicTaskLockTest(DatabaseTestCase):
+
+    def setUp(self):
+        TaskLock.objects.all().delete()
+
+    def test_only_lock_holder_runs(self):
+        calls = []
+        self.assertTrue(run_periodic_once('auto-retry', lambda: calls.append('a'), 60, owner='a'))
+        self.assertFalse(run_periodic_once('auto-retry', lambda: calls.append('b'), 60, owner='b'))
+        # 持有者每个周期续期，继续执行
+        self.assertTrue(run_periodic_once('auto-retry', lambda: calls.append('a'), 60, owner='a'))
+        self.assertEqual(calls, ['a', 'a'])
+
+        # 持有者两个周期没有续期后由其他进程接管
+        TaskLock.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(run_periodic_once('auto-retry', lambda: calls.append('b'), 60, owner='b'))
+        self.assertEqual(TaskLock.objects.get(name='periodic:auto-retry').owner, 'b')
+        # 不需要互斥的任务不加锁
+        self.assertTrue(run_periodic_once('webhooks', lambda: None, 5))
+        self.assertEqual(TaskLock.objects.count(), 1)
+
+    def test_background_tasks_can_be_disabled(self):
+        with mock.patch.dict(os.environ, {'BACKGROUND_TASKS_ENABLED': 'false'}), \
+                mock.patch('api.jobs.start_periodic_task') as start:
+            start_background_tasks()
+        start.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()